@@ -1,319 +1,325 @@
 import streamlit as st
-import pandas as pd
 from datetime import datetime, timedelta
-import random
-import sqlite3
 import os
+import json
+import uuid
+
+from nubodhi.api import Api, start_server
+from nubodhi.cache import HistoryCache
+from nubodhi.catalog import MealCatalog
+from nubodhi.backends import open_backend
+from nubodhi.cohort import backend_cohort_frame, cohort_names, cohort_summary, save_cohort
+from nubodhi.compact import compact_in_background
+from nubodhi.grocery import GroceryPlanner, format_quantity, to_csv
+from nubodhi.instrument import Recorder
+from nubodhi.gallery import PAGE_SIZES, PhotoIndex, date_order, entry_dates, entry_for_date, filter_positions, paginate
+from nubodhi.meals import meal_plan, meal_plans, plan_days
+from nubodhi.reminders import ReminderScheduler, SessionInbox, complete_snack, enroll_client, outbox, webhook
+from nubodhi.metrics import calculate_bmi, calculate_calories
+from nubodhi.rollups import load_rollups
+from nubodhi.service import UserDataService, default_user_data, history_size, user_data_from_profile
+from nubodhi.storage import change_seq
+from nubodhi.thumbnails import DerivativePool
+from nubodhi.timeseries import FREQUENCIES, METRICS, chart_frame, history_for
+from nubodhi.transfer import export_zip
+from nubodhi.uploads import store_upload, upload_generation
+from nubodhi.writebehind import WriteBehindQueue
+
+# Shared database for every session in this process, migrated on first use.
+# NUBODHI_BACKEND picks another storage backend (see nubodhi.backends), e.g.
+# sharded:data?shards=8 when several server processes write at once.
+# Duplicate daily rows left by old versions are compacted in the background.
+@st.cache_resource
+def get_database():
+    db = open_backend(os.environ.get('NUBODHI_BACKEND', 'nubodhi_data.db'))
+    compact_in_background(db)
+    return db
+
+# Optional write-behind mode (NUBODHI_WRITE_BEHIND=1): saves are queued and
+# group-committed by a background thread instead of blocking the page
+@st.cache_resource
+def get_write_queue():
+    if os.environ.get('NUBODHI_WRITE_BEHIND') != '1':
+        return None
+    recorder = get_recorder()
+    write_queue = WriteBehindQueue(
+        get_database(),
+        max_rows=int(os.environ.get('NUBODHI_WRITE_BATCH_ROWS', 200)),
+        max_delay_ms=int(os.environ.get('NUBODHI_WRITE_BATCH_MS', 50)),
+        max_pending=int(os.environ.get('NUBODHI_WRITE_QUEUE_MAX', 10000)),
+        recorder=recorder,
+    )
+    recorder.add_collector('write_queue', write_queue.stats)
+    return write_queue
+
+# History rows shared by all sessions, so re-opening a profile skips SQLite
+@st.cache_resource
+def get_history_cache():
+    return HistoryCache(max_rows=100000, ttl=300)
+
+# Timings and counters for the debug panel and metrics export. Optional
+# exports: NUBODHI_METRICS_FILE (Prometheus text, rewritten at most every
+# 10 s) and NUBODHI_METRICS_LOG (one JSON event per line)
+@st.cache_resource
+def get_recorder():
+    recorder = Recorder(log_path=os.environ.get('NUBODHI_METRICS_LOG'))
+    recorder.add_collector('history_cache', get_history_cache().stats)
+    return recorder
+
+# Saves and loads for every page, through the cache and the write queue
+@st.cache_resource
+def get_service():
+    return UserDataService(get_database(), get_history_cache(), get_write_queue(), get_recorder())
+
+# JSON sync API for mobile clients (nubodhi.api) in this process when
+# NUBODHI_API_PORT is set, so its saves share the history cache and the
+# write queue with the pages
+@st.cache_resource
+def get_api_server():
+    port = os.environ.get('NUBODHI_API_PORT')
+    if not port:
+        return None
+    return start_server(Api(get_service(), token=os.environ.get('NUBODHI_API_TOKEN')),
+                        os.environ.get('NUBODHI_API_HOST', '127.0.0.1'), int(port))
+
+# Latest exercise-snack reminder per client, for their sessions to show;
+# read from the database, so it works whichever process sent it
+@st.cache_resource
+def get_reminder_inbox():
+    return SessionInbox(get_database())
+
+# Exercise-snack reminders (nubodhi.reminders) need one scheduler per
+# database: a thread in this process with NUBODHI_REMINDERS=1 (set it on one
+# server process only), or `python -m nubodhi.reminders run`. Sessions in
+# every process show them through the inbox; they can also go to a push
+# gateway (NUBODHI_REMINDER_WEBHOOK, NUBODHI_REMINDER_TOKEN) or a JSON-lines
+# file (NUBODHI_REMINDER_OUTBOX)
+@st.cache_resource
+def get_reminder_scheduler():
+    if os.environ.get('NUBODHI_REMINDERS') != '1':
+        return None
+    scheduler = ReminderScheduler(get_database())
+    if os.environ.get('NUBODHI_REMINDER_WEBHOOK'):
+        scheduler.add_hook(webhook(os.environ['NUBODHI_REMINDER_WEBHOOK'], os.environ.get('NUBODHI_REMINDER_TOKEN')))
+    if os.environ.get('NUBODHI_REMINDER_OUTBOX'):
+        scheduler.add_hook(outbox(os.environ['NUBODHI_REMINDER_OUTBOX']))
+    scheduler.start()
+    get_recorder().add_collector('reminders', scheduler.stats)
+    return scheduler
+
+# Store an uploaded file, recording its size and how long the write took
+def save_upload(uploaded_file, kind):
+    with get_recorder().timer('upload', kind=kind) as event:
+        path = store_upload(get_database(), uploaded_file)
+        event['bytes'] = os.path.getsize(path)
+    return path
+
+# Background process pool that renders photo thumbnails and previews
+@st.cache_resource
+def get_derivative_pool():
+    return DerivativePool(root="uploads")
+
+# File existence and thumbnails for gallery photos, shared by all sessions
+@st.cache_resource
+def get_photo_index():
+    return PhotoIndex(root="uploads")
+
+# Show a progress photo as a derivative ('thumb' or 'medium'), with the
+# original on request. Falls back to the original (and queues a render) if
+# the derivative does not exist yet
+def show_photo(info, caption, key, size='thumb', width=200):
+    derived = info.derived[size]
+    if derived is None:
+        get_derivative_pool().submit(info.path)
+        st.image(info.path, caption=caption, width=width)
+        return
+    st.image(derived, caption=caption, width=width)
+    if st.checkbox("Show original", key=key):
+        st.image(info.path, caption=caption)
+
+# The four views of one photo entry in two columns
+def show_photo_entry(entry, key, size='thumb', width=200):
+    index = get_photo_index()
+    col1, col2 = st.columns(2)
+    for column, views in [(col1, [('front', "Front View"), ('side', "Side View")]),
+                          (col2, [('back', "Back View"), ('outfit', "Goal Outfit")])]:
+        with column:
+            for view, caption in views:
+                path = entry['photos'].get(view)
+                if not path:
+                    continue
+                info = index.lookup(path)
+                if info.exists:
+                    show_photo(info, caption, key=f"{key}_{view}", size=size, width=width)
+
+# Photo dates and positions, newest first. The user's change seq and the
+# entry count (queued saves are appended before they commit) identify the
+# history, so reruns skip the sort
+@st.cache_data(max_entries=256)
+def gallery_order(user_id, seq, count, _entries):
+    return date_order(_entries)
+
+# Newest-first, paginated gallery with a date filter and a compare mode;
+# only the visible page is built from the history and touches the photo index
+def show_photo_gallery(user_id, entries):
+    with get_database().connection() as conn:
+        get_photo_index().sync(upload_generation(conn))
+        seq = change_seq(conn, user_id)
+    order = gallery_order(user_id, seq, len(entries), entries)
+    mode = st.radio("Gallery view", ["Browse", "Compare two dates"], horizontal=True, key="gallery_mode")
+    if mode == "Compare two dates":
+        dates = entry_dates(order)
+        col1, col2 = st.columns(2)
+        for column, default, label in [(col1, len(dates) - 1, "Before"), (col2, 0, "After")]:
+            with column:
+                date = st.selectbox(label, dates, index=default, key=f"gallery_compare_{label}")
+                entry = entry_for_date(entries, order, date)
+                if entry:
+                    show_photo_entry(entry, key=f"compare_{label}", size='medium', width=300)
+        return
+    first = datetime.strptime(order[-1][0], "%Y-%m-%d").date()
+    last = datetime.strptime(order[0][0], "%Y-%m-%d").date()
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        date_range = st.date_input("Date range", value=(first, last), min_value=first, max_value=last,
+                                   key="gallery_range")
+    with col2:
+        page_size = st.selectbox("Per page", PAGE_SIZES, key="gallery_page_size")
+    # While a range is being picked the widget returns only its start
+    start, end = (list(date_range) + [last])[:2] if isinstance(date_range, (list, tuple)) else (date_range, last)
+    selected = filter_positions(order, start.isoformat(), end.isoformat())
+    if not selected:
+        st.write("No progress photos in this date range.")
+        return
+    pages = paginate(selected, 1, page_size)[1]
+    page = st.number_input(f"Page (of {pages})", 1, pages, 1, key="gallery_page") if pages > 1 else 1
+    visible, _ = paginate(selected, page, page_size)
+    for position, photo_entry in enumerate((entries[i] for i in visible), (page - 1) * page_size):
+        st.write(f"**Date:** {photo_entry['date']}")
+        show_photo_entry(photo_entry, key=f"photo_{photo_entry['date']}_{position}")
+        st.markdown("---")
+
+# Chart data for one metric. Histories only grow by appending, so the length
+# and last entry identify the data without hashing the whole list
+@st.cache_data(max_entries=512)
+def progress_chart(user_id, metric, freq, rolling_days, count, last_entry, _entries):
+    return chart_frame(_entries, metric, freq, rolling_days)
+
+# Metric picker and one line chart per chosen metric
+def show_progress_charts(user_id, user_data):
+    available = [metric for metric in METRICS if history_for(user_data, metric)]
+    if not available:
+        return
+    col1, col2, col3 = st.columns([3, 1, 1])
+    with col1:
+        metrics = st.multiselect("Metrics", available, format_func=lambda metric: METRICS[metric].label,
+                                 default=[metric for metric in ('weight', 'waist', 'mood') if metric in available])
+    with col2:
+        freq = st.selectbox("Resolution", list(FREQUENCIES))
+    with col3:
+        rolling_days = st.selectbox("Rolling average", [None, 7, 30],
+                                    format_func=lambda days: "Off" if days is None else f"{days} days")
+    for metric in metrics:
+        entries = history_for(user_data, metric)
+        frame = progress_chart(user_id, metric, freq, rolling_days, len(entries), entries[-1], entries)
+        if not frame.empty:
+            st.line_chart(frame)
+
+# Weekly or monthly averages, read from the rollup table (a few rows per
+# metric) rather than the raw history. `history_rows` is the session's
+# history size and `latest` the last entries of the summarized histories:
+# together they change on every save (re-saving a day keeps the size), so
+# reruns in between reuse the rows
+@st.cache_data(max_entries=512, ttl=300)
+def rollup_summary(user_id, period, history_rows, latest):
+    flush_pending_writes()
+    summary = {}
+    with get_database().connection(user_id) as conn:
+        for metric in ['mood', 'energy', 'sleep_hours', 'sleep_quality', 'waist', 'weight']:
+            for row in load_rollups(conn, user_id, metric, period, limit=8):
+                period_row = summary.setdefault(row['period_start'], {'Starting': row['period_start']})
+                period_row[METRICS[metric].label] = round(row['mean'], 1)
+    return [summary[start] for start in sorted(summary, reverse=True)]
+
+def show_rollup_summary(user_id):
+    period = st.radio("Summary by", ["week", "month"], horizontal=True, format_func=str.title, key="summary_period")
+    user_data = st.session_state.user_data
+    latest = [user_data[name][-1:] for name in ('weight_history', 'mood_log', 'body_measurements_history')]
+    rows = rollup_summary(user_id, period, history_size(user_data), latest)
+    if rows:
+        st.dataframe(rows, use_container_width=True)
+    else:
+        st.write("Nothing to summarize yet.")
 
-# Page configuration
-st.set_page_config(
-    page_title="Nu Bodhi - Indian Wellness App",
-    page_icon="🧘‍♀️",
-    layout="wide"
-)
-
-# Create uploads directory if it doesn't exist
-if not os.path.exists("uploads"):
-    os.makedirs("uploads")
-
-# Initialize database connection
-def init_db():
-    conn = sqlite3.connect('nubodhi_data.db', check_same_thread=False)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS user_data
-                 (user_id TEXT, data_type TEXT, date TEXT, value TEXT)''')
-    conn.commit()
-    return conn
+# Group a handler's writes: one transaction, or one queue batch in write-behind mode
+def db_writes(user_id):
+    return get_service().writes(user_id or None)
 
 # Initialize session state
 def initialize_session_state():
-    today = datetime.now().strftime("%Y-%m-%d")
-    conn = getattr(st.session_state, 'db_connection', None)
-    if conn is None:
-        st.session_state.db_connection = init_db()
-
     if 'user_data' not in st.session_state:
-        st.session_state.user_data = {
-            'user_id': '',
-            'name': '',
-            'age': 0,
-            'gender': '',
-            'height': 0,
-            'weight': 0,
-            'weight_history': [],
-            'body_measurements_history': [],
-            'mood_log': [],
-            'health_metrics': {
-                'biophotonic_scan': [],
-                'blood_work': [],
-                'body_composition': [],
-                'progress_photos': []
-            },
-            'daily_checklist': {
-                'date': today,
-                'items': {
-                    'trme_supplements': False,
-                    'exercise_snack': False,
-                    'healthy_drinks': False,
-                    'no_processed_food': False
-                },
-                'mood': 5,
-                'energy': 5,
-                'sleep_hours': 7.0,
-                'sleep_quality': 5,
-                'arms': 0,
-                'chest': 0,
-                'waist': 0,
-                'hips': 0,
-                'thighs': 0,
-                'calves': 0
-            },
-            'exercise_reminders': {
-                'last_reminder': None,
-                'completed_today': 0,
-                'target_daily': 4
-            },
-            'week_number': 1
-        }
-
-initialize_session_state()
+        st.session_state.user_data = default_user_data()
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex[:12]
 
-# Save data to database
+# Save data to database; joins the caller's transaction if one is open.
+# In write-behind mode returns a ticket whose wait() confirms the commit.
 def save_to_db(user_id, data_type, date, value):
     if not user_id:
         return  # Skip saving if no user ID is provided
-    conn = st.session_state.db_connection
-    c = conn.cursor()
-    # Convert value to string for storage
-    c.execute("INSERT INTO user_data (user_id, data_type, date, value) VALUES (?, ?, ?, ?)",
-              (user_id, data_type, date, str(value)))
-    conn.commit()
+    return get_service().save(user_id, data_type, date, value)
 
 # Load data from database
 def load_from_db(user_id, data_type):
     if not user_id:
         return []  # Return empty list if no user ID
-    conn = st.session_state.db_connection
-    c = conn.cursor()
-    c.execute("SELECT date, value FROM user_data WHERE user_id = ? AND data_type = ? ORDER BY date",
-              (user_id, data_type))
-    return c.fetchall()
+    return get_service().load(user_id, data_type)
 
-# Load all user data from database
+# Make queued writes visible before reading them back
+def flush_pending_writes():
+    get_service().flush()
+
+# Load all user data from database into session state, replacing the
+# previous client's (served from the shared cache when possible)
 def load_user_data(user_id):
     if not user_id:
         return
-
-    # Reset session state to defaults before loading new user data
-    today = datetime.now().strftime("%Y-%m-%d")
-    st.session_state.user_data.update({
-        'user_id': user_id,
-        'name': '',
-        'age': 0,
-        'gender': '',
-        'height': 0,
-        'weight': 0,
-        'weight_history': [],
-        'body_measurements_history': [],
-        'mood_log': [],
-        'health_metrics': {
-            'biophotonic_scan': [],
-            'blood_work': [],
-            'body_composition': [],
-            'progress_photos': []
-        },
-        'daily_checklist': {
-            'date': today,
-            'items': {
-                'trme_supplements': False,
-                'exercise_snack': False,
-                'healthy_drinks': False,
-                'no_processed_food': False
-            },
-            'mood': 5,
-            'energy': 5,
-            'sleep_hours': 7.0,
-            'sleep_quality': 5,
-            'arms': 0,
-            'chest': 0,
-            'waist': 0,
-            'hips': 0,
-            'thighs': 0,
-            'calves': 0
-        }
-    })
-
-    # Load personal info
-    personal_info = load_from_db(user_id, 'personal_info')
-    if personal_info:
-        latest_info = eval(personal_info[-1][1])  # Get the latest entry
-        st.session_state.user_data.update(latest_info)
-        st.session_state.user_data['user_id'] = user_id  # Ensure user_id is updated
-
-    # Load daily checklist (only the latest for current session)
-    daily_checklist = load_from_db(user_id, 'daily_checklist')
-    if daily_checklist and daily_checklist[-1][0] == datetime.now().strftime("%Y-%m-%d"):
-        st.session_state.user_data['daily_checklist'] = eval(daily_checklist[-1][1])
-
-    # Load historical data
-    mood_log = load_from_db(user_id, 'mood_log')
-    if mood_log:
-        st.session_state.user_data['mood_log'] = [
-            {'date': entry[0], **eval(entry[1])} for entry in mood_log
-        ]
-
-    body_measurements = load_from_db(user_id, 'body_measurements_history')
-    if body_measurements:
-        st.session_state.user_data['body_measurements_history'] = [
-            {'date': entry[0], 'measurements': eval(entry[1])} for entry in body_measurements
-        ]
-
-    biophotonic_scan = load_from_db(user_id, 'biophotonic_scan')
-    if biophotonic_scan:
-        st.session_state.user_data['health_metrics']['biophotonic_scan'] = [
-            {'date': entry[0], 'score': eval(entry[1])} for entry in biophotonic_scan
-        ]
-
-    blood_work = load_from_db(user_id, 'blood_work')
-    if blood_work:
-        st.session_state.user_data['health_metrics']['blood_work'] = [
-            {'date': entry[0], 'metrics': eval(entry[1]), 'report_file': eval(entry[1]).get('report_file')} for entry in blood_work
-        ]
-
-    body_composition = load_from_db(user_id, 'body_composition')
-    if body_composition:
-        st.session_state.user_data['health_metrics']['body_composition'] = [
-            {'date': entry[0], 'metrics': eval(entry[1]), 'report_file': eval(entry[1]).get('report_file')} for entry in body_composition
-        ]
-
-    progress_photos = load_from_db(user_id, 'progress_photos')
-    if progress_photos:
-        st.session_state.user_data['health_metrics']['progress_photos'] = [
-            {'date': entry[0], 'photos': eval(entry[1])} for entry in progress_photos
-        ]
-
-# Exercise reminder function
+    profile = get_service().profile(user_id)
+    st.session_state.user_data.update(user_data_from_profile(user_id, profile))
+    update_exercise_reminders(enroll_client(get_database(), user_id))
+
+# Copy the reminder state of the client into the session
+def update_exercise_reminders(state):
+    reminders = st.session_state.user_data['exercise_reminders']
+    for key in reminders:
+        reminders[key] = state[key]
+
+# Exercise reminder sent to the loaded client by the scheduler; stays in the
+# sidebar until marked done or dismissed. Every session of the client shows
+# it once; Done clears it for all of them
 def show_exercise_reminder():
-    now = datetime.now()
-    last_reminder = st.session_state.user_data['exercise_reminders']['last_reminder']
-    completed_today = st.session_state.user_data['exercise_reminders']['completed_today']
-
-    if now.hour < 7 or now.hour >= 21 or completed_today >= 4:
+    user_id = st.session_state.user_data['user_id']
+    if not user_id:
+        return False
+    reminder = get_reminder_inbox().take(user_id, st.session_state.session_id)
+    if reminder is not None:
+        st.session_state.exercise_reminder = reminder
+    reminder = st.session_state.get('exercise_reminder')
+    if reminder is None or reminder.user_id != user_id:
         return False
 
-    if last_reminder is None or (now - datetime.fromisoformat(last_reminder)).total_seconds() > 1800:
-        if random.random() < 0.3:
-            st.session_state.user_data['exercise_reminders']['last_reminder'] = now.isoformat()
-            return True
-    return False
-
-# BMI and Calorie Calculation with Error Handling
-def calculate_bmi(weight, height):
-    try:
-        return round((weight / ((height / 100) ** 2)), 2) if weight and height else 0
-    except ZeroDivisionError:
-        return 0
-
-def calculate_calories(age, gender, weight, height, activity_level):
-    if not all([age, weight, height, gender, activity_level]):
-        return 0
-    try:
-        bmr = 10 * weight + 6.25 * height - 5 * age + (5 if gender == "Male" else -161)
-        activity_multipliers = {"Sedentary": 1.2, "Lightly Active": 1.375, "Moderately Active": 1.55, "Very Active": 1.725}
-        return round(bmr * activity_multipliers[activity_level])
-    except (ZeroDivisionError, KeyError):
-        return 0
-
-# Extended Meal Plans
-vegetarian_meals = {
-    "Monday": {
-        "Breakfast": {"Meal": "Besan Cheela", "Ingredients": ["1 cup chickpea flour", "1/2 cup water", "1/2 tsp turmeric", "1 tsp cumin", "1 small onion (chopped)", "1 tomato (chopped)", "2 tbsp ghee"], "Recipe": "Mix ingredients into a batter, heat ghee in a pan, pour batter, cook 2-3 mins per side."},
-        "Lunch": {"Meal": "Leftover Cheela with Cucumber Raita", "Ingredients": ["Leftover cheela", "1 cup yogurt", "1 cucumber (grated)", "1/2 tsp cumin", "Salt to taste"], "Recipe": "Reheat cheela, mix yogurt, cucumber, cumin, and salt for raita. Serve together."},
-        "Dinner": {"Meal": "Dal Tadka with Jeera Rice", "Ingredients": ["1 cup red lentils", "2 tbsp ghee", "1 tsp cumin seeds", "1/2 tsp turmeric", "2 garlic cloves", "1 cup rice"], "Recipe": "Boil lentils with turmeric, fry cumin and garlic in ghee, mix. Cook rice with ghee and cumin."},
-        "Snack": {"Meal": "Roasted Makhana", "Ingredients": ["1 cup makhana", "1 tbsp ghee", "Salt, pepper to taste"], "Recipe": "Roast makhana in ghee with salt and pepper for 5 mins."}
-    },
-    "Tuesday": {
-        "Breakfast": {"Meal": "Stuffed Paratha", "Ingredients": ["2 cups whole wheat flour", "2 boiled potatoes (mashed)", "1 tbsp ghee", "1 tsp cumin"], "Recipe": "Knead dough, stuff with mashed potatoes and cumin, cook with ghee."},
-        "Lunch": {"Meal": "Dal with Leftover Rice", "Ingredients": ["Leftover dal", "Leftover rice", "1 tsp ghee"], "Recipe": "Reheat dal and rice with ghee in 5 mins."},
-        "Dinner": {"Meal": "Palak Paneer with Roti", "Ingredients": ["2 cups spinach", "200g paneer", "2 tbsp ghee", "1 tsp garlic", "1 tsp ginger", "1 cup whole wheat flour"], "Recipe": "Blend spinach, cook with ghee, garlic, ginger, add paneer. Make roti with flour and ghee."},
-        "Snack": {"Meal": "Roasted Peanuts", "Ingredients": ["1 cup peanuts", "1 tbsp ghee", "Salt to taste"], "Recipe": "Roast peanuts in ghee with salt for 5 mins."}
-    },
-    "Wednesday": {
-        "Breakfast": {"Meal": "Poha", "Ingredients": ["2 cups flattened rice", "1 tbsp ghee", "1 tsp mustard seeds", "1/2 tsp turmeric", "1/4 cup peanuts"], "Recipe": "Soak rice, heat ghee, add mustard seeds, turmeric, peanuts, mix."},
-        "Lunch": {"Meal": "Aloo Gobi with Roti", "Ingredients": ["2 potatoes", "1 cauliflower", "2 tbsp ghee", "1 tsp cumin", "1 cup whole wheat flour"], "Recipe": "Cook potatoes and cauliflower with ghee and cumin. Make roti with flour."},
-        "Dinner": {"Meal": "Chana Masala with Rice", "Ingredients": ["1 cup chickpeas", "2 tbsp ghee", "2 tomatoes", "1 tsp garam masala", "1 cup rice"], "Recipe": "Soak chickpeas, cook with ghee, tomatoes, spices. Serve with rice."},
-        "Snack": {"Meal": "Roasted Makhana", "Ingredients": ["1 cup makhana", "1 tbsp ghee", "Salt, pepper"], "Recipe": "Roast in ghee with salt and pepper for 5 mins."}
-    },
-    "Thursday": {
-        "Breakfast": {"Meal": "Leftover Chana Masala with Paratha", "Ingredients": ["Leftover chana masala", "1 cup whole wheat flour", "1 tbsp ghee"], "Recipe": "Reheat chana, make fresh paratha with flour and ghee."},
-        "Lunch": {"Meal": "Palak Paneer with Rice", "Ingredients": ["Leftover palak paneer", "1 cup rice", "1 tsp ghee"], "Recipe": "Reheat palak paneer, cook fresh rice with ghee."},
-        "Dinner": {"Meal": "Rajma with Jeera Rice", "Ingredients": ["1 cup kidney beans", "2 tbsp ghee", "1 tsp cumin", "1 cup rice"], "Recipe": "Cook beans with ghee and spices, serve with cumin rice."},
-        "Snack": {"Meal": "Cucumber Slices with Chaat Masala", "Ingredients": ["1 cucumber", "1 tsp chaat masala"], "Recipe": "Slice cucumber, sprinkle chaat masala."}
-    },
-    "Friday": {
-        "Breakfast": {"Meal": "Vegetable Upma", "Ingredients": ["1 cup semolina", "1 tbsp ghee", "1/4 cup mixed veggies (carrot, peas)"], "Recipe": "Roast semolina, add ghee, veggies, cook 15 mins."},
-        "Lunch": {"Meal": "Aloo Gobi with Roti", "Ingredients": ["Leftover aloo gobi", "1 cup whole wheat flour", "1 tbsp ghee"], "Recipe": "Reheat aloo gobi, make fresh roti."},
-        "Dinner": {"Meal": "Baingan Bharta with Roti", "Ingredients": ["1 large eggplant", "2 tbsp ghee", "2 tomatoes", "1 cup whole wheat flour"], "Recipe": "Roast eggplant, mash with ghee and tomatoes. Make roti."},
-        "Snack": {"Meal": "Roasted Peanuts", "Ingredients": ["1 cup peanuts", "1 tbsp ghee", "Salt"], "Recipe": "Roast in ghee with salt for 5 mins."}
-    },
-    "Saturday": {
-        "Breakfast": {"Meal": "Besan Cheela", "Ingredients": ["1 cup chickpea flour", "1/2 cup water", "1/2 tsp turmeric", "1 tsp cumin", "2 tbsp ghee"], "Recipe": "Mix, cook in ghee, 2-3 mins per side."},
-        "Lunch": {"Meal": "Rajma with Rice", "Ingredients": ["Leftover rajma", "1 cup rice", "1 tsp ghee"], "Recipe": "Reheat rajma, cook fresh rice with ghee."},
-        "Dinner": {"Meal": "Mixed Veg Curry with Roti", "Ingredients": ["1 cup mixed veggies", "2 tbsp ghee", "1 tsp spices", "1 cup whole wheat flour"], "Recipe": "Cook veggies with ghee and spices, make roti."},
-        "Snack": {"Meal": "Roasted Makhana", "Ingredients": ["1 cup makhana", "1 tbsp ghee", "Salt, pepper"], "Recipe": "Roast in ghee with salt and pepper for 5 mins."}
-    },
-    "Sunday": {
-        "Breakfast": {"Meal": "Poha", "Ingredients": ["2 cups flattened rice", "1 tbsp ghee", "1 tsp mustard seeds", "1/2 tsp turmeric"], "Recipe": "Soak rice, cook with ghee, mustard, turmeric."},
-        "Lunch": {"Meal": "Mixed Veg Curry with Rice", "Ingredients": ["Leftover mixed veg curry", "1 cup rice", "1 tsp ghee"], "Recipe": "Reheat curry, cook fresh rice with ghee."},
-        "Dinner": {"Meal": "Paneer Tikka with Sautéed Spinach", "Ingredients": ["200g paneer", "1 tbsp yogurt", "2 tbsp ghee", "2 cups spinach", "1 tsp spices"], "Recipe": "Marinate paneer with yogurt, cook in ghee, sauté spinach."},
-        "Snack": {"Meal": "Cucumber Slices", "Ingredients": ["1 cucumber"], "Recipe": "Slice and serve."}
-    }
-}
-
-meat_meals = {
-    "Monday": {
-        "Breakfast": {"Meal": "Chicken Masala Omelette", "Ingredients": ["2 eggs", "100g shredded chicken", "1 tbsp ghee", "1/2 tsp turmeric"], "Recipe": "Mix eggs, chicken, spices, cook in ghee."},
-        "Lunch": {"Meal": "Chicken Curry with Cauliflower Rice", "Ingredients": ["200g chicken", "1 tbsp coconut oil", "1 tsp garlic", "1 cup cauliflower"], "Recipe": "Cook chicken with spices and oil, sauté cauliflower."},
-        "Dinner": {"Meal": "Mutton Keema with Roti", "Ingredients": ["200g mutton mince", "2 tbsp ghee", "1 tsp garlic", "1 cup whole wheat flour"], "Recipe": "Cook mince with ghee and spices, make roti."},
-        "Snack": {"Meal": "Tandoori Chicken Bites", "Ingredients": ["200g chicken", "1 tbsp yogurt", "1 tbsp ghee", "1 tsp tandoori spices"], "Recipe": "Marinate, cook in ghee or oven."}
-    },
-    "Tuesday": {
-        "Breakfast": {"Meal": "Leftover Chicken Omelette Mix", "Ingredients": ["Leftover chicken mix", "2 eggs", "1 tsp ghee"], "Recipe": "Fry with fresh eggs and ghee."},
-        "Lunch": {"Meal": "Chicken Curry with Rice", "Ingredients": ["Leftover chicken curry", "1 cup rice", "1 tsp ghee"], "Recipe": "Reheat curry, cook fresh rice with ghee."},
-        "Dinner": {"Meal": "Palak Chicken with Roti", "Ingredients": ["Leftover chicken", "2 cups spinach", "2 tbsp ghee", "1 cup whole wheat flour"], "Recipe": "Cook spinach with ghee, add chicken, make roti."},
-        "Snack": {"Meal": "Roasted Almonds", "Ingredients": ["1 cup almonds", "1 tbsp ghee", "Salt"], "Recipe": "Roast in ghee with salt for 5 mins."}
-    },
-    "Wednesday": {
-        "Breakfast": {"Meal": "Egg Bhurji with Chicken", "Ingredients": ["2 eggs", "Leftover chicken", "1 tbsp ghee", "1/2 tsp cumin"], "Recipe": "Scramble eggs with chicken and cumin in ghee."},
-        "Lunch": {"Meal": "Mutton Keema with Cauliflower Rice", "Ingredients": ["Leftover mutton keema", "1 cup cauliflower", "1 tbsp ghee"], "Recipe": "Reheat keema, sauté cauliflower with ghee."},
-        "Dinner": {"Meal": "Chicken Tikka with Sautéed Greens", "Ingredients": ["200g chicken", "1 tbsp yogurt", "2 tbsp ghee", "2 cups spinach"], "Recipe": "Marinate chicken, cook in ghee, sauté greens."},
-        "Snack": {"Meal": "Tandoori Bites", "Ingredients": ["Leftover tandoori chicken", "1 tbsp ghee"], "Recipe": "Reheat or eat cold."}
-    },
-    "Thursday": {
-        "Breakfast": {"Meal": "Mutton Omelette", "Ingredients": ["2 eggs", "Leftover mutton keema", "1 tbsp ghee"], "Recipe": "Mix eggs with keema, cook in ghee."},
-        "Lunch": {"Meal": "Palak Chicken with Rice", "Ingredients": ["Leftover palak chicken", "1 cup rice", "1 tsp ghee"], "Recipe": "Reheat, cook fresh rice with ghee."},
-        "Dinner": {"Meal": "Fish Curry with Cauliflower Rice", "Ingredients": ["200g fish", "1 tbsp coconut oil", "1 cup cauliflower", "1 tsp turmeric"], "Recipe": "Cook fish with oil and spices, sauté cauliflower."},
-        "Snack": {"Meal": "Roasted Almonds", "Ingredients": ["1 cup almonds", "1 tbsp ghee", "Salt"], "Recipe": "Roast in ghee with salt for 5 mins."}
-    },
-    "Friday": {
-        "Breakfast": {"Meal": "Chicken Tikka Omelette", "Ingredients": ["2 eggs", "Leftover chicken tikka", "1 tbsp ghee"], "Recipe": "Fry eggs with tikka in ghee."},
-        "Lunch": {"Meal": "Fish Curry with Rice", "Ingredients": ["Leftover fish curry", "1 cup rice", "1 tsp ghee"], "Recipe": "Reheat curry, cook fresh rice with ghee."},
-        "Dinner": {"Meal": "Mutton Rogan Josh with Greens", "Ingredients": ["200g mutton", "2 tbsp ghee", "1 tbsp yogurt", "2 cups methi"], "Recipe": "Cook mutton with ghee and yogurt, sauté greens."},
-        "Snack": {"Meal": "Tandoori Bites", "Ingredients": ["Leftover tandoori chicken", "1 tbsp ghee"], "Recipe": "Reheat or eat cold."}
-    },
-    "Saturday": {
-        "Breakfast": {"Meal": "Egg Bhurji", "Ingredients": ["2 eggs", "1 tbsp ghee", "1/2 tsp cumin"], "Recipe": "Scramble eggs with ghee and cumin."},
-        "Lunch": {"Meal": "Chicken Tikka with Cauliflower Rice", "Ingredients": ["Leftover chicken tikka", "1 cup cauliflower", "1 tbsp ghee"], "Recipe": "Reheat tikka, sauté cauliflower with ghee."},
-        "Dinner": {"Meal": "Butter Chicken with Rice", "Ingredients": ["200g chicken", "2 tbsp ghee", "1 cup cream", "1 cup rice"], "Recipe": "Cook chicken with ghee and cream, serve with rice."},
-        "Snack": {"Meal": "Roasted Almonds", "Ingredients": ["1 cup almonds", "1 tbsp ghee", "Salt"], "Recipe": "Roast in ghee with salt for 5 mins."}
-    },
-    "Sunday": {
-        "Breakfast": {"Meal": "Chicken Masala Omelette", "Ingredients": ["2 eggs", "100g chicken", "1 tbsp ghee", "1/2 tsp turmeric"], "Recipe": "Mix eggs, chicken, spices, cook in ghee."},
-        "Lunch": {"Meal": "Mutton Rogan Josh with Roti", "Ingredients": ["Leftover mutton rogan josh", "1 cup whole wheat flour", "1 tsp ghee"], "Recipe": "Reheat mutton, make fresh roti."},
-        "Dinner": {"Meal": "Fish Tikka with Sautéed Spinach", "Ingredients": ["200g fish", "1 tbsp yogurt", "1 tbsp ghee", "2 cups spinach"], "Recipe": "Marinate fish, cook in ghee, sauté spinach."},
-        "Snack": {"Meal": "Tandoori Bites", "Ingredients": ["Leftover tandoori chicken", "1 tbsp ghee"], "Recipe": "Reheat or eat cold."}
-    }
-}
+    reminders = st.session_state.user_data['exercise_reminders']
+    st.sidebar.info(f"🏃 Time for an exercise snack! ({reminders['completed_today']} of "
+                    f"{reminders['target_daily']} done today)")
+    done, later = st.sidebar.columns(2)
+    if done.button("Done", key="exercise_reminder_done"):
+        update_exercise_reminders(complete_snack(get_database(), user_id))
+        st.session_state.exercise_reminder = None
+        st.experimental_rerun()
+    if later.button("Later", key="exercise_reminder_later"):
+        st.session_state.exercise_reminder = None
+        st.experimental_rerun()
+    return True
 
 def welcome_page():
     # Custom CSS to shrink the logo by 50% on desktop while keeping it full-width on mobile
@@ -363,18 +369,86 @@ def welcome_page():
     **NuBodhi is about better food, better sleep, better movement, and better supplements for a better you!**
     """)
 
+# Meal plans indexed for search, built once per process
+@st.cache_resource
+def get_meal_catalog():
+    return MealCatalog(meal_plans())
+
+# Shopping lists for the meal plans, memoized per diet and day range
+@st.cache_resource
+def get_grocery_planner():
+    return GroceryPlanner(meal_plans())
+
 def meals_page():
     st.markdown("<h2 style='text-align: center;'>🍱 Meals</h2>", unsafe_allow_html=True)
-    diet = st.selectbox("Select Diet", ["Vegetarian", "Meat-Eater"])
-    day = st.selectbox("Select Day", list(vegetarian_meals.keys()))
-    
-    meals = vegetarian_meals if diet == "Vegetarian" else meat_meals
-    st.write(f"### Meal Plan for {day} ({diet})")
-    for meal_type, details in meals[day].items():
-        st.write(f"**{meal_type}:** {details['Meal']}")
+    plan_tab, search_tab = st.tabs(["Weekly Plan", "Search Recipes"])
+    with plan_tab:
+        diet = st.selectbox("Select Diet", ["Vegetarian", "Meat-Eater"])
+        day = st.selectbox("Select Day", plan_days())
+
+        meals = meal_plan(diet)
+        st.write(f"### Meal Plan for {day} ({diet})")
+        for meal_type, details in meals[day].items():
+            st.write(f"**{meal_type}:** {details['Meal']}")
+            st.write("**Ingredients:**", ", ".join(details['Ingredients']))
+            st.write("**Recipe:**", details['Recipe'])
+        show_shopping_list(diet)
+    with search_tab:
+        show_meal_search()
+
+# Consolidated shopping list for a range of days of one plan
+def show_shopping_list(diet):
+    st.write("### 🛒 Shopping List")
+    days = plan_days()
+    first, last = st.select_slider("Days", options=days, value=(days[0], days[-1]), key="shopping_days")
+    items, leftovers = get_grocery_planner().shopping_list(diet, first, last)
+    st.dataframe([{'Item': item.item, 'Quantity': format_quantity(item), 'Used in meals': item.meals}
+                  for item in items], use_container_width=True)
+    if leftovers:
+        st.write("**Already covered by leftovers:**", ", ".join(leftovers))
+    st.download_button("Download shopping list (CSV)", to_csv(items),
+                       file_name=f"shopping_list_{diet.lower()}_{first}-{last}.csv".replace(' ', '_'),
+                       mime="text/csv")
+
+# Search every plan by dish, ingredient or recipe text
+def show_meal_search():
+    catalog = get_meal_catalog()
+    text = st.text_input("Search dishes, ingredients or recipes", placeholder="e.g. chickpeas", key="meal_search")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        diet = st.selectbox("Diet", ["Any"] + catalog.diets, key="meal_search_diet")
+        ingredient = st.text_input("Must contain ingredient", placeholder="e.g. paneer", key="meal_search_ingredient")
+    with col2:
+        meal_type = st.selectbox("Meal", ["Any"] + catalog.meal_types, key="meal_search_type")
+        leftovers = st.selectbox("Leftovers", ["Any", "Uses leftovers", "Freshly cooked"], key="meal_search_leftovers")
+    with col3:
+        exclude_meat = st.checkbox("No meat or fish", key="meal_search_no_meat")
+        exclude_egg = st.checkbox("No eggs", key="meal_search_no_egg")
+    results = catalog.search(
+        text, ingredient,
+        diet=None if diet == "Any" else diet,
+        meal_type=None if meal_type == "Any" else meal_type,
+        exclude_meat=exclude_meat, exclude_egg=exclude_egg,
+        leftovers={"Any": None, "Uses leftovers": True, "Freshly cooked": False}[leftovers],
+    )
+    st.write(f"{len(results)} meals found")
+    for details in results:
+        st.write(f"**{details['Meal']}** · {details['diet']}, {details['day']} {details['meal_type']}")
         st.write("**Ingredients:**", ", ".join(details['Ingredients']))
         st.write("**Recipe:**", details['Recipe'])
 
+# Zip of the user's full history (one CSV per data type), built on request
+# so reruns don't re-read every table
+def show_data_export(user_id):
+    if st.button("Prepare data export", key="prepare_export"):
+        flush_pending_writes()
+        with get_database().connection(user_id) as conn:
+            st.session_state.data_export = (user_id, export_zip(conn, [user_id]))
+    export = st.session_state.get('data_export')
+    if export and export[0] == user_id:
+        st.download_button("Download my data (ZIP of CSVs)", export[1], file_name=f"nubodhi_{user_id}.zip",
+                           mime="application/zip", key="download_export")
+
 def tracking_page():
     st.markdown("<h2 style='text-align: center;'>📊 Tracking</h2>", unsafe_allow_html=True)
 
@@ -390,6 +464,8 @@ def tracking_page():
         st.write(f"Data loaded for user ID: {user_id}")
     else:
         st.write("Enter your user ID to load your data or start fresh.")
+    if user_id:
+        show_data_export(user_id)
 
     st.write("### Enter or Update Your Personal Information")
 
@@ -398,17 +474,20 @@ def tracking_page():
     default_height = st.session_state.user_data['height'] if st.session_state.user_data['height'] >= 100 else 100
     default_weight = st.session_state.user_data['weight'] if st.session_state.user_data['weight'] >= 30 else 30
 
-    col1, col2 = st.columns(2)
-    with col1:
-        name = st.text_input("Name", st.session_state.user_data['name'], key="name_input")
-        age = st.number_input("Age", min_value=18, max_value=100, value=default_age, key="age_input")
-    with col2:
-        gender = st.selectbox("Gender", ["Male", "Female"], index=0 if st.session_state.user_data['gender'] == "Male" else 1 if st.session_state.user_data['gender'] == "Female" else 0, key="gender_input")
-        height = st.number_input("Height (cm)", min_value=100, max_value=250, value=default_height, key="height_input")
-        weight = st.number_input("Weight (kg)", min_value=30, max_value=200, value=default_weight, key="weight_input")
-    activity = st.selectbox("Activity Level", ["Sedentary", "Lightly Active", "Moderately Active", "Very Active"],
-                          index=["Sedentary", "Lightly Active", "Moderately Active", "Very Active"].index(st.session_state.user_data.get('activity', 'Sedentary')), key="activity_input")
-    if st.button("Save Personal Info"):
+    # A form: editing the fields does not rerun the page until it is saved
+    with st.form("personal_info_form"):
+        col1, col2 = st.columns(2)
+        with col1:
+            name = st.text_input("Name", st.session_state.user_data['name'], key="name_input")
+            age = st.number_input("Age", min_value=18, max_value=100, value=default_age, key="age_input")
+        with col2:
+            gender = st.selectbox("Gender", ["Male", "Female"], index=0 if st.session_state.user_data['gender'] == "Male" else 1 if st.session_state.user_data['gender'] == "Female" else 0, key="gender_input")
+            height = st.number_input("Height (cm)", min_value=100, max_value=250, value=default_height, key="height_input")
+            weight = st.number_input("Weight (kg)", min_value=30, max_value=200, value=default_weight, key="weight_input")
+        activity = st.selectbox("Activity Level", ["Sedentary", "Lightly Active", "Moderately Active", "Very Active"],
+                              index=["Sedentary", "Lightly Active", "Moderately Active", "Very Active"].index(st.session_state.user_data.get('activity', 'Sedentary')), key="activity_input")
+        save_personal_info = st.form_submit_button("Save Personal Info")
+    if save_personal_info:
         updated_data = {
             'user_id': user_id,
             'name': name,
@@ -418,9 +497,13 @@ def tracking_page():
             'weight': weight,
             'activity': activity
         }
+        today = datetime.now().strftime("%Y-%m-%d")
         st.session_state.user_data.update(updated_data)
+        # One personal-info row per day: saving again replaces today's weight
+        st.session_state.user_data['weight_history'] = [
+            entry for entry in st.session_state.user_data['weight_history'] if entry[0] != today] + [(today, weight)]
         # Save personal info to database
-        save_to_db(user_id, 'personal_info', datetime.now().strftime("%Y-%m-%d"), updated_data)
+        save_to_db(user_id, 'personal_info', today, updated_data)
         st.success("Personal info saved!")
 
     # BMI and Calorie Display (only after personal info is saved)
@@ -437,24 +520,27 @@ def tracking_page():
 
     # Daily Tracking with Measurements
     st.write("### Daily Updates")
-    col1, col2, col3 = st.columns([2, 2, 1])  # Adjusted columns to accommodate measurements
-    with col1:
-        mood = st.slider("Mood (1-10)", 1, 10, st.session_state.user_data['daily_checklist']['mood'],
-                        help="1: Deflated, 5: Neutral, 10: Optimistic")
-        energy = st.slider("Energy (1-10)", 1, 10, st.session_state.user_data['daily_checklist']['energy'],
-                          help="1: Exhausted, 10: Energetic")
-    with col2:
-        sleep_hours = st.number_input("Hours of Sleep", 0.0, 24.0, st.session_state.user_data['daily_checklist']['sleep_hours'], 0.5)
-        sleep_quality = st.slider("Sleep Quality (1-10)", 1, 10, st.session_state.user_data['daily_checklist']['sleep_quality'],
-                                 help="1: Poor, 10: Excellent")
-    with col3:
-        arms = st.number_input("Arms (cm)", min_value=0, max_value=100, value=st.session_state.user_data['daily_checklist']['arms'])
-        chest = st.number_input("Chest (cm)", min_value=0, max_value=200, value=st.session_state.user_data['daily_checklist']['chest'])
-        waist = st.number_input("Waist (cm)", min_value=0, max_value=200, value=st.session_state.user_data['daily_checklist']['waist'])
-        hips = st.number_input("Hips (cm)", min_value=0, max_value=200, value=st.session_state.user_data['daily_checklist']['hips'])
-        thighs = st.number_input("Thighs (cm)", min_value=0, max_value=100, value=st.session_state.user_data['daily_checklist']['thighs'])
-        calves = st.number_input("Calves (cm)", min_value=0, max_value=100, value=st.session_state.user_data['daily_checklist']['calves'])
-    if st.button("Save Daily Data"):
+    # One form for the whole check-in: sliders and measurements submit together
+    with st.form("daily_updates_form"):
+        col1, col2, col3 = st.columns([2, 2, 1])  # Adjusted columns to accommodate measurements
+        with col1:
+            mood = st.slider("Mood (1-10)", 1, 10, st.session_state.user_data['daily_checklist']['mood'],
+                            help="1: Deflated, 5: Neutral, 10: Optimistic")
+            energy = st.slider("Energy (1-10)", 1, 10, st.session_state.user_data['daily_checklist']['energy'],
+                              help="1: Exhausted, 10: Energetic")
+        with col2:
+            sleep_hours = st.number_input("Hours of Sleep", 0.0, 24.0, st.session_state.user_data['daily_checklist']['sleep_hours'], 0.5)
+            sleep_quality = st.slider("Sleep Quality (1-10)", 1, 10, st.session_state.user_data['daily_checklist']['sleep_quality'],
+                                     help="1: Poor, 10: Excellent")
+        with col3:
+            arms = st.number_input("Arms (cm)", min_value=0, max_value=100, value=st.session_state.user_data['daily_checklist']['arms'])
+            chest = st.number_input("Chest (cm)", min_value=0, max_value=200, value=st.session_state.user_data['daily_checklist']['chest'])
+            waist = st.number_input("Waist (cm)", min_value=0, max_value=200, value=st.session_state.user_data['daily_checklist']['waist'])
+            hips = st.number_input("Hips (cm)", min_value=0, max_value=200, value=st.session_state.user_data['daily_checklist']['hips'])
+            thighs = st.number_input("Thighs (cm)", min_value=0, max_value=100, value=st.session_state.user_data['daily_checklist']['thighs'])
+            calves = st.number_input("Calves (cm)", min_value=0, max_value=100, value=st.session_state.user_data['daily_checklist']['calves'])
+        save_daily = st.form_submit_button("Save Daily Data")
+    if save_daily:
         st.session_state.user_data['daily_checklist']['mood'] = mood
         st.session_state.user_data['daily_checklist']['energy'] = energy
         st.session_state.user_data['daily_checklist']['sleep_hours'] = sleep_hours
@@ -477,22 +563,25 @@ def tracking_page():
             'date': st.session_state.user_data['daily_checklist']['date'],
             'measurements': {'arms': arms, 'chest': chest, 'waist': waist, 'hips': hips, 'thighs': thighs, 'calves': calves}
         })
-        # Save daily data to database
-        save_to_db(user_id, 'daily_checklist', st.session_state.user_data['daily_checklist']['date'], st.session_state.user_data['daily_checklist'])
-        save_to_db(user_id, 'mood_log', st.session_state.user_data['daily_checklist']['date'], {
-            'mood': mood,
-            'energy': energy,
-            'sleep_hours': sleep_hours,
-            'sleep_quality': sleep_quality
-        })
-        save_to_db(user_id, 'body_measurements_history', st.session_state.user_data['daily_checklist']['date'], {
-            'measurements': {'arms': arms, 'chest': chest, 'waist': waist, 'hips': hips, 'thighs': thighs, 'calves': calves}
-        })
+        # Save daily data to database in a single transaction
+        with db_writes(user_id):
+            save_to_db(user_id, 'daily_checklist', st.session_state.user_data['daily_checklist']['date'], st.session_state.user_data['daily_checklist'])
+            save_to_db(user_id, 'mood_log', st.session_state.user_data['daily_checklist']['date'], {
+                'mood': mood,
+                'energy': energy,
+                'sleep_hours': sleep_hours,
+                'sleep_quality': sleep_quality
+            })
+            save_to_db(user_id, 'body_measurements_history', st.session_state.user_data['daily_checklist']['date'], {
+                'measurements': {'arms': arms, 'chest': chest, 'waist': waist, 'hips': hips, 'thighs': thighs, 'calves': calves}
+            })
         st.success("Daily data saved!")
 
     # Biometric Data
     st.write("### Biometric Data")
-    if st.button("Log Blood Work"):
+    # Each log is a form in an expander, so filling it in (or attaching a
+    # file) does not rerun the page until it is saved
+    with st.expander("Log Blood Work"), st.form("blood_work_form", clear_on_submit=True):
         uploaded_file = st.file_uploader("Upload Blood Work Photo (PNG/JPG/PDF)", type=['png', 'jpg', 'jpeg', 'pdf'], key="blood")
         col1, col2 = st.columns(2)
         with col1:
@@ -500,7 +589,7 @@ def tracking_page():
             blood_sugar = st.number_input("Blood Sugar (mg/dL)", 0, 500)
         with col2:
             hemoglobin = st.number_input("Hemoglobin (g/dL)", 0.0, 30.0)
-        if st.button("Save Blood Work"):
+        if st.form_submit_button("Save Blood Work"):
             report_data = {
                 'date': datetime.now().strftime("%Y-%m-%d"),
                 'metrics': {
@@ -510,19 +599,16 @@ def tracking_page():
                 }
             }
             if uploaded_file:
-                # Save the file to the uploads folder
-                file_path = os.path.join("uploads", f"{user_id}_{uploaded_file.name}")
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                report_data['report_file'] = file_path
+                # Stream the file into the content-addressed upload store
+                report_data['report_file'] = save_upload(uploaded_file, 'blood_work')
             st.session_state.user_data['health_metrics']['blood_work'].append(report_data)
             # Save to database
             save_to_db(user_id, 'blood_work', report_data['date'], report_data)
             st.success("Blood work saved!")
 
-    if st.button("Log Biophotonic Scan"):
+    with st.expander("Log Biophotonic Scan"), st.form("biophotonic_scan_form", clear_on_submit=True):
         scan_score = st.number_input("Biophotonic Scan Score (10,000-100,000)", 10000, 100000)
-        if st.button("Save Scan Score"):
+        if st.form_submit_button("Save Scan Score"):
             scan_data = {
                 'date': datetime.now().strftime("%Y-%m-%d"),
                 'score': scan_score
@@ -532,24 +618,21 @@ def tracking_page():
             save_to_db(user_id, 'biophotonic_scan', scan_data['date'], scan_score)
             st.success("Scan score saved!")
 
-    if st.button("Log Body Composition"):
+    with st.expander("Log Body Composition"), st.form("body_composition_form", clear_on_submit=True):
         uploaded_file = st.file_uploader("Upload Body Composition Results", type=['pdf'], key="composition")
         col1, col2 = st.columns(2)
         with col1:
             body_fat = st.number_input("Body Fat %", 0.0, 100.0)
         with col2:
             muscle_mass = st.number_input("Muscle Mass (kg)", 0.0, 100.0)
-        if st.button("Save Body Composition"):
+        if st.form_submit_button("Save Body Composition"):
             composition_data = {
                 'date': datetime.now().strftime("%Y-%m-%d"),
                 'metrics': {'body_fat': body_fat, 'muscle_mass': muscle_mass}
             }
             if uploaded_file:
-                # Save the file to the uploads folder
-                file_path = os.path.join("uploads", f"{user_id}_{uploaded_file.name}")
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-                composition_data['report_file'] = file_path
+                # Stream the file into the content-addressed upload store
+                composition_data['report_file'] = save_upload(uploaded_file, 'body_composition')
             st.session_state.user_data['health_metrics']['body_composition'].append(composition_data)
             # Save to database
             save_to_db(user_id, 'body_composition', composition_data['date'], composition_data)
@@ -557,28 +640,31 @@ def tracking_page():
 
     # Photo Upload Subsection with Instructions
     st.write("### Upload Progress Photos")
-    col1, col2 = st.columns(2)
-    with col1:
-        front_photo = st.file_uploader("Front View Photo", type=['png', 'jpg', 'jpeg'], key="front")
-        side_photo = st.file_uploader("Side View Photo", type=['png', 'jpg', 'jpeg'], key="side")
-    with col2:
-        back_photo = st.file_uploader("Back View Photo", type=['png', 'jpg', 'jpeg'], key="back")
-        outfit_photo = st.file_uploader("Goal Outfit Photo", type=['png', 'jpg', 'jpeg'], key="outfit")
-    st.markdown("""
-    #### Before Photo Guidelines
-    - Use **clear, natural lighting** that can be replicated for your "after" photo.
-    - Wear **tight-fitting clothing** you can wear again for consistency.
-    - Maintain the **same pose** (e.g., standing straight, arms slightly away) for front, side, and back views.
-    #### Goal Photo Explanation
-    - Capture a photo wearing a **special outfit** that either fits poorly now or, if too small, hold it against yourself to demonstrate the current fit.
-    - The goal is to wear and fit well in this outfit in a few months for a powerful "after" photo.
-    """)
-    if st.button("Save Progress Photos"):
+    # Uploads are held by the form and sent together on save
+    with st.form("progress_photos_form", clear_on_submit=True):
+        col1, col2 = st.columns(2)
+        with col1:
+            front_photo = st.file_uploader("Front View Photo", type=['png', 'jpg', 'jpeg'], key="front")
+            side_photo = st.file_uploader("Side View Photo", type=['png', 'jpg', 'jpeg'], key="side")
+        with col2:
+            back_photo = st.file_uploader("Back View Photo", type=['png', 'jpg', 'jpeg'], key="back")
+            outfit_photo = st.file_uploader("Goal Outfit Photo", type=['png', 'jpg', 'jpeg'], key="outfit")
+        st.markdown("""
+        #### Before Photo Guidelines
+        - Use **clear, natural lighting** that can be replicated for your "after" photo.
+        - Wear **tight-fitting clothing** you can wear again for consistency.
+        - Maintain the **same pose** (e.g., standing straight, arms slightly away) for front, side, and back views.
+        #### Goal Photo Explanation
+        - Capture a photo wearing a **special outfit** that either fits poorly now or, if too small, hold it against yourself to demonstrate the current fit.
+        - The goal is to wear and fit well in this outfit in a few months for a powerful "after" photo.
+        """)
+        save_photos = st.form_submit_button("Save Progress Photos")
+    if save_photos:
         photos = {
             'date': datetime.now().strftime("%Y-%m-%d"),
             'photos': {}
         }
-        # Save each uploaded image to the uploads folder
+        # Stream each uploaded image into the content-addressed upload store
         for photo_type, photo in [
             ('front', front_photo),
             ('side', side_photo),
@@ -586,10 +672,9 @@ def tracking_page():
             ('outfit', outfit_photo)
         ]:
             if photo:
-                file_path = os.path.join("uploads", f"{user_id}_{photo_type}_{photo.name}")
-                with open(file_path, "wb") as f:
-                    f.write(photo.getbuffer())
-                photos['photos'][photo_type] = file_path
+                photos['photos'][photo_type] = save_upload(photo, 'progress_photo')
+                # Thumbnails are rendered off the request path
+                get_derivative_pool().submit(photos['photos'][photo_type])
             else:
                 photos['photos'][photo_type] = None
         st.session_state.user_data['health_metrics']['progress_photos'].append(photos)
@@ -597,40 +682,24 @@ def tracking_page():
         save_to_db(user_id, 'progress_photos', photos['date'], photos)
         st.success("Progress photos saved!")
 
-    # Display previously uploaded progress photos
+    # Display previously uploaded progress photos. The heavy sections are
+    # timed separately (see the debug panel)
+    recorder = get_recorder()
     st.write("### View Previous Progress Photos")
-    if st.session_state.user_data['health_metrics']['progress_photos']:
-        for photo_entry in st.session_state.user_data['health_metrics']['progress_photos']:
-            st.write(f"**Date:** {photo_entry['date']}")
-            col1, col2 = st.columns(2)
-            with col1:
-                if photo_entry['photos'].get('front') and os.path.exists(photo_entry['photos']['front']):
-                    st.image(photo_entry['photos']['front'], caption="Front View", width=200)
-                if photo_entry['photos'].get('side') and os.path.exists(photo_entry['photos']['side']):
-                    st.image(photo_entry['photos']['side'], caption="Side View", width=200)
-            with col2:
-                if photo_entry['photos'].get('back') and os.path.exists(photo_entry['photos']['back']):
-                    st.image(photo_entry['photos']['back'], caption="Back View", width=200)
-                if photo_entry['photos'].get('outfit') and os.path.exists(photo_entry['photos']['outfit']):
-                    st.image(photo_entry['photos']['outfit'], caption="Goal Outfit", width=200)
-            st.markdown("---")
-    else:
-        st.write("No progress photos uploaded yet.")
+    with recorder.timer('section', section='gallery'):
+        if st.session_state.user_data['health_metrics']['progress_photos']:
+            show_photo_gallery(user_id, st.session_state.user_data['health_metrics']['progress_photos'])
+        else:
+            st.write("No progress photos uploaded yet.")
 
     # Visualize Progress
-    if st.session_state.user_data['weight_history']:
-        weights = [w[1] for w in st.session_state.user_data['weight_history']]
-        dates = [w[0] for w in st.session_state.user_data['weight_history']]
-        st.line_chart(pd.DataFrame({'Weight (kg)': weights}, index=dates))
-    if st.session_state.user_data['body_measurements_history']:
-        waists = [m['measurements']['waist'] for m in st.session_state.user_data['body_measurements_history'] if m['measurements'].get('waist')]
-        dates = [m['date'] for m in st.session_state.user_data['body_measurements_history'] if m['measurements'].get('waist')]
-        if waists and dates:
-            st.line_chart(pd.DataFrame({'Waist (cm)': waists}, index=dates))
-    if st.session_state.user_data['mood_log']:
-        moods = [m['mood'] for m in st.session_state.user_data['mood_log']]
-        dates = [m['date'] for m in st.session_state.user_data['mood_log']]
-        st.line_chart(pd.DataFrame({'Mood (1-10)': moods}, index=dates))
+    st.write("### Progress Charts")
+    with recorder.timer('section', section='charts'):
+        show_progress_charts(user_id, st.session_state.user_data)
+    if user_id:
+        st.write("### Averages")
+        with recorder.timer('section', section='averages'):
+            show_rollup_summary(user_id)
 
 def tips_help_page():
     st.markdown("<h2 style='text-align: center;'>💡Useful Tips</h2>", unsafe_allow_html=True)
@@ -697,19 +766,139 @@ def tips_help_page():
       *Tip:* Your NuBodhi guide can help find the right tool for you to speed up results, just let them know what your goals are and they'll be able to point you in the right direction.
     """)
 
+# Cohort report for the guide page; cached for ten minutes, or until refreshed
+@st.cache_data(ttl=600, show_spinner="Crunching cohort numbers...")
+def cohort_report(cohort, days):
+    flush_pending_writes()
+    return backend_cohort_frame(get_database(), cohort, days)
+
+# A summary figure, or '-' when there is no data (None or NaN)
+def format_stat(value, spec):
+    return "-" if value is None or value != value else format(value, spec)
+
+def guide_page():
+    st.markdown("<h2 style='text-align: center;'>🧑‍🏫 Guide Dashboard</h2>", unsafe_allow_html=True)
+    with get_database().connection() as conn:
+        names = cohort_names(conn)
+    col1, col2, col3 = st.columns([2, 1, 1])
+    with col1:
+        cohort = st.selectbox("Cohort", ["All clients"] + names, key="guide_cohort")
+    with col2:
+        days = st.selectbox("Period", [7, 30, 90, 365], index=1, format_func=lambda d: f"Last {d} days",
+                            key="guide_days")
+    with col3:
+        st.write("")
+        if st.button("Refresh"):
+            cohort_report.clear()
+    frame = cohort_report(None if cohort == "All clients" else cohort, days)
+    summary = cohort_summary(frame)
+    if not summary['clients']:
+        st.write("No clients with personal info in this cohort yet.")
+    else:
+        cols = st.columns(4)
+        cols[0].metric("Clients", summary['clients'], f"{summary['active_clients']} active", delta_color="off")
+        cols[1].metric("Average BMI", format_stat(summary['mean_bmi'], '.1f'))
+        cols[2].metric("Average mood", format_stat(summary['mean_mood'], '.1f'))
+        cols[3].metric("Logging compliance", format_stat(summary['mean_compliance'], '.0%'))
+        cols = st.columns(4)
+        cols[0].metric("Average sleep (h)", format_stat(summary['mean_sleep_hours'], '.1f'))
+        cols[1].metric("Average weight change (kg)", format_stat(summary['mean_weight_change'], '+.1f'))
+        cols[2].metric("Average calorie target", format_stat(summary['mean_calories'], '.0f'))
+        cols[3].write(", ".join(f"{label}: {count}" for label, count in summary['bmi_categories'].items()))
+        st.dataframe(frame.rename(columns={
+            'name': "Name", 'age': "Age", 'gender': "Gender", 'height': "Height", 'weight': "Weight",
+            'activity': "Activity", 'mood': "Mood", 'sleep_hours': "Sleep (h)", 'days_logged': "Days logged",
+            'bmi': "BMI", 'bmi_category': "BMI category", 'calories': "Calories", 'weight_change': "Weight change",
+            'compliance': "Compliance",
+        }), use_container_width=True)
+
+    with st.expander("Create or update a cohort"):
+        name = st.text_input("Cohort name", key="cohort_name")
+        members = st.text_area("Client user IDs (one per line or comma separated)", key="cohort_members")
+        if st.button("Save Cohort") and name:
+            user_ids = [user_id.strip() for user_id in members.replace(',', '\n').splitlines() if user_id.strip()]
+            with get_database().connection() as conn:
+                save_cohort(conn, name, user_ids)
+            cohort_report.clear()
+            st.success(f"Saved cohort {name} with {len(user_ids)} clients")
+
+# The debug panel is opt-in: NUBODHI_DEBUG=1, or ?debug=1 in the URL
+def debug_enabled():
+    if os.environ.get('NUBODHI_DEBUG') == '1':
+        return True
+    return st.experimental_get_query_params().get('debug') == ['1']
+
+def export_metrics():
+    path = os.environ.get('NUBODHI_METRICS_FILE')
+    if path:
+        get_recorder().write_prometheus(path, min_interval=10)
+
+# Sidebar tables of where reruns spend their time, with downloads of the
+# Prometheus text and a JSON snapshot
+def show_debug_panel():
+    recorder = get_recorder()
+    summaries = recorder.summaries()
+    with st.sidebar.expander("⏱ Performance", expanded=True):
+        for title, name, label, extra in [("Pages", 'page', 'page', 'history_rows'),
+                                          ("Page sections", 'section', 'section', None),
+                                          ("SQL statements", 'sql', 'statement', 'rows'),
+                                          ("Saves", 'save', 'data_type', None),
+                                          ("Uploads", 'upload', 'kind', 'bytes')]:
+            timings = summaries.get(f"{name}_seconds")
+            if not timings:
+                continue
+            extras = {row[label]: row for row in summaries.get(f"{name}_{extra}", [])}
+            st.write(f"**{title}**")
+            st.dataframe([{label: row[label], 'count': row['count'], 'mean ms': round(row['mean'] * 1000, 2),
+                           'max ms': round(row['max'] * 1000, 2),
+                           **({f"mean {extra}": round(extras[row[label]]['mean'], 1)}
+                              if row[label] in extras else {})}
+                          for row in timings], use_container_width=True)
+        gauges = recorder.gauges()
+        st.write("**Caches**")
+        st.write(f"History cache hit rate: {gauges.get('history_cache_hit_rate', 0):.0%} "
+                 f"({gauges.get('history_cache_hits', 0):,} hits, {gauges.get('history_cache_misses', 0):,} misses)")
+        if 'write_queue_queue_depth' in gauges:
+            st.write(f"Write queue: {gauges['write_queue_queue_depth']:,} pending, "
+                     f"mean flush {gauges['write_queue_mean_flush_ms']:.1f} ms")
+        st.write("**Recent events**")
+        st.dataframe(recorder.events(20), use_container_width=True)
+        st.download_button("Prometheus metrics", recorder.to_prometheus(), file_name="nubodhi_metrics.prom",
+                           mime="text/plain", key="debug_prometheus")
+        st.download_button("JSON snapshot", json.dumps(recorder.snapshot(), default=str, indent=2),
+                           file_name="nubodhi_metrics.json", mime="application/json", key="debug_json")
+        if st.button("Reset timings", key="debug_reset"):
+            recorder.reset()
+
 # Main app with navigation
 def main():
+    # Page configuration
+    st.set_page_config(
+        page_title="Nu Bodhi - Indian Wellness App",
+        page_icon="🧘‍♀️",
+        layout="wide"
+    )
+    # Create uploads directory if it doesn't exist
+    os.makedirs("uploads", exist_ok=True)
+    initialize_session_state()
+    get_api_server()
+    get_reminder_scheduler()
+    show_exercise_reminder()
+
     st.sidebar.title("Navigation 📍")
-    page = st.sidebar.radio("Go to", ["Welcome", "Tracking", "Useful Tips", "Meals"])
-
-    if page == "Welcome":
-        welcome_page()
-    elif page == "Tracking":
-        tracking_page()
-    elif page == "Useful Tips":
-        tips_help_page()
-    elif page == "Meals":
-        meals_page()
+    pages = {"Welcome": welcome_page, "Tracking": tracking_page, "Useful Tips": tips_help_page,
+             "Meals": meals_page, "Guides": guide_page}
+    page = st.sidebar.radio("Go to", list(pages))
+
+    # Time the page; events carry the session and client for the JSON log
+    recorder = get_recorder()
+    with recorder.context(session=st.session_state.session_id, user_id=st.session_state.user_data['user_id']):
+        with recorder.timer('page', page=pages[page].__name__) as event:
+            pages[page]()
+            event['history_rows'] = history_size(st.session_state.user_data)
+    export_metrics()
+    if debug_enabled():
+        show_debug_panel()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,168 @@
+"""Save throughput of the storage backends under concurrent writer processes.
+
+Each writer process stands in for one Streamlit server process behind a
+load balancer. It opens the backend on its own and saves daily check-ins
+(checklist, mood and measurements, committed together as the tracking page
+does) for random clients as fast as it can, for a fixed time. The backends
+compared are:
+- single: one SQLite file (every writer shares its write lock)
+- sharded-N: ``nubodhi.backends.ShardedDatabase`` with N shard files
+- remote: ``RemoteDatabase`` against ``benchmarks.libsql_standin`` (one
+  SQLite file behind HTTP). This measures the adapter's round trips, not a
+  real libSQL server.
+
+Every backend starts from the same synthetic history. The report gives
+check-ins per second, latency percentiles, lock waits (transactions that
+took over 5 ms to begin) and check-ins that failed with "database is
+locked".
+
+Usage: python -m benchmarks.bench_backends [--writers 8] [--seconds 10] [--users 500] [--days 60]
+       [--backends single,sharded-4,sharded-8,remote] [--json]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+from nubodhi.backends import RemoteDatabase, ShardedDatabase, open_backend, split
+from nubodhi.cache import HistoryCache
+from nubodhi.db import Database
+from nubodhi.service import UserDataService, open_database
+
+from .bench_startup import _REPO
+from .synthetic import START_DATE, build_typed_db, day_rows, user_ids
+
+LOCK_WAIT_S = 0.005
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+# Open a backend in a writer process (the parent already prepared it)
+def connect(kind, location):
+    if kind == 'single':
+        return Database(location)
+    if kind == 'sharded':
+        return ShardedDatabase(location)
+    return RemoteDatabase(location)
+
+
+def writer(kind, location, users, seconds, seed, results):
+    db = connect(kind, location)
+    service = UserDataService(db, HistoryCache())
+    rng = random.Random(seed)
+    ids = user_ids(users)
+    latencies, lock_waits, failed = [], 0, 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        user_id = rng.choice(ids)
+        day = rng.randrange(3650)
+        today = START_DATE.fromordinal(START_DATE.toordinal() + day).isoformat()
+        rows = [row for row in day_rows(rng, user_id, today, day + 1) if row[1] in
+                ('daily_checklist', 'mood_log', 'body_measurements_history')]
+        start = time.perf_counter()
+        try:
+            with service.writes(user_id) as conn:
+                if conn is not None and time.perf_counter() - start > LOCK_WAIT_S:
+                    lock_waits += 1
+                for _, data_type, date, value in rows:
+                    service.save(user_id, data_type, date, value)
+        except sqlite3.OperationalError:
+            failed += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+    db.close()
+    results.put((latencies, lock_waits, failed))
+
+
+def run(kind, location, writers, users, seconds):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    processes = [context.Process(target=writer, args=(kind, location, users, seconds, n, results))
+                 for n in range(writers)]
+    for process in processes:
+        process.start()
+    latencies, lock_waits, failed = [], 0, 0
+    for _ in processes:
+        process_latencies, process_waits, process_failed = results.get()
+        latencies += process_latencies
+        lock_waits += process_waits
+        failed += process_failed
+    for process in processes:
+        process.join()
+    return {
+        'check_ins': len(latencies), 'per_second': len(latencies) / seconds,
+        'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000, 'max_ms': max(latencies, default=0) * 1000,
+        'lock_waits': lock_waits, 'failed': failed,
+    }
+
+
+def start_standin(path):
+    server = subprocess.Popen([sys.executable, '-m', 'benchmarks.libsql_standin', '--db', path, '--port', '0'],
+                              cwd=_REPO, stdout=subprocess.PIPE, text=True)
+    url = server.stdout.readline().split()[-1]
+    return server, url
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8, help="concurrent writer processes")
+    parser.add_argument('--seconds', type=float, default=10, help="run time per backend")
+    parser.add_argument('--users', type=int, default=500, help="clients in the database")
+    parser.add_argument('--days', type=int, default=60, help="days of history per client")
+    parser.add_argument('--backends', default='single,sharded-4,sharded-8,remote')
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix='nubodhi-backends-')
+    results = {}
+    try:
+        seed_path = os.path.join(work, 'seed.db')
+        conn = sqlite3.connect(seed_path)
+        build_typed_db(conn, args.users, args.days)
+        conn.close()
+        open_database(seed_path).close()
+        for name in args.backends.split(','):
+            kind, _, shards = name.partition('-')
+            path = os.path.join(work, f"{name}.db")
+            shutil.copy(seed_path, path)
+            server = None
+            if kind == 'sharded':
+                location = os.path.join(work, name)
+                split(Database(path), open_backend(f"sharded:{location}?shards={shards}"))
+            elif kind == 'remote':
+                server, location = start_standin(path)
+            else:
+                location = path
+            try:
+                results[name] = run(kind, location, args.writers, args.users, args.seconds)
+            finally:
+                if server is not None:
+                    server.terminate()
+                    server.wait()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"daily check-ins, {args.writers} writer processes for {args.seconds:g}s each, "
+          f"{args.users} clients x {args.days} days ({os.cpu_count()} CPUs)")
+    print(f"  {'backend':<11} {'check-ins/s':>12} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} {'lock waits':>11} {'failed':>7}")
+    for name, result in results.items():
+        print(f"  {name:<11} {result['per_second']:12.0f} {result['p50_ms']:6.1f} ms {result['p95_ms']:6.1f} ms "
+              f"{result['p99_ms']:6.1f} ms {result['max_ms']:6.0f} ms {result['lock_waits']:11,} {result['failed']:7,}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,194 @@
+"""Reruns and server CPU for one daily check-in on the tracking page.
+
+Runs the app under ``streamlit run`` with a client that has a year of
+history, progress photos and thumbnails, and drives it over the websocket
+the way a browser would. The client opens Tracking, enters the user ID,
+then does the check-in: it sets mood, energy, sleep hours, sleep quality
+and the six measurements, and presses "Save Daily Data".
+
+Widgets inside a form do not rerun the script until the form is submitted.
+The client models that, so the same script measures any version of the
+page. It reports the script runs the check-in caused, the server process's
+CPU time (from /proc, so Linux only), wall time and bytes received.
+
+Usage: python -m benchmarks.bench_checkin [--days 365] [--app-dir path] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import time
+
+from .bench_startup import _REPO, copy_app, start_server, stop_server
+from .synthetic import build_typed_db, user_ids
+
+CHECK_IN = [
+    ("Mood (1-10)", 7), ("Energy (1-10)", 6), ("Hours of Sleep", 7.5), ("Sleep Quality (1-10)", 8),
+    ("Arms (cm)", 30), ("Chest (cm)", 95), ("Waist (cm)", 80), ("Hips (cm)", 98), ("Thighs (cm)", 55),
+    ("Calves (cm)", 36),
+]
+SAVE_BUTTON = "Save Daily Data"
+
+
+def server_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+# A database with `days` of history for one client, real photo files for
+# its progress photos and their thumbnails
+def prepare(work, days):
+    from PIL import Image
+
+    conn = sqlite3.connect(os.path.join(work, 'nubodhi_data.db'))
+    build_typed_db(conn, 1, days)
+    paths = [path for row in conn.execute("SELECT front, side, back, outfit FROM progress_photos")
+             for path in row if path]
+    conn.close()
+    for n, path in enumerate(paths):
+        path = os.path.join(work, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        Image.new('RGB', (900, 1200), (n * 37 % 256, 120, 160)).save(path, quality=85)
+    subprocess.run([sys.executable, '-m', 'nubodhi.thumbnails', 'backfill'], cwd=work, check=True,
+                   stdout=subprocess.DEVNULL)
+    return user_ids(1)[0]
+
+
+class Client:
+    def __init__(self, ws):
+        self.ws = ws
+        self.widgets = {}  # label -> (kind, proto)
+        self.values = {}  # widget id -> WidgetState, as the browser last sent them
+        self.staged = {}  # form id -> {widget id: WidgetState} not yet submitted
+        self.runs = 0
+        self.bytes = 0
+
+    def _state(self, kind, widget, value):
+        from streamlit.proto import WidgetStates_pb2
+
+        state = WidgetStates_pb2.WidgetState(id=widget.id)
+        if kind == 'slider':
+            state.double_array_value.data.append(value)
+        elif kind == 'number_input':
+            if widget.data_type == widget.INT:
+                state.int_value = int(value)
+            else:
+                state.double_value = float(value)
+        elif kind == 'text_input':
+            state.string_value = value
+        elif kind in ('radio', 'selectbox'):
+            state.int_value = list(widget.options).index(value)
+        elif kind == 'button':
+            state.trigger_value = True
+        else:
+            raise ValueError(f"unsupported widget {kind}")
+        return state
+
+    # Send a rerun with the current widget states; wait for the run (and any
+    # reruns it requests) to finish
+    async def rerun(self, triggers=()):
+        from streamlit.proto import BackMsg_pb2, ForwardMsg_pb2
+
+        request = BackMsg_pb2.BackMsg()
+        request.rerun_script.query_string = ''
+        request.rerun_script.widget_states.widgets.extend([*self.values.values(), *triggers])
+        await self.ws.write_message(request.SerializeToString(), binary=True)
+        while True:
+            data = await self.ws.read_message()
+            self.bytes += len(data)
+            message = ForwardMsg_pb2.ForwardMsg()
+            message.ParseFromString(data)
+            kind = message.WhichOneof('type')
+            if kind == 'delta' and message.delta.WhichOneof('type') == 'new_element':
+                element = message.delta.new_element
+                widget_kind = element.WhichOneof('type')
+                widget = getattr(element, widget_kind)
+                if getattr(widget, 'id', '') and getattr(widget, 'label', ''):
+                    self.widgets[widget.label] = (widget_kind, widget)
+                if widget_kind == 'exception':
+                    raise RuntimeError(f"app raised: {widget.message}")
+            elif kind == 'script_finished':
+                self.runs += 1
+                if message.script_finished != message.FINISHED_EARLY_FOR_RERUN:
+                    return
+
+    # Change a widget as a user would: inside a form this only stages the
+    # value, elsewhere it reruns the script
+    async def set(self, label, value):
+        kind, widget = self.widgets[label]
+        state = self._state(kind, widget, value)
+        if widget.form_id:
+            self.staged.setdefault(widget.form_id, {})[widget.id] = state
+            return
+        self.values[widget.id] = state
+        await self.rerun()
+
+    async def click(self, label):
+        kind, widget = self.widgets[label]
+        if widget.form_id:
+            self.values.update(self.staged.pop(widget.form_id, {}))
+        await self.rerun([self._state(kind, widget, True)])
+
+
+async def check_in(port, pid, user_id):
+    from tornado import websocket
+
+    ws = await websocket.websocket_connect(f"ws://localhost:{port}/_stcore/stream", max_message_size=1 << 30)
+    client = Client(ws)
+    await client.rerun()
+    await client.set("Go to", "Tracking")
+    await client.set("User ID", user_id)
+
+    client.runs = client.bytes = 0
+    cpu, start = server_cpu_seconds(pid), time.perf_counter()
+    for label, value in CHECK_IN:
+        await client.set(label, value)
+    await client.click(SAVE_BUTTON)
+    results = {'reruns': client.runs, 'server_cpu_s': server_cpu_seconds(pid) - cpu,
+               'wall_s': time.perf_counter() - start, 'bytes_received': client.bytes}
+    ws.close()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app-dir', default=_REPO, help="checkout to measure (default: this repository)")
+    parser.add_argument('--days', type=int, default=365, help="days of history for the client")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    work = copy_app(args.app_dir)
+    try:
+        user_id = prepare(work, args.days)
+        server, port = start_server(work)
+        try:
+            results = asyncio.run(check_in(port, server.pid, user_id))
+        finally:
+            stop_server(server)
+        conn = sqlite3.connect(os.path.join(work, 'nubodhi_data.db'))
+        results['saved'] = conn.execute("SELECT count(*) FROM mood_log WHERE user_id = ? AND mood = ? AND energy = ?",
+                                        (user_id, CHECK_IN[0][1], CHECK_IN[1][1])).fetchone()[0] > 0
+        conn.close()
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    results['days'] = args.days
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"daily check-in, {len(CHECK_IN)} inputs + save, client with {args.days} days of history "
+          f"({args.app_dir})")
+    print(f"  script runs     {results['reruns']:8d}")
+    print(f"  server CPU      {results['server_cpu_s'] * 1000:8.0f} ms")
+    print(f"  wall time       {results['wall_s'] * 1000:8.0f} ms")
+    print(f"  received        {results['bytes_received'] / 1024:8.0f} KiB")
+    print(f"  saved           {'yes' if results['saved'] else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""Decode throughput of the stored-value codecs against the old eval() path.
+
+Usage: python -m benchmarks.bench_codec [--rows 50000] [--json]
+"""
+import argparse
+import json
+import time
+
+from nubodhi import codec
+
+from .synthetic import generate_rows
+
+
+def rate(decode, payloads):
+    start = time.perf_counter()
+    for payload in payloads:
+        decode(payload)
+    return len(payloads) / (time.perf_counter() - start)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    values = [value for _, _, _, value in generate_rows(max(1, args.rows // 300), 100)][:args.rows]
+    legacy = [str(value) for value in values]
+    current = [codec.encode(value)[1] for value in values]
+
+    results = {
+        'rows': len(values),
+        'eval_rows_per_s': rate(eval, legacy),
+        'legacy_literal_eval_rows_per_s': rate(lambda p: codec.decode(p, codec.LEGACY), legacy),
+        'json_rows_per_s': rate(lambda p: codec.decode(p, codec.JSON), current),
+        'legacy_bytes': sum(len(p) for p in legacy),
+        'json_bytes': sum(len(p.encode()) for p in current),
+    }
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"Decoding {results['rows']:,} stored values:")
+    for label, key in [("eval (old path)", 'eval_rows_per_s'),
+                       ("legacy literal_eval", 'legacy_literal_eval_rows_per_s'),
+                       ("json (codec 1)", 'json_rows_per_s')]:
+        print(f"  {label:<20} {results[key]:>12,.0f} rows/s")
+    print(f"  storage: repr {results['legacy_bytes']:,} bytes, json {results['json_bytes']:,} bytes")
+
+
+if __name__ == '__main__':
+    main()
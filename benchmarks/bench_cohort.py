@@ -0,0 +1,83 @@
+"""Cohort dashboard timings on a synthetic client base.
+
+Builds a typed database (default 10,000 users x 365 days), then times the
+cohort report for every client and for a 300-client cohort, plus the
+per-user Python loop it replaces.
+
+Usage: python -m benchmarks.bench_cohort [--users 10000 --days 365] [--db path]
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+
+from nubodhi.cohort import cohort_frame, cohort_summary, save_cohort
+from nubodhi.storage import load_profile
+
+from .synthetic import START_DATE, build_typed_db, user_ids
+
+
+def timed(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - start)
+    return result, {'mean_ms': statistics.mean(timings) * 1000, 'max_ms': max(timings) * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--cohort-size', type=int, default=300)
+    parser.add_argument('--window', type=int, default=30, help="days of mood/compliance history")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--loop-sample', type=int, default=50, help="users timed with the per-user loop")
+    parser.add_argument('--db', help="existing or new database path (default: a temporary file)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='nubodhi-bench-'), 'bench.db')
+    conn = sqlite3.connect(db_path)
+    results = {'users': args.users, 'days': args.days, 'window': args.window}
+    if not conn.execute("SELECT name FROM sqlite_master WHERE name = 'rollups'").fetchone():
+        start = time.perf_counter()
+        results['rows'] = build_typed_db(conn, args.users, args.days)
+        results['build_s'] = time.perf_counter() - start
+    today = (START_DATE + timedelta(days=args.days - 1)).isoformat()
+    save_cohort(conn, 'bench', user_ids(args.users)[:args.cohort_size])
+
+    frame, results['all_clients'] = timed(lambda: cohort_frame(conn, None, args.window, today), args.repeat)
+    results['all_clients']['clients'] = len(frame)
+    cohort, results['cohort'] = timed(lambda: cohort_frame(conn, 'bench', args.window, today), args.repeat)
+    results['cohort']['clients'] = len(cohort)
+    _, results['summary'] = timed(lambda: cohort_summary(frame), args.repeat)
+
+    # Baseline: what a per-user page would do, loading each profile in turn
+    sample = user_ids(args.users)[:args.loop_sample]
+    start = time.perf_counter()
+    for user_id in sample:
+        load_profile(conn, user_id)
+    per_user = (time.perf_counter() - start) / len(sample)
+    results['per_user_loop_estimate_s'] = {'all_clients': per_user * args.users, 'cohort': per_user * args.cohort_size}
+    conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    if 'rows' in results:
+        print(f"{results['rows']:,} rows for {args.users:,} users x {args.days} days (built in {results['build_s']:.1f}s)")
+    for label, key in [("all clients", 'all_clients'), (f"{args.cohort_size}-client cohort", 'cohort')]:
+        print(f"  {label:<20} {results[key]['clients']:>6} rows: mean {results[key]['mean_ms']:9.1f} ms, "
+              f"max {results[key]['max_ms']:9.1f} ms "
+              f"(per-user loop: ~{results['per_user_loop_estimate_s'][key]:.1f} s)")
+    print(f"  summary               mean {results['summary']['mean_ms']:9.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+"""Data-layer benchmark suite: the work behind the tracking page.
+
+Builds a typed database from synthetic data (every data_type the app
+writes, for N users x D days), then times for a sample of users:
+- profile load: load_profile, the single query load_user_data runs
+- history decode: turning already-fetched rows into history entries
+- chart build: chart_frame for every progress metric
+- daily save: one day of tracking-page saves, committed together
+and reports database size and its growth per saved user-day.
+
+Results are JSON (--out) so runs on different commits can be compared:
+
+    python -m benchmarks.bench_data_layer --out before.json
+    python -m benchmarks.bench_data_layer --out after.json --compare before.json
+
+Usage: python -m benchmarks.bench_data_layer [--users 1000 --days 365] [--db path]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from nubodhi.db import Database
+from nubodhi.storage import PROFILE_SQL, load_profile, profile_from_rows, save_value
+from nubodhi.timeseries import METRICS, chart_frame, history_for
+
+from .synthetic import START_DATE, build_typed_db, day_rows, user_ids
+
+# Timing sections compared by --compare, in report order
+SECTIONS = ('profile_load', 'history_decode', 'chart_build', 'daily_save')
+
+
+def summary(timings):
+    timings = sorted(timings)
+    return {
+        'mean_ms': statistics.mean(timings) * 1000,
+        'p50_ms': timings[len(timings) // 2] * 1000,
+        'p95_ms': timings[min(len(timings) - 1, int(len(timings) * 0.95))] * 1000,
+        'max_ms': timings[-1] * 1000,
+        'samples': len(timings),
+    }
+
+
+def timed(func, args):
+    timings = []
+    for arg in args:
+        start = time.perf_counter()
+        func(arg)
+        timings.append(time.perf_counter() - start)
+    return summary(timings)
+
+
+def used_bytes(conn):
+    pages = conn.execute("PRAGMA page_count").fetchone()[0] - conn.execute("PRAGMA freelist_count").fetchone()[0]
+    return pages * conn.execute("PRAGMA page_size").fetchone()[0]
+
+
+# The history lists load_user_data puts in session state
+def session_histories(profile):
+    return {
+        'weight_history': [(info['date'], info['weight']) for info in profile['personal_info']],
+        'mood_log': profile['mood_log'],
+        'body_measurements_history': profile['body_measurements_history'],
+        'health_metrics': {data_type: profile[data_type]
+                           for data_type in ['biophotonic_scan', 'blood_work', 'body_composition', 'progress_photos']},
+    }
+
+
+def build_charts(user_data):
+    for metric in METRICS:
+        chart_frame(history_for(user_data, metric), metric, 'D', 7)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='nubodhi-bench-'), 'bench.db')
+    results = {
+        'commit': git_commit(), 'created': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(), 'sqlite': sqlite3.sqlite_version,
+        'users': args.users, 'days': args.days, 'seed': args.seed,
+    }
+    conn = sqlite3.connect(db_path)
+    if not conn.execute("SELECT name FROM sqlite_master WHERE name = 'rollups'").fetchone():
+        start = time.perf_counter()
+        results['rows'] = build_typed_db(conn, args.users, args.days, args.seed)
+        results['build_s'] = time.perf_counter() - start
+    conn.close()
+
+    db = Database(db_path)
+    sample = random.Random(args.seed).sample(user_ids(args.users), min(args.samples, args.users))
+    with db.connection() as conn:
+        results['db_bytes'] = used_bytes(conn)
+        results['bytes_per_user_day'] = results['db_bytes'] / (args.users * args.days)
+        results['profile_load'] = timed(lambda user_id: load_profile(conn, user_id), sample)
+        raw = {user_id: conn.execute(PROFILE_SQL, {'user_id': user_id}).fetchall() for user_id in sample}
+        results['history_decode'] = timed(lambda user_id: profile_from_rows(user_id, raw[user_id]), sample)
+        results['history_rows'] = statistics.mean(len(rows) for rows in raw.values())
+        histories = {user_id: session_histories(load_profile(conn, user_id)) for user_id in sample}
+        results['chart_build'] = timed(lambda user_id: build_charts(histories[user_id]), sample)
+
+        # New days after the synthetic history, saved the way the tracking
+        # page's handlers do: one transaction per user-day
+        rng = random.Random(args.seed + 1)
+        before = used_bytes(conn)
+        saves = [(user_id, day) for day in range(args.days, args.days + args.save_days) for user_id in sample]
+
+        def save_day(save):
+            user_id, day = save
+            today = (START_DATE + timedelta(days=day)).isoformat()
+            with db.transaction() as tx:
+                for row in day_rows(rng, user_id, today, day):
+                    save_value(tx, *row)
+
+        results['daily_save'] = timed(save_day, saves)
+        results['growth_bytes_per_user_day'] = (used_bytes(conn) - before) / len(saves)
+    db.close()
+    return results
+
+
+def compare(results, baseline, threshold):
+    print(f"vs {baseline.get('commit') or 'baseline'} ({baseline.get('created', '?')}):")
+    regressions = 0
+    for section in SECTIONS:
+        if section not in baseline:
+            continue
+        old, new = baseline[section]['mean_ms'], results[section]['mean_ms']
+        change = (new - old) / old if old else 0.0
+        flag = "  REGRESSION" if change > threshold else ""
+        regressions += bool(flag)
+        print(f"  {section:<15} {old:9.2f} -> {new:9.2f} ms ({change:+.0%}){flag}")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--samples', type=int, default=50, help="users timed in each section")
+    parser.add_argument('--save-days', type=int, default=3, help="extra days saved per sampled user")
+    parser.add_argument('--db', help="existing or new database path (default: a temporary file)")
+    parser.add_argument('--out', help="write the results to this JSON file")
+    parser.add_argument('--compare', help="baseline JSON from an earlier run")
+    parser.add_argument('--threshold', type=float, default=0.2, help="slowdown reported as a regression")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    results = run(args)
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        if 'rows' in results:
+            print(f"{results['rows']:,} rows for {args.users:,} users x {args.days} days "
+                  f"(built in {results['build_s']:.1f}s)")
+        print(f"  database          {results['db_bytes'] / 2 ** 20:9.1f} MiB "
+              f"({results['bytes_per_user_day']:.0f} bytes/user-day, "
+              f"+{results['growth_bytes_per_user_day']:.0f} bytes per saved user-day)")
+        for section in SECTIONS:
+            timing = results[section]
+            print(f"  {section:<15} mean {timing['mean_ms']:9.2f} ms, p95 {timing['p95_ms']:9.2f} ms, "
+                  f"max {timing['max_ms']:9.2f} ms")
+    if args.compare:
+        with open(args.compare) as f:
+            if compare(results, json.load(f), args.threshold):
+                raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
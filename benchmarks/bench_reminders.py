@@ -0,0 +1,103 @@
+"""Reminder scheduler throughput for a large client base.
+
+Enrolls 100,000 clients (default) in a ``nubodhi.reminders`` scheduler and
+replays one day on a simulated clock, calling ``run_due()`` once per tick
+from 06:00 to 22:00. It times enrollment (planning, queueing and saving
+every client's state), loading that state into a fresh scheduler as after a
+restart, the day's ticks (reminders sent per second, slowest tick) and
+``complete()`` calls. For comparison it times a tick of the per-client scan
+a scheduler without a heap would do.
+
+Usage: python -m benchmarks.bench_reminders [--users 100000] [--tick 60] [--completions 2000]
+       [--backend spec] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from nubodhi.backends import open_backend
+from nubodhi.reminders import ReminderScheduler, plan_slots
+
+from .bench_backends import percentile
+from .synthetic import START_DATE, user_ids
+
+SCAN_TICKS = 5
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--tick', type=int, default=60, help="simulated seconds between run_due() calls")
+    parser.add_argument('--completions', type=int, default=2000, help="complete() calls timed")
+    parser.add_argument('--backend', help="backend spec (default: a temporary single file)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    work = tempfile.mkdtemp(prefix='nubodhi-reminders-')
+    db = open_backend(args.backend or os.path.join(work, 'bench.db'))
+    ids = user_ids(args.users)
+    midnight = datetime.combine(START_DATE, datetime.min.time()).timestamp()
+    morning = midnight + 6 * 3600
+    results = {'users': args.users, 'tick_s': args.tick}
+    try:
+        scheduler = ReminderScheduler(db)
+        start = time.perf_counter()
+        scheduler.enroll(ids, now=morning)
+        results['enroll_s'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        scheduler = ReminderScheduler(db)
+        scheduler.load(now=morning)
+        results['load_s'] = time.perf_counter() - start
+
+        sent, ticks = 0, []
+        now = morning
+        day_start = time.perf_counter()
+        while now < morning + 16 * 3600:
+            now += args.tick
+            start = time.perf_counter()
+            sent += len(scheduler.run_due(now))
+            ticks.append(time.perf_counter() - start)
+        day_s = time.perf_counter() - day_start
+        results['day'] = {
+            'reminders': sent, 'seconds': day_s, 'per_second': sent / day_s, 'ticks': len(ticks),
+            'p99_tick_ms': percentile(ticks, 0.99) * 1000, 'max_tick_ms': max(ticks) * 1000,
+        }
+
+        rng = random.Random(0)
+        start = time.perf_counter()
+        for user_id in rng.sample(ids, min(args.completions, len(ids))):
+            scheduler.complete(user_id, now=now)
+        results['complete_ms'] = (time.perf_counter() - start) / max(1, min(args.completions, len(ids))) * 1000
+
+        # Baseline: every tick checks each client's next slot
+        next_due = {user_id: midnight + plan_slots(user_id, START_DATE)[0] for user_id in ids}
+        start = time.perf_counter()
+        for tick in range(SCAN_TICKS):
+            [user_id for user_id, due in next_due.items() if due <= morning + tick * args.tick]
+        results['scan_tick_ms'] = (time.perf_counter() - start) / SCAN_TICKS * 1000
+    finally:
+        db.close()
+        shutil.rmtree(work, ignore_errors=True)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    day = results['day']
+    print(f"{args.users:,} clients, one simulated day in {args.tick}s ticks")
+    print(f"  enroll (plan, queue, save)  {results['enroll_s']:8.2f} s  ({args.users / results['enroll_s']:,.0f} clients/s)")
+    print(f"  load after restart          {results['load_s']:8.2f} s  ({args.users / results['load_s']:,.0f} clients/s)")
+    print(f"  day: {day['reminders']:,} reminders in {day['seconds']:.2f} s ({day['per_second']:,.0f}/s), "
+          f"{day['ticks']} ticks, p99 {day['p99_tick_ms']:.1f} ms, max {day['max_tick_ms']:.1f} ms")
+    print(f"  complete()                  {results['complete_ms']:8.2f} ms per call")
+    print(f"  per-client scan, one tick   {results['scan_tick_ms']:8.1f} ms "
+          f"(x {day['ticks']} ticks = {results['scan_tick_ms'] * day['ticks'] / 1000:.1f} s a day, before sending)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Before/after profile query timings for the typed schema.
+
+Builds a legacy single-table database from synthetic data, times the old
+per-data_type queries, migrates it to the typed schema and times the same
+reads again.
+
+Usage: python -m benchmarks.bench_schema [--users 5000 --days 620] [--db path]
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+from nubodhi.migrate import migrate_legacy_rows
+from nubodhi.schema import TABLES
+from nubodhi.storage import load_values
+
+from .synthetic import build_legacy_db, user_ids
+
+
+def time_profiles(load, users):
+    timings = []
+    for user_id in users:
+        start = time.perf_counter()
+        for data_type in TABLES:
+            load(user_id, data_type)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summary(timings):
+    return {'mean_ms': statistics.mean(timings) * 1000, 'max_ms': max(timings) * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=620)
+    parser.add_argument('--samples', type=int, default=5, help="profiles to load before and after")
+    parser.add_argument('--db', help="database path (default: a temporary file)")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    db_path = args.db or os.path.join(tempfile.mkdtemp(prefix='nubodhi-bench-'), 'bench.db')
+    conn = sqlite3.connect(db_path)
+    results = {'users': args.users, 'days': args.days}
+
+    start = time.perf_counter()
+    results['rows'] = build_legacy_db(conn, args.users, args.days)
+    results['build_s'] = time.perf_counter() - start
+    sample = random.Random(1).sample(user_ids(args.users), args.samples)
+
+    def legacy_load(user_id, data_type):
+        return conn.execute("SELECT date, value FROM user_data WHERE user_id = ? AND data_type = ? ORDER BY date",
+                            (user_id, data_type)).fetchall()
+
+    results['legacy_profile'] = summary(time_profiles(legacy_load, sample))
+
+    start = time.perf_counter()
+    results['migrated_rows'] = migrate_legacy_rows(conn)['migrated']
+    results['migrate_s'] = time.perf_counter() - start
+    results['typed_profile'] = summary(time_profiles(lambda u, t: load_values(conn, u, t), sample))
+    conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{results['rows']:,} rows for {args.users:,} users x {args.days} days "
+          f"(built in {results['build_s']:.1f}s, migrated in {results['migrate_s']:.1f}s)")
+    for label, key in [("legacy user_data", 'legacy_profile'), ("typed tables", 'typed_profile')]:
+        print(f"  {label:<18} profile load: mean {results[key]['mean_ms']:9.2f} ms, "
+              f"max {results[key]['max_ms']:9.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
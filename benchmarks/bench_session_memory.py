@@ -0,0 +1,119 @@
+"""Memory one tracking-page session holds for a client's history.
+
+Builds a typed database from synthetic data, then for a sample of clients
+measures (with tracemalloc) the ``user_data`` a session keeps after loading
+the client, in two representations:
+- dicts: lists of per-day history dicts, as sessions held them before
+  ``nubodhi.history``
+- columnar: ``History`` columns, as ``load_profile`` returns them now
+both for a fresh load (``load_profile`` + ``user_data_from_profile``) and
+for a session served from the shared ``HistoryCache``. The timings are for
+the fresh load and for building every progress chart from the session.
+
+Usage: python -m benchmarks.bench_session_memory [--days 365] [--clients 20] [--sessions 300] [--json]
+"""
+import argparse
+import gc
+import json
+import sqlite3
+import statistics
+import time
+import tracemalloc
+
+from nubodhi.cache import HistoryCache
+from nubodhi.schema import ENTRY_DECODERS, TABLES
+from nubodhi.service import user_data_from_profile
+from nubodhi.storage import PROFILE_SQL, load_profile
+from nubodhi.timeseries import METRICS, chart_frame, history_for
+
+from .synthetic import build_typed_db, user_ids
+
+TODAY = '2099-01-01'
+
+
+# The previous load_profile: one dict per history entry
+def dict_profile(conn, user_id):
+    profile = {data_type: [] for data_type in TABLES}
+    decoders = {data_type: ENTRY_DECODERS[table.name] for data_type, table in TABLES.items()}
+    for row in conn.execute(PROFILE_SQL, {'user_id': user_id}):
+        profile[row[0]].append(decoders[row[0]](user_id, row[1], row[3:]))
+    return profile
+
+
+# Bytes still allocated after build() returns (its result is kept alive),
+# and the result
+def retained(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = build()
+        gc.collect()
+        return tracemalloc.get_traced_memory()[0] - before, result
+    finally:
+        tracemalloc.stop()
+
+
+def build_charts(user_data):
+    for metric in METRICS:
+        chart_frame(history_for(user_data, metric), metric, 'D', 7)
+
+
+def measure(conn, clients, load, from_cache):
+    fresh, cached, load_s, chart_s = [], [], [], []
+    for user_id in clients:
+        size, user_data = retained(lambda: user_data_from_profile(user_id, load(conn, user_id), TODAY))
+        fresh.append(size)
+        size, _ = retained(lambda: user_data_from_profile(user_id, from_cache(user_id), TODAY))
+        cached.append(size)
+        start = time.perf_counter()
+        user_data_from_profile(user_id, load(conn, user_id), TODAY)
+        load_s.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        build_charts(user_data)
+        chart_s.append(time.perf_counter() - start)
+    return {'fresh_bytes': statistics.mean(fresh), 'cached_bytes': statistics.mean(cached),
+            'load_ms': statistics.mean(load_s) * 1000, 'charts_ms': statistics.mean(chart_s) * 1000}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=365, help="days of history per client")
+    parser.add_argument('--clients', type=int, default=20, help="clients measured")
+    parser.add_argument('--sessions', type=int, default=300, help="live sessions for the projected total")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(':memory:')
+    build_typed_db(conn, args.clients, args.days)
+    clients = user_ids(args.clients)
+
+    # The dict cache handed each session a new list of the shared entry dicts
+    dict_cache = {user_id: dict_profile(conn, user_id) for user_id in clients}
+    history_cache = HistoryCache(max_rows=10 ** 9)
+    for user_id in clients:
+        history_cache.put_profile(user_id, load_profile(conn, user_id))
+    results = {
+        'days': args.days, 'clients': args.clients, 'sessions': args.sessions,
+        'dicts': measure(conn, clients, dict_profile,
+                         lambda user_id: {data_type: list(rows) for data_type, rows in dict_cache[user_id].items()}),
+        'columnar': measure(conn, clients, load_profile, history_cache.get_profile),
+    }
+    conn.close()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"one session's user_data, client with {args.days} days of history (mean of {args.clients} clients)")
+    print(f"  {'':<10} {'fresh load':>12} {'from cache':>12} {'per day':>9} {f'x{args.sessions} sessions':>16}"
+          f" {'load':>9} {'charts':>9}")
+    for name in ('dicts', 'columnar'):
+        result = results[name]
+        print(f"  {name:<10} {result['fresh_bytes'] / 1024:9.0f} KiB {result['cached_bytes'] / 1024:9.0f} KiB"
+              f" {result['fresh_bytes'] / args.days:7.0f} B"
+              f" {result['fresh_bytes'] * args.sessions / 2 ** 20:12.1f} MiB"
+              f" {result['load_ms']:6.2f} ms {result['charts_ms']:6.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
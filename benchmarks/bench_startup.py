@@ -0,0 +1,164 @@
+"""Cold-start timings: importing the app and rendering its first page.
+
+Each measurement runs in a fresh interpreter against a copy of the app in a
+temporary directory, so the database and uploads start empty:
+- import: ``import streamlit``, then ``import app``; separately, every
+  nubodhi module without the app
+- server: ``streamlit run`` until the health check answers
+- first render: one browser session over the websocket, from the rerun
+  request to ``script_finished`` (the Welcome page), then the mean of
+  further reruns
+
+Usage: python -m benchmarks.bench_startup [--repeat 3] [--app-dir path] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+_REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_IMPORT_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+import streamlit
+streamlit_s = time.perf_counter() - start
+start = time.perf_counter()
+import app
+print(json.dumps({'streamlit_s': streamlit_s, 'app_s': time.perf_counter() - start}))
+'''
+
+_HEADLESS_SCRIPT = '''
+import json, pkgutil, sys, time
+start = time.perf_counter()
+import nubodhi
+for module in pkgutil.iter_modules(nubodhi.__path__):
+    __import__(f"nubodhi.{module.name}")
+print(json.dumps({'nubodhi_s': time.perf_counter() - start, 'streamlit_imported': 'streamlit' in sys.modules}))
+'''
+
+
+def copy_app(app_dir):
+    work = tempfile.mkdtemp(prefix='nubodhi-startup-')
+    shutil.copy(os.path.join(app_dir, 'app.py'), work)
+    for name in ['nubodhi', 'assets']:
+        shutil.copytree(os.path.join(app_dir, name), os.path.join(work, name),
+                        ignore=shutil.ignore_patterns('__pycache__'))
+    return work
+
+
+def run_script(script, cwd):
+    out = subprocess.run([sys.executable, '-c', script], cwd=cwd, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+async def _render(port, reruns):
+    from streamlit.proto import BackMsg_pb2, ForwardMsg_pb2
+    from tornado import websocket
+
+    ws = await websocket.websocket_connect(f"ws://localhost:{port}/_stcore/stream")
+    timings = []
+    for _ in range(reruns + 1):
+        request = BackMsg_pb2.BackMsg()
+        request.rerun_script.query_string = ''
+        start = time.perf_counter()
+        await ws.write_message(request.SerializeToString(), binary=True)
+        while True:
+            message = ForwardMsg_pb2.ForwardMsg()
+            message.ParseFromString(await ws.read_message())
+            if message.WhichOneof('type') == 'script_finished':
+                timings.append(time.perf_counter() - start)
+                break
+    ws.close()
+    return timings
+
+
+# Start `streamlit run app.py` in cwd; returns (process, port) once the
+# health check answers
+def start_server(cwd, env=None):
+    port = free_port()
+    server = subprocess.Popen([sys.executable, '-m', 'streamlit', 'run', 'app.py', '--server.headless', 'true',
+                               '--server.port', str(port), '--browser.gatherUsageStats', 'false'],
+                              cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            urllib.request.urlopen(f"http://localhost:{port}/_stcore/health", timeout=1)
+            return server, port
+        except OSError:
+            if server.poll() is not None:
+                raise RuntimeError("streamlit exited before serving")
+            time.sleep(0.05)
+
+
+def stop_server(server):
+    server.terminate()
+    server.wait()
+
+
+def serve_and_render(cwd, reruns):
+    start = time.perf_counter()
+    server, port = start_server(cwd)
+    try:
+        server_s = time.perf_counter() - start
+        timings = asyncio.run(_render(port, reruns))
+    finally:
+        stop_server(server)
+    return {'server_s': server_s, 'first_render_s': timings[0],
+            'rerun_s': statistics.mean(timings[1:]) if reruns else None}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--app-dir', default=_REPO, help="checkout to measure (default: this repository)")
+    parser.add_argument('--repeat', type=int, default=3, help="fresh processes per measurement")
+    parser.add_argument('--reruns', type=int, default=5, help="reruns timed after the first render")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    runs = []
+    for _ in range(args.repeat):
+        work = copy_app(args.app_dir)
+        try:
+            run = run_script(_IMPORT_SCRIPT, work)
+            run.update(run_script(_HEADLESS_SCRIPT, work))
+            # A new copy: the import above already created the database
+            shutil.rmtree(work)
+            work = copy_app(args.app_dir)
+            run.update(serve_and_render(work, args.reruns))
+        finally:
+            shutil.rmtree(work, ignore_errors=True)
+        runs.append(run)
+    results = {key: statistics.median(run[key] for run in runs) if isinstance(runs[0][key], float) else runs[0][key]
+               for key in runs[0]}
+    results['repeat'] = args.repeat
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"median of {args.repeat} cold starts ({args.app_dir})")
+    print(f"  import streamlit          {results['streamlit_s'] * 1000:8.1f} ms")
+    print(f"  import app                {results['app_s'] * 1000:8.1f} ms")
+    print(f"  nubodhi alone (headless)  {results['nubodhi_s'] * 1000:8.1f} ms"
+          f"{'  (pulls in streamlit!)' if results['streamlit_imported'] else ''}")
+    print(f"  server ready              {results['server_s'] * 1000:8.1f} ms")
+    print(f"  first render              {results['first_render_s'] * 1000:8.1f} ms")
+    if results['rerun_s'] is not None:
+        print(f"  rerun (mean)              {results['rerun_s'] * 1000:8.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
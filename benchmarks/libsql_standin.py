@@ -0,0 +1,216 @@
+"""Local stand-in for a libSQL server, to test ``nubodhi.backends.RemoteDatabase``.
+
+Serves the part of libSQL's HTTP protocol (Hrana v2, ``POST /v2/pipeline``)
+the adapter uses: execute, batch (with ok/error/not/and/or conditions) and
+close requests. Each stream is a SQLite connection to one database file.
+The stream stays open between requests through its baton, so interactive
+transactions work as they do on sqld. Values travel in Hrana's JSON
+encoding (integers as strings, blobs as base64). Like sqld, it queues
+write transactions (BEGIN IMMEDIATE) on a lock of its own rather than
+leaving waiting streams in SQLite's busy-retry sleeps.
+
+Usage: python -m benchmarks.libsql_standin [--db standin.db] [--host 127.0.0.1] [--port 8080] [--token T]
+"""
+import argparse
+import base64
+import json
+import re
+import secrets
+import sqlite3
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from nubodhi.db import PRAGMAS
+
+WRITE_LOCK_TIMEOUT = 5.0
+_WRITE_BEGIN = re.compile(r'\s*BEGIN\s+(IMMEDIATE|EXCLUSIVE)', re.I)
+
+
+def _to_python(value):
+    kind = value['type']
+    if kind == 'integer':
+        return int(value['value'])
+    if kind == 'float':
+        return float(value['value'])
+    if kind == 'blob':
+        return base64.b64decode(value['base64'])
+    if kind == 'null':
+        return None
+    return value['value']
+
+
+def _to_hrana(value):
+    if value is None:
+        return {'type': 'null'}
+    if isinstance(value, int):
+        return {'type': 'integer', 'value': str(value)}
+    if isinstance(value, float):
+        return {'type': 'float', 'value': value}
+    if isinstance(value, bytes):
+        return {'type': 'blob', 'base64': base64.b64encode(value).decode()}
+    return {'type': 'text', 'value': value}
+
+
+class Stream:
+    def __init__(self, path, write_lock):
+        self.conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        for name, value in PRAGMAS.items():
+            self.conn.execute(f"PRAGMA {name} = {value}")
+        self.lock = threading.Lock()
+        self.write_lock = write_lock
+        self.writing = False
+
+    def execute(self, stmt):
+        if 'named_args' in stmt:
+            params = {arg['name'][1:]: _to_python(arg['value']) for arg in stmt['named_args']}
+        else:
+            params = [_to_python(value) for value in stmt.get('args', [])]
+        if not self.writing and _WRITE_BEGIN.match(stmt['sql']):
+            if not self.write_lock.acquire(timeout=WRITE_LOCK_TIMEOUT):
+                raise sqlite3.OperationalError("database is locked")
+            self.writing = True
+        try:
+            cursor = self.conn.execute(stmt['sql'], params)
+            rows = cursor.fetchall() if stmt.get('want_rows', True) else []
+        finally:
+            if self.writing and not self.conn.in_transaction:
+                self.writing = False
+                self.write_lock.release()
+        return {
+            'cols': [{'name': column[0], 'decltype': None} for column in cursor.description or ()],
+            'rows': [[_to_hrana(value) for value in row] for row in rows],
+            'affected_row_count': max(cursor.rowcount, 0),
+            'last_insert_rowid': str(cursor.lastrowid) if cursor.lastrowid else None,
+        }
+
+    def batch(self, steps):
+        results, errors = [], []
+
+        def holds(condition):
+            if condition is None:
+                return True
+            kind = condition['type']
+            if kind == 'ok':
+                return results[condition['step']] is not None
+            if kind == 'error':
+                return errors[condition['step']] is not None
+            if kind == 'not':
+                return not holds(condition['cond'])
+            if kind == 'and':
+                return all(holds(cond) for cond in condition['conds'])
+            return any(holds(cond) for cond in condition['conds'])
+
+        for step in steps:
+            result = error = None
+            if holds(step.get('condition')):
+                try:
+                    result = self.execute(step['stmt'])
+                except sqlite3.Error as e:
+                    error = _error(e)
+            results.append(result)
+            errors.append(error)
+        return {'step_results': results, 'step_errors': errors}
+
+    def close(self):
+        if self.writing:
+            self.conn.rollback()
+            self.writing = False
+            self.write_lock.release()
+        self.conn.close()
+
+
+def _error(error):
+    code = 'SQLITE_CONSTRAINT' if isinstance(error, sqlite3.IntegrityError) else 'SQLITE_ERROR'
+    return {'message': str(error), 'code': code}
+
+
+class StandIn:
+    def __init__(self, path, token=None):
+        self.path = path
+        self.token = token
+        self._streams = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+
+    def pipeline(self, request):
+        baton = request.get('baton')
+        with self._lock:
+            stream = self._streams.pop(baton, None) if baton else Stream(self.path, self._write_lock)
+        if stream is None:
+            return 400, {'message': "stream expired or unknown baton"}
+        results = []
+        closed = False
+        with stream.lock:
+            for item in request['requests']:
+                try:
+                    if item['type'] == 'execute':
+                        response = {'type': 'execute', 'result': stream.execute(item['stmt'])}
+                    elif item['type'] == 'batch':
+                        response = {'type': 'batch', 'result': stream.batch(item['batch']['steps'])}
+                    elif item['type'] == 'close':
+                        stream.close()
+                        closed = True
+                        response = {'type': 'close'}
+                    else:
+                        raise ValueError(f"unsupported request {item['type']!r}")
+                    results.append({'type': 'ok', 'response': response})
+                except (sqlite3.Error, ValueError) as e:
+                    results.append({'type': 'error', 'error': _error(e)})
+        baton = None
+        if not closed:
+            # A fresh baton per response, as sqld hands out
+            baton = secrets.token_urlsafe(12)
+            with self._lock:
+                self._streams[baton] = stream
+        return 200, {'baton': baton, 'base_url': None, 'results': results}
+
+
+def make_server(standin, host='127.0.0.1', port=8080):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        disable_nagle_algorithm = True
+
+        def _send(self, status, payload):
+            data = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            self._send(200 if self.path.rstrip('/') in ('', '/v2') else 404, {})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if standin.token and self.headers.get('Authorization') != f"Bearer {standin.token}":
+                self._send(401, {'message': "unauthorized"})
+            elif self.path != '/v2/pipeline':
+                self._send(404, {'message': "not found"})
+            else:
+                self._send(*standin.pipeline(json.loads(body)))
+
+        def log_message(self, format, *args):
+            pass
+
+    return ThreadingHTTPServer((host, port), Handler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='standin.db')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--token')
+    args = parser.parse_args(argv)
+
+    server = make_server(StandIn(args.db, args.token), args.host, args.port)
+    print(f"libSQL stand-in for {args.db} on http://{args.host}:{server.server_address[1]}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,360 @@
+"""Concurrent-session load test of the app's data paths (the morning rush).
+
+Each simulated session is one client opening the tracking page and checking
+in, doing what the page's handlers do through ``nubodhi.service``:
+- load: open the profile, as ``load_user_data`` does (shared history cache,
+  then one query)
+- daily: save the checklist, mood and measurements in one transaction
+- blood_work: store a lab report upload, then save the reading
+  (``--blood-work`` of sessions)
+- photos: store four progress photos, then save the entry (``--photos`` of
+  sessions; ``--thumbnails`` also renders their derivatives in a process pool)
+
+``--sessions`` threads run sessions back to back for ``--seconds``, with an
+optional think time between steps. With ``--processes P`` they are spread
+over P processes, each with its own service, like server processes behind a
+load balancer. Everything runs offline on a generated database (``--users``
+clients with ``--days`` of history) and generated upload files, in a
+temporary directory unless ``--work`` is given.
+
+The report gives p50/p95/p99 latency and throughput per step, SQLite lock
+waits (transactions that took over 5 ms to begin, and the time spent
+waiting), errors by type, and upload volume. ``--max-p99-ms`` and
+``--max-errors`` make the run exit non-zero when exceeded, to catch
+contention regressions in CI.
+
+Usage: python -m benchmarks.loadtest [--sessions 16] [--processes 1] [--seconds 20] [--users 1000] [--days 90]
+       [--blood-work 0.2] [--photos 0.1] [--think-ms 0] [--backend spec] [--write-behind] [--thumbnails]
+       [--max-p99-ms MS] [--max-errors N] [--json]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import timedelta
+
+from nubodhi.backends import open_backend, split
+from nubodhi.cache import HistoryCache
+from nubodhi.db import Database
+from nubodhi.instrument import Recorder
+from nubodhi.schema import PHOTO_VIEWS
+from nubodhi.service import UserDataService, user_data_from_profile
+from nubodhi.uploads import store_upload
+from nubodhi.writebehind import WriteBehindQueue
+
+from .bench_backends import LOCK_WAIT_S, percentile
+from .synthetic import START_DATE, build_typed_db, day_rows, user_ids
+
+STEPS = ('load', 'daily', 'blood_work', 'photos')
+
+
+# The backend with every transaction's wait for the write lock recorded
+class LockTimer:
+    def __init__(self, db):
+        self._db = db
+        self._lock = threading.Lock()
+        self.waits = 0
+        self.wait_s = 0.0
+        self.max_wait_s = 0.0
+
+    @contextmanager
+    def transaction(self, *args, **kwargs):
+        start = time.perf_counter()
+        with self._db.transaction(*args, **kwargs) as conn:
+            waited = time.perf_counter() - start
+            if waited > LOCK_WAIT_S:
+                with self._lock:
+                    self.waits += 1
+                    self.wait_s += waited
+                    self.max_wait_s = max(self.max_wait_s, waited)
+            yield conn
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+# Upload payloads: a real file of the given size plus a unique suffix, so
+# every upload is new content for the store (as a fresh photo would be)
+class Payloads:
+    def __init__(self, photo_kb, report_kb):
+        from PIL import Image
+
+        buffer = io.BytesIO()
+        Image.new('RGB', (900, 1200), (180, 120, 160)).save(buffer, 'JPEG', quality=85)
+        self.photo = buffer.getvalue().ljust(photo_kb * 1024, b'\0')
+        self.report = b'%PDF-1.4\n'.ljust(report_kb * 1024, b' ')
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def make(self, base, name):
+        with self._lock:
+            self._count += 1
+            suffix = f"\n{os.getpid()}-{self._count}".encode()
+        fileobj = io.BytesIO(base + suffix)
+        fileobj.name = name
+        return fileobj
+
+
+class Session:
+    def __init__(self, service, uploads_root, payloads, derivatives, args, rng):
+        self.service = service
+        self.uploads_root = uploads_root
+        self.payloads = payloads
+        self.derivatives = derivatives
+        self.args = args
+        self.rng = rng
+        self.latencies = {step: [] for step in STEPS}
+        self.errors = Counter()
+        self.upload_bytes = 0
+        self.uploads = 0
+        self.sessions = 0
+
+    def _upload(self, base, name):
+        fileobj = self.payloads.make(base, name)
+        path = store_upload(self.service.db, fileobj, name, self.uploads_root)
+        self.upload_bytes += len(fileobj.getbuffer())
+        self.uploads += 1
+        return path
+
+    def load(self, user_id, today):
+        self.user_data = user_data_from_profile(user_id, self.service.profile(user_id), today)
+
+    def daily(self, user_id, today):
+        rows = [row for row in day_rows(self.rng, user_id, today, self.args.days)
+                if row[1] in ('daily_checklist', 'mood_log', 'body_measurements_history')]
+        with self.service.writes(user_id):
+            for _, data_type, date, value in rows:
+                self.service.save(user_id, data_type, date, value)
+
+    def blood_work(self, user_id, today):
+        report = {
+            'date': today,
+            'metrics': {'blood_pressure': f"{self.rng.randint(100, 150)}/", 'blood_sugar': self.rng.randint(70, 140),
+                        'hemoglobin': round(self.rng.uniform(11, 17), 1)},
+            'report_file': self._upload(self.payloads.report, 'report.pdf'),
+        }
+        self.service.save(user_id, 'blood_work', today, report)
+
+    def photos(self, user_id, today):
+        photos = {'date': today, 'photos': {}}
+        for view in PHOTO_VIEWS:
+            photos['photos'][view] = self._upload(self.payloads.photo, f"{view}.jpg")
+            if self.derivatives is not None:
+                self.derivatives.submit(photos['photos'][view])
+        self.service.save(user_id, 'progress_photos', today, photos)
+
+    # One client's check-in; returns False once the deadline has passed
+    def run_once(self, ids, today, deadline):
+        user_id = self.rng.choice(ids)
+        steps = ['load', 'daily']
+        if self.rng.random() < self.args.blood_work:
+            steps.append('blood_work')
+        if self.rng.random() < self.args.photos:
+            steps.append('photos')
+        for step in steps:
+            if self.args.think_ms:
+                time.sleep(self.rng.expovariate(1000 / self.args.think_ms))
+            if time.perf_counter() >= deadline:
+                return False
+            start = time.perf_counter()
+            try:
+                getattr(self, step)(user_id, today)
+            except sqlite3.OperationalError as e:
+                self.errors[f"{step}: {e}"] += 1
+                continue
+            except Exception as e:
+                self.errors[f"{step}: {type(e).__name__}"] += 1
+                continue
+            self.latencies[step].append(time.perf_counter() - start)
+        self.sessions += 1
+        return True
+
+
+# One server process: a service like the app's, and `sessions` threads
+def server_process(backend, work, sessions, seed, args, results):
+    db = LockTimer(open_backend(backend))
+    write_queue = WriteBehindQueue(db) if args.write_behind else None
+    service = UserDataService(db, HistoryCache(max_rows=100000, ttl=300), write_queue, Recorder())
+    derivatives = None
+    if args.thumbnails:
+        from nubodhi.thumbnails import DerivativePool
+
+        derivatives = DerivativePool(root=os.path.join(work, 'uploads'))
+    payloads = Payloads(args.photo_kb, args.report_kb)
+    ids = user_ids(args.users)
+    today = (START_DATE + timedelta(days=args.days)).isoformat()
+    workers = [Session(service, os.path.join(work, 'uploads'), payloads, derivatives, args,
+                       random.Random(seed * 1000 + n)) for n in range(sessions)]
+    start = time.perf_counter()
+    deadline = start + args.seconds
+
+    def run(session):
+        while session.run_once(ids, today, deadline):
+            pass
+
+    threads = [threading.Thread(target=run, args=(session,)) for session in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if write_queue is not None:
+        write_queue.close()
+    if derivatives is not None:
+        derivatives.shutdown()
+    result = {
+        'elapsed': elapsed,
+        'latencies': {step: sum((session.latencies[step] for session in workers), []) for step in STEPS},
+        'errors': dict(sum((session.errors for session in workers), Counter())),
+        'sessions': sum(session.sessions for session in workers),
+        'upload_bytes': sum(session.upload_bytes for session in workers),
+        'uploads': sum(session.uploads for session in workers),
+        'lock_waits': db.waits, 'lock_wait_s': db.wait_s, 'max_lock_wait_s': db.max_wait_s,
+    }
+    db.close()
+    if results is None:
+        return result
+    results.put(result)
+
+
+def has_clients(db):
+    for store in db.stores():
+        with store.connection() as conn:
+            if conn.execute("SELECT 1 FROM personal_info LIMIT 1").fetchone():
+                return True
+    return False
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def run(backend, work, args):
+    uploads_before = directory_bytes(os.path.join(work, 'uploads'))
+    if args.processes == 1:
+        parts = [server_process(backend, work, args.sessions, 0, args, None)]
+    else:
+        context = multiprocessing.get_context('spawn')
+        results = context.Queue()
+        shares = [args.sessions // args.processes + (n < args.sessions % args.processes)
+                  for n in range(args.processes)]
+        processes = [context.Process(target=server_process, args=(backend, work, share, n, args, results))
+                     for n, share in enumerate(shares)]
+        for process in processes:
+            process.start()
+        parts = [results.get() for _ in processes]
+        for process in processes:
+            process.join()
+    # Time the sessions ran, without process start-up
+    elapsed = max(part['elapsed'] for part in parts)
+
+    errors = Counter()
+    for part in parts:
+        errors.update(part['errors'])
+    steps = {}
+    for step in STEPS:
+        latencies = sum((part['latencies'][step] for part in parts), [])
+        steps[step] = {
+            'count': len(latencies), 'per_second': len(latencies) / elapsed,
+            'p50_ms': percentile(latencies, 0.5) * 1000, 'p95_ms': percentile(latencies, 0.95) * 1000,
+            'p99_ms': percentile(latencies, 0.99) * 1000, 'max_ms': max(latencies, default=0) * 1000,
+        }
+    upload_bytes = sum(part['upload_bytes'] for part in parts)
+    return {
+        'seconds': elapsed,
+        'sessions': sum(part['sessions'] for part in parts),
+        'sessions_per_second': sum(part['sessions'] for part in parts) / elapsed,
+        'steps': steps,
+        'errors': dict(errors),
+        'lock_waits': sum(part['lock_waits'] for part in parts),
+        'lock_wait_s': sum(part['lock_wait_s'] for part in parts),
+        'max_lock_wait_ms': max(part['max_lock_wait_s'] for part in parts) * 1000,
+        'uploads': sum(part['uploads'] for part in parts),
+        'upload_bytes': upload_bytes,
+        'upload_mb_per_second': upload_bytes / elapsed / 1e6,
+        'upload_store_growth_bytes': directory_bytes(os.path.join(work, 'uploads')) - uploads_before,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sessions', type=int, default=16, help="concurrent sessions")
+    parser.add_argument('--processes', type=int, default=1, help="server processes the sessions are spread over")
+    parser.add_argument('--seconds', type=float, default=20, help="run time")
+    parser.add_argument('--users', type=int, default=1000, help="clients in the generated database")
+    parser.add_argument('--days', type=int, default=90, help="days of history per client")
+    parser.add_argument('--blood-work', type=float, default=0.2, help="share of sessions that log blood work")
+    parser.add_argument('--photos', type=float, default=0.1, help="share of sessions that save progress photos")
+    parser.add_argument('--photo-kb', type=int, default=800, help="size of each generated photo")
+    parser.add_argument('--report-kb', type=int, default=300, help="size of each generated lab report")
+    parser.add_argument('--think-ms', type=float, default=0, help="mean pause before each step")
+    parser.add_argument('--backend', help="backend spec, e.g. sharded:DIR?shards=4 (default: a single file)")
+    parser.add_argument('--write-behind', action='store_true', help="queue saves as NUBODHI_WRITE_BEHIND=1 does")
+    parser.add_argument('--thumbnails', action='store_true', help="render photo derivatives in a process pool")
+    parser.add_argument('--work', help="directory for the database and uploads (default: temporary)")
+    parser.add_argument('--max-p99-ms', type=float, help="exit non-zero if any step's p99 exceeds this")
+    parser.add_argument('--max-errors', type=int, help="exit non-zero if more steps than this fail")
+    parser.add_argument('--json', action='store_true', help="print results as JSON")
+    args = parser.parse_args(argv)
+
+    work = args.work or tempfile.mkdtemp(prefix='nubodhi-loadtest-')
+    os.makedirs(os.path.join(work, 'uploads'), exist_ok=True)
+    try:
+        seed_path = os.path.join(work, 'nubodhi_data.db')
+        if not os.path.exists(seed_path):
+            conn = sqlite3.connect(seed_path)
+            build_typed_db(conn, args.users, args.days)
+            conn.close()
+        open_backend(seed_path).close()
+        backend = args.backend or seed_path
+        if args.backend:
+            target = open_backend(args.backend)
+            if not has_clients(target):
+                split(Database(seed_path), target)
+            target.close()
+        results = run(backend, work, args)
+    finally:
+        if not args.work:
+            shutil.rmtree(work, ignore_errors=True)
+
+    failures = []
+    if args.max_p99_ms is not None:
+        failures += [f"{step} p99 {result['p99_ms']:.1f} ms > {args.max_p99_ms:g} ms"
+                     for step, result in results['steps'].items() if result['p99_ms'] > args.max_p99_ms]
+    if args.max_errors is not None and sum(results['errors'].values()) > args.max_errors:
+        failures.append(f"{sum(results['errors'].values())} errors > {args.max_errors}")
+
+    if args.json:
+        print(json.dumps({**results, 'failures': failures}, indent=2))
+    else:
+        print(f"{args.sessions} sessions in {args.processes} process(es) for {results['seconds']:.1f}s, "
+              f"{args.users:,} clients x {args.days} days ({os.cpu_count()} CPUs)")
+        print(f"  {results['sessions']:,} check-ins, {results['sessions_per_second']:.1f}/s")
+        print(f"  {'step':<11} {'count':>7} {'per s':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9}")
+        for step, result in results['steps'].items():
+            print(f"  {step:<11} {result['count']:7,} {result['per_second']:7.1f} {result['p50_ms']:6.1f} ms "
+                  f"{result['p95_ms']:6.1f} ms {result['p99_ms']:6.1f} ms {result['max_ms']:6.0f} ms")
+        print(f"  lock waits: {results['lock_waits']:,} ({results['lock_wait_s']:.2f} s waited, "
+              f"longest {results['max_lock_wait_ms']:.0f} ms)")
+        print(f"  uploads: {results['uploads']:,} files, {results['upload_bytes'] / 1e6:.1f} MB "
+              f"({results['upload_mb_per_second']:.1f} MB/s), store grew {results['upload_store_growth_bytes'] / 1e6:.1f} MB")
+        errors = results['errors']
+        print(f"  errors: {sum(errors.values()):,}" + ''.join(f"\n    {count:6,}  {kind}" for kind, count in
+                                                        sorted(errors.items(), key=lambda item: -item[1])))
+        for failure in failures:
+            print(f"FAIL: {failure}")
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Deterministic synthetic NuBodhi data.
+
+Values have exactly the shapes the tracking page saves, so the same rows can
+be written through the storage layer or, ``str()``-encoded, into a legacy
+single-table database.
+"""
+import random
+from datetime import date, timedelta
+
+from nubodhi.rollups import rebuild_rollups
+from nubodhi.schema import CHECKLIST_ITEMS, MEASUREMENTS, PHOTO_VIEWS, init_schema
+from nubodhi.storage import insert_statement
+
+START_DATE = date(2024, 1, 1)
+
+
+def user_ids(users):
+    return [f"user{n:06d}" for n in range(users)]
+
+
+# Yield (user_id, data_type, date, value) for every user, day by day
+def generate_rows(users, days, seed=0):
+    rng = random.Random(seed)
+    ids = user_ids(users)
+    for day in range(days):
+        today = (START_DATE + timedelta(days=day)).strftime("%Y-%m-%d")
+        for user_id in ids:
+            yield from day_rows(rng, user_id, today, day)
+
+
+def day_rows(rng, user_id, today, day):
+    if day == 0:
+        yield user_id, 'personal_info', today, {
+            'user_id': user_id, 'name': f"Client {user_id[4:]}", 'age': rng.randint(18, 80),
+            'gender': rng.choice(["Male", "Female"]), 'height': rng.randint(150, 195),
+            'weight': rng.randint(50, 120),
+            'activity': rng.choice(["Sedentary", "Lightly Active", "Moderately Active", "Very Active"]),
+        }
+    mood = {'mood': rng.randint(1, 10), 'energy': rng.randint(1, 10),
+            'sleep_hours': rng.choice([5.5, 6.0, 6.5, 7.0, 7.5, 8.0]), 'sleep_quality': rng.randint(1, 10)}
+    measurements = {part: rng.randint(20, 120) for part in MEASUREMENTS}
+    yield user_id, 'daily_checklist', today, {
+        'date': today, 'items': {item: rng.random() < 0.6 for item in CHECKLIST_ITEMS},
+        **mood, **measurements,
+    }
+    yield user_id, 'mood_log', today, mood
+    yield user_id, 'body_measurements_history', today, {'measurements': measurements}
+    if day % 30 == 7:
+        yield user_id, 'biophotonic_scan', today, rng.randint(10000, 100000)
+        yield user_id, 'blood_work', today, {
+            'date': today,
+            'metrics': {'blood_pressure': f"{rng.randint(100, 150)}/", 'blood_sugar': rng.randint(70, 180),
+                        'hemoglobin': round(rng.uniform(10, 17), 1)},
+            'report_file': f"uploads/{user_id}_blood_{today}.pdf",
+        }
+        yield user_id, 'body_composition', today, {
+            'date': today,
+            'metrics': {'body_fat': round(rng.uniform(10, 40), 1), 'muscle_mass': round(rng.uniform(20, 60), 1)},
+        }
+    if day % 7 == 3:
+        yield user_id, 'progress_photos', today, {
+            'date': today,
+            'photos': {view: f"uploads/{user_id}_{view}_{today}.jpg" for view in PHOTO_VIEWS},
+        }
+
+
+# Fill the old single-table schema with str()-encoded rows, as the app used to
+def build_legacy_db(conn, users, days, seed=0, batch_size=50000):
+    conn.execute('''CREATE TABLE IF NOT EXISTS user_data
+                    (user_id TEXT, data_type TEXT, date TEXT, value TEXT)''')
+    batch = []
+    total = 0
+    for user_id, data_type, today, value in generate_rows(users, days, seed):
+        batch.append((user_id, data_type, today, str(value)))
+        if len(batch) >= batch_size:
+            conn.executemany("INSERT INTO user_data VALUES (?, ?, ?, ?)", batch)
+            total += len(batch)
+            batch = []
+    conn.executemany("INSERT INTO user_data VALUES (?, ?, ?, ?)", batch)
+    conn.commit()
+    return total + len(batch)
+
+
+# Fill the typed schema directly (plain INSERTs, then one rollup rebuild);
+# much faster than saving row by row
+def build_typed_db(conn, users, days, seed=0, batch_size=50000):
+    init_schema(conn)
+    statements = {}
+    total = 0
+    for row in generate_rows(users, days, seed):
+        sql, params = insert_statement(*row)
+        batch = statements.setdefault(sql, [])
+        batch.append(params)
+        if len(batch) >= batch_size:
+            conn.executemany(sql, batch)
+            total += len(batch)
+            batch.clear()
+    for sql, batch in statements.items():
+        conn.executemany(sql, batch)
+        total += len(batch)
+    conn.commit()
+    rebuild_rollups(conn)
+    return total
@@ -0,0 +1,5 @@
+"""Data layer for the NuBodhi wellness app.
+
+Everything in this package is free of Streamlit so it can be used from the
+app, command-line tools and benchmarks alike.
+"""
@@ -0,0 +1,403 @@
+"""JSON HTTP API for syncing a client's data from phones.
+
+A small front end (native or PWA) can log a day in one request and pull
+what changed since its last sync in another, instead of a full page round
+trip. Records are flat, one field per column, as in the CSV export:
+
+    GET  /v1/health
+    GET  /v1/users/<user_id>/<data_type>[?since=YYYY-MM-DD&until=...]
+    PUT  /v1/users/<user_id>/<data_type>/<date>      {"mood": 7, "energy": 6, ...}
+    POST /v1/users/<user_id>/batch                   {"writes": [{"data_type": ..., "date": ..., ...}]}
+    GET  /v1/users/<user_id>/changes?cursor=N[&limit=500]
+    GET  /v1/users/<user_id>/uploads
+
+Data types are the app's: personal_info, daily_checklist, mood_log,
+body_measurements_history, biophotonic_scan, blood_work, body_composition
+and progress_photos. Saves go through ``UserDataService``, so they update
+the rollups and the history cache like the tracking page does. Daily data
+types replace the day's record; the others add one. A batch is validated
+as a whole and saved in one transaction (with a write-behind queue, as one
+queue item, confirmed before the response), so a failed batch saves
+nothing and the client can retry it without duplicating records.
+
+Delta sync: every save marks (user, data_type, date) in the ``changes``
+table with the user's next sequence number. ``changes?cursor=0`` returns
+every record with ``"reset": true``. Later calls pass the returned cursor
+and get each changed day's records once, however often it was saved.
+Clients replace their copy of each returned day.
+
+Run it on its own (stdlib, threaded) or under an ASGI server:
+
+    python -m nubodhi.api [--db nubodhi_data.db] [--host 127.0.0.1] [--port 8502] [--token T]
+    uvicorn --factory nubodhi.api:create_asgi     # NUBODHI_DB, NUBODHI_API_TOKEN
+
+or inside the Streamlit process with NUBODHI_API_PORT (see app.py), which
+shares the app's history cache. A separate process has its own cache, so
+the app may show its saves only after the cache TTL. With a token set,
+requests need ``Authorization: Bearer <token>``.
+"""
+import argparse
+import asyncio
+import gzip
+import hmac
+import json
+import logging
+import os
+import re
+import threading
+from datetime import date as Date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from .backends import open_backend
+from .cache import HistoryCache
+from .compact import compact_in_background
+from .schema import DECODERS, FILE_COLUMNS, TABLES
+from .service import UserDataService
+from .storage import change_seq
+from .transfer import validate_record
+from .writebehind import WriteQueueFull
+
+MAX_BODY = 1024 * 1024
+MAX_BATCH = 500
+CHANGES_LIMIT = 500
+GZIP_MIN_BYTES = 1024
+
+logger = logging.getLogger(__name__)
+
+_ROUTES = [
+    ('GET', re.compile(r'/v1/health'), 'health'),
+    ('GET', re.compile(r'/v1/users/([^/]+)/changes'), 'changes'),
+    ('GET', re.compile(r'/v1/users/([^/]+)/uploads'), 'uploads'),
+    ('POST', re.compile(r'/v1/users/([^/]+)/batch'), 'batch'),
+    ('GET', re.compile(r'/v1/users/([^/]+)/(\w+)'), 'records'),
+    ('PUT', re.compile(r'/v1/users/([^/]+)/(\w+)/([^/]+)'), 'save'),
+]
+
+
+class ApiError(Exception):
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.details = details
+
+
+def _table(data_type):
+    table = TABLES.get(data_type)
+    if table is None:
+        raise ApiError(404, f"unknown data type {data_type!r}")
+    return table
+
+
+def _date(text, name):
+    try:
+        return Date.fromisoformat(text).isoformat()
+    except (TypeError, ValueError):
+        raise ApiError(400, f"{name} must be YYYY-MM-DD") from None
+
+
+def _int(text, name, default):
+    if text is None:
+        return default
+    try:
+        return int(text)
+    except ValueError:
+        raise ApiError(400, f"{name} must be a whole number") from None
+
+
+# Flat records {'date': ..., column: value} from (date, *columns) rows
+def _records(table, rows):
+    bools = {i for i, (_, sql_type, _) in enumerate(table.columns) if sql_type == 'BOOLEAN'}
+    names = [column for column, _, _ in table.columns]
+    return [{'date': date, **{name: bool(value) if i in bools and value is not None else value
+                              for i, (name, value) in enumerate(zip(names, values))}}
+            for date, *values in rows]
+
+
+def _select(table):
+    return f"SELECT date, {', '.join(column for column, _, _ in table.columns)} FROM {table.name}"
+
+
+class Api:
+    def __init__(self, service, token=None):
+        self.service = service
+        self.db = service.db
+        self.token = token
+
+    # One request in, (status, JSON-able payload) out; shared by both servers
+    def handle(self, method, path, query='', body=b'', headers=None):
+        try:
+            if self.token:
+                supplied = (headers or {}).get('authorization', '')
+                if not hmac.compare_digest(supplied.encode(), f"Bearer {self.token}".encode()):
+                    raise ApiError(401, "missing or wrong token")
+            params = {key: values[-1] for key, values in parse_qs(query).items()}
+            for route_method, pattern, name in _ROUTES:
+                match = pattern.fullmatch(path)
+                if match and route_method == method:
+                    args = [unquote(arg) for arg in match.groups()]
+                    return 200, getattr(self, name)(*args, params=params, body=body)
+            if any(pattern.fullmatch(path) for _, pattern, _ in _ROUTES):
+                raise ApiError(405, f"{method} not allowed here")
+            raise ApiError(404, "no such endpoint")
+        except ApiError as e:
+            payload = {'error': str(e)}
+            if e.details is not None:
+                payload['details'] = e.details
+            return e.status, payload
+        except WriteQueueFull as e:
+            return 503, {'error': str(e)}
+        except Exception:
+            logger.exception("API request failed: %s %s", method, path)
+            return 500, {'error': "internal error"}
+
+    def health(self, params, body):
+        return {'ok': True}
+
+    # The user's records of one data type, oldest first
+    def records(self, user_id, data_type, params, body):
+        table = _table(data_type)
+        since = _date(params['since'], 'since') if 'since' in params else ''
+        until = _date(params['until'], 'until') if 'until' in params else '9999'
+        self.service.flush()
+        with self.db.connection(user_id) as conn:
+            rows = conn.execute(f"{_select(table)} WHERE user_id = ? AND date >= ? AND date <= ? "
+                                f"ORDER BY date, id", (user_id, since, until)).fetchall()
+        return {'data_type': data_type, 'records': _records(table, rows)}
+
+    def save(self, user_id, data_type, date, params, body):
+        record = self._json(body)
+        if not isinstance(record, dict):
+            raise ApiError(400, "expected a JSON object")
+        write = self._validate(user_id, {**record, 'data_type': data_type, 'date': date})
+        return self._write(user_id, [write])
+
+    def batch(self, user_id, params, body):
+        payload = self._json(body)
+        writes = payload.get('writes') if isinstance(payload, dict) else None
+        if not isinstance(writes, list) or not writes:
+            raise ApiError(400, 'expected {"writes": [...]}')
+        if len(writes) > MAX_BATCH:
+            raise ApiError(413, f"at most {MAX_BATCH} writes per batch")
+        validated, errors = [], []
+        for index, record in enumerate(writes):
+            try:
+                if not isinstance(record, dict):
+                    raise ApiError(400, "expected a JSON object")
+                validated.append(self._validate(user_id, record))
+            except ApiError as e:
+                errors.append({'index': index, 'error': str(e)})
+        if errors:
+            raise ApiError(400, "invalid writes, nothing was saved", errors)
+        return self._write(user_id, validated)
+
+    # Records of the days changed after `cursor`; cursor 0 (a first sync)
+    # returns everything
+    def changes(self, user_id, params, body):
+        cursor = _int(params.get('cursor'), 'cursor', 0)
+        limit = min(max(_int(params.get('limit'), 'limit', CHANGES_LIMIT), 1), CHANGES_LIMIT)
+        self.service.flush()
+        with self.db.snapshot(user_id) as conn:
+            latest = self._cursor(conn, user_id)
+            if cursor <= 0 or cursor > latest:
+                return {'cursor': latest, 'reset': True, 'more': False, 'days': self._snapshot(conn, user_id)}
+            marks = conn.execute("SELECT data_type, date, seq FROM changes WHERE user_id = ? AND seq > ? "
+                                 "ORDER BY seq LIMIT ?", (user_id, cursor, limit + 1)).fetchall()
+            more = len(marks) > limit
+            marks = marks[:limit]
+            days = []
+            for data_type, date, _ in marks:
+                table = TABLES.get(data_type)
+                if table is None:
+                    continue
+                rows = conn.execute(f"{_select(table)} WHERE user_id = ? AND date = ? ORDER BY id",
+                                    (user_id, date)).fetchall()
+                days.append({'data_type': data_type, 'date': date, 'records': _records(table, rows)})
+        return {'cursor': marks[-1][2] if more else latest, 'reset': False, 'more': more, 'days': days}
+
+    # Metadata of the files the user's records point to (the records and
+    # the uploads table may be in different stores, see nubodhi.backends)
+    def uploads(self, user_id, params, body):
+        self.service.flush()
+        uploads = []
+        with self.db.connection(user_id) as conn:
+            for data_type, columns in FILE_COLUMNS.items():
+                table = TABLES[data_type]
+                for column in columns:
+                    for date, path in conn.execute(f"SELECT date, {column} FROM {table.name} "
+                                                   f"WHERE user_id = ? AND {column} IS NOT NULL ORDER BY date, id",
+                                                   (user_id,)):
+                        uploads.append({'data_type': data_type, 'field': column, 'date': date, 'path': path})
+        paths = sorted({upload['path'] for upload in uploads})
+        with self.db.connection() as conn:
+            known = {row[0]: row[1:] for row in conn.execute(
+                "SELECT path, sha256, size, original_name, created_at FROM uploads "
+                "WHERE path IN (SELECT value FROM json_each(?))", (json.dumps(paths),))}
+        for upload in uploads:
+            upload.update(zip(('sha256', 'size', 'original_name', 'created_at'),
+                              known.get(upload['path'], (None,) * 4)))
+        uploads.sort(key=lambda upload: upload['date'])
+        return {'uploads': uploads}
+
+    def _json(self, body):
+        try:
+            return json.loads(body or b'null')
+        except ValueError:
+            raise ApiError(400, "body is not valid JSON") from None
+
+    # (data_type, date, value as the app saves it) from a flat record
+    def _validate(self, user_id, record):
+        data_type = record.get('data_type')
+        table = _table(data_type)
+        fields = {column for column, _, _ in table.columns}
+        unknown = sorted(set(record) - fields - {'data_type', 'date'})
+        if unknown:
+            raise ApiError(400, f"unknown fields for {data_type}: {', '.join(unknown)}")
+        try:
+            _, date, *values = validate_record(data_type, {**record, 'user_id': user_id})
+        except ValueError as e:
+            raise ApiError(400, str(e)) from None
+        return data_type, date, DECODERS[table.name](user_id, date, values)
+
+    def _write(self, user_id, writes):
+        ticket = self.service.save_many(user_id, writes)
+        if ticket is not None:
+            ticket.wait()
+        with self.db.connection(user_id) as conn:
+            return {'saved': len(writes), 'cursor': self._cursor(conn, user_id)}
+
+    def _cursor(self, conn, user_id):
+        return change_seq(conn, user_id)
+
+    def _snapshot(self, conn, user_id):
+        days = []
+        for data_type, table in TABLES.items():
+            rows = conn.execute(f"{_select(table)} WHERE user_id = ? ORDER BY date, id", (user_id,)).fetchall()
+            for record in _records(table, rows):
+                if days and days[-1]['data_type'] == data_type and days[-1]['date'] == record['date']:
+                    days[-1]['records'].append(record)
+                else:
+                    days.append({'data_type': data_type, 'date': record['date'], 'records': [record]})
+        return days
+
+
+def _encode(payload, accept_encoding):
+    data = json.dumps(payload, separators=(',', ':'), default=str).encode()
+    if len(data) >= GZIP_MIN_BYTES and 'gzip' in (accept_encoding or ''):
+        return gzip.compress(data, 6), 'gzip'
+    return data, None
+
+
+def _handler(api):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes
+        disable_nagle_algorithm = True
+
+        def _respond(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            if length > MAX_BODY:
+                status, payload = 413, {'error': f"body larger than {MAX_BODY} bytes"}
+                self.close_connection = True
+            else:
+                url = urlsplit(self.path)
+                headers = {key.lower(): value for key, value in self.headers.items()}
+                status, payload = api.handle(self.command, url.path, url.query, self.rfile.read(length), headers)
+            data, encoding = _encode(payload, self.headers.get('Accept-Encoding'))
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            if encoding:
+                self.send_header('Content-Encoding', encoding)
+            self.end_headers()
+            self.wfile.write(data)
+
+        do_GET = do_PUT = do_POST = do_DELETE = _respond
+
+        def log_message(self, format, *args):
+            logger.debug("%s %s", self.address_string(), format % args)
+
+    return Handler
+
+
+def make_server(api, host='127.0.0.1', port=8502):
+    return ThreadingHTTPServer((host, port), _handler(api))
+
+
+# Serve in a daemon thread; returns the server (server.shutdown() stops it)
+def start_server(api, host='127.0.0.1', port=8502):
+    server = make_server(api, host, port)
+    threading.Thread(target=server.serve_forever, name='nubodhi-api', daemon=True).start()
+    return server
+
+
+# ASGI application around an Api; requests run in worker threads, since
+# SQLite calls block
+def asgi_app(api):
+    async def app(scope, receive, send):
+        if scope['type'] == 'lifespan':
+            while True:
+                message = await receive()
+                if message['type'] == 'lifespan.startup':
+                    await send({'type': 'lifespan.startup.complete'})
+                elif message['type'] == 'lifespan.shutdown':
+                    await send({'type': 'lifespan.shutdown.complete'})
+                    return
+        if scope['type'] != 'http':
+            return
+        headers = {key.decode('latin-1').lower(): value.decode('latin-1') for key, value in scope['headers']}
+        body, more = b'', True
+        while more and len(body) <= MAX_BODY:
+            message = await receive()
+            body += message.get('body', b'')
+            more = message.get('more_body', False)
+        if len(body) > MAX_BODY:
+            status, payload = 413, {'error': f"body larger than {MAX_BODY} bytes"}
+        else:
+            # raw_path keeps the percent-escapes, as http.server's path does
+            path = scope['raw_path'].decode('latin-1') if scope.get('raw_path') else scope['path']
+            status, payload = await asyncio.to_thread(api.handle, scope['method'], path,
+                                                      scope['query_string'].decode('latin-1'), body, headers)
+        data, encoding = _encode(payload, headers.get('accept-encoding'))
+        response_headers = [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+        if encoding:
+            response_headers.append((b'content-encoding', encoding.encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+        await send({'type': 'http.response.body', 'body': data})
+
+    return app
+
+
+def default_api(db_path=None, token=None):
+    db = open_backend(db_path or os.environ.get('NUBODHI_DB', 'nubodhi_data.db'))
+    compact_in_background(db)
+    return Api(UserDataService(db, HistoryCache()), token or os.environ.get('NUBODHI_API_TOKEN'))
+
+
+# For `uvicorn --factory nubodhi.api:create_asgi`
+def create_asgi():
+    return asgi_app(default_api())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the NuBodhi JSON sync API.")
+    parser.add_argument('--db', default=os.environ.get('NUBODHI_DB', 'nubodhi_data.db'))
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--token', default=os.environ.get('NUBODHI_API_TOKEN'),
+                        help="require 'Authorization: Bearer <token>'")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    server = make_server(default_api(args.db, args.token), args.host, args.port)
+    print(f"Serving the NuBodhi API on http://{args.host}:{args.port}/v1/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,649 @@
+"""Storage backends: where each user's rows live.
+
+Every backend has the store protocol of ``db.Database``:
+- ``connection(user_id)``, ``transaction(user_id)``, ``snapshot(user_id)``
+  and ``on_commit(callback, user_id)`` work on the store holding that
+  user's rows. With no user_id they use the store with the global tables
+  (uploads, cohort_members).
+- ``store(user_id)`` is that store as a ``Database``. ``stores()`` lists
+  every per-user store, for queries across users. ``partition(user_ids)``
+  groups user IDs by store, so a batch commits once per store.
+
+There are three backends:
+- ``Database``: one SQLite file, the default.
+- ``ShardedDatabase``: a directory of SQLite files. ``main.db`` holds the
+  global tables and ``user_shards``, which says where each user lives.
+  ``shard-NN.db`` hold the users' rows. New users are placed by a stable
+  hash of their ID. Each shard has its own write lock, so saves for users
+  on different shards never wait for each other, across processes too.
+- ``RemoteDatabase``: a libSQL server (sqld) over its HTTP protocol
+  (Hrana v2). It runs the same SQLite SQL. ``benchmarks/libsql_standin.py``
+  is a local stand-in server to test it against.
+
+``open_backend(spec)`` opens one and prepares every store (see
+``service.prepare_store``) unless ``prepare=False``. The spec is a file path,
+``sharded:<dir>[?shards=N]``, or a server URL (``http://``, ``https://`` or
+``libsql://``, token in NUBODHI_BACKEND_TOKEN).
+
+Users can move between shards while the app runs. A move copies the user's
+rows to the new shard, then deletes them from the old one and leaves a
+``moved_users`` marker there. Both happen while holding the old shard's
+write lock. Every transaction on a user's shard checks for that marker and
+follows it, so a process with an out-of-date route never writes to, or
+reads from, a shard the user has left:
+
+    python -m nubodhi.backends status sharded:data
+    python -m nubodhi.backends move sharded:data USER_ID SHARD
+    python -m nubodhi.backends rebalance sharded:data [--shards N] [--tolerance 0.1] [--dry-run]
+    python -m nubodhi.backends split nubodhi_data.db sharded:data [--shards N]
+
+``split`` copies a single-file database into a new sharded directory; run
+it with the app stopped. The other maintenance CLIs (compact, transfer,
+rollups, reminders) take a backend spec wherever they take a database, and
+work through this module, so they see every shard and register new users.
+"""
+import argparse
+import base64
+import hashlib
+import http.client
+import json
+import os
+import re
+import socket
+import sqlite3
+import time
+from contextlib import contextmanager
+from urllib.parse import parse_qs, urlsplit
+
+from .db import Database
+from .service import prepare_store
+
+DEFAULT_SHARDS = 4
+MAIN_FILE = 'main.db'
+SHARD_FILE = 'shard-{:02d}.db'
+# Times a transaction follows a user who keeps moving
+MAX_HOPS = 3
+# Users copied per transaction by split()
+SPLIT_USERS = 500
+
+_MAIN_DDL = ['''CREATE TABLE IF NOT EXISTS user_shards
+                (user_id TEXT PRIMARY KEY, shard INTEGER NOT NULL) WITHOUT ROWID''']
+_SHARD_DDL = ['''CREATE TABLE IF NOT EXISTS moved_users
+                 (user_id TEXT PRIMARY KEY, shard INTEGER NOT NULL) WITHOUT ROWID''']
+# Tables with a user_id column that are not per-user data
+_NOT_USER_DATA = {'moved_users', 'user_shards', 'cohort_members'}
+
+
+# Users in a batch moved to other shards while it was being written; the
+# writer regroups them (see partition) and retries
+class UserMoved(Exception):
+    def __init__(self, user_ids):
+        super().__init__(f"moved to another shard: {', '.join(sorted(user_ids))}")
+        self.user_ids = user_ids
+
+
+def default_shard(user_id, shards):
+    digest = hashlib.blake2b(user_id.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % shards
+
+
+class ShardedDatabase:
+    def __init__(self, directory, shards=None, pragmas=None):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.pragmas = pragmas
+        self.main = Database(os.path.join(directory, MAIN_FILE), pragmas)
+        existing = [int(match.group(1)) for name in os.listdir(directory)
+                    if (match := re.fullmatch(r'shard-(\d+)\.db', name))]
+        self.shards = []
+        self._add_shards(max(max(existing, default=-1) + 1, shards or 0) or DEFAULT_SHARDS)
+        with self.main.transaction() as conn:
+            for statement in _MAIN_DDL:
+                conn.execute(statement)
+        self._routes = {}  # user_id -> shard, for users in user_shards
+
+    def _add_shards(self, count):
+        for index in range(len(self.shards), count):
+            shard = Database(os.path.join(self.directory, SHARD_FILE.format(index)), self.pragmas)
+            with shard.transaction() as conn:
+                for statement in _SHARD_DDL:
+                    conn.execute(statement)
+            self.shards.append(shard)
+
+    # Add empty shards (new users spread over all of them; existing users
+    # stay where they are until moved)
+    def add_shards(self, count):
+        self._add_shards(count)
+        for shard in self.shards:
+            prepare_store(shard)
+
+    def __repr__(self):
+        return f"ShardedDatabase({self.directory!r}, {len(self.shards)} shards)"
+
+    # The user's shard, registering new users (on their first write)
+    def route(self, user_id, register=False):
+        shard = self._routes.get(user_id)
+        if shard is not None:
+            return shard
+        with self.main.connection() as conn:
+            row = conn.execute("SELECT shard FROM user_shards WHERE user_id = ?", (user_id,)).fetchone()
+        if row is None and not register:
+            return default_shard(user_id, len(self.shards))
+        if row is None:
+            # Another process may register the user first; its choice wins
+            with self.main.transaction() as conn:
+                conn.execute("INSERT OR IGNORE INTO user_shards (user_id, shard) VALUES (?, ?)",
+                             (user_id, default_shard(user_id, len(self.shards))))
+                row = conn.execute("SELECT shard FROM user_shards WHERE user_id = ?", (user_id,)).fetchone()
+        self._routes[user_id] = row[0]
+        return row[0]
+
+    def _shard(self, index):
+        if index >= len(self.shards):
+            # Added by another process's rebalance
+            self._add_shards(index + 1)
+        return self.shards[index]
+
+    # Users among user_ids whose rows left the shard conn is on; routes them
+    # to where they went
+    def _moved(self, conn, user_ids):
+        marks = ', '.join('?' * len(user_ids))
+        moved = conn.execute(f"SELECT user_id, shard FROM moved_users WHERE user_id IN ({marks})",
+                             user_ids).fetchall()
+        for user_id, shard in moved:
+            self._routes[user_id] = shard
+        return [user_id for user_id, _ in moved]
+
+    # Enter `method` (transaction or snapshot) on the shard of user_ids,
+    # following moves
+    @contextmanager
+    def _on_shard(self, method, user_ids, register):
+        for _ in range(MAX_HOPS):
+            shards = {self.route(user_id, register) for user_id in user_ids}
+            if len(shards) > 1:
+                raise UserMoved(user_ids)
+            with getattr(self._shard(shards.pop()), method)() as conn:
+                moved = self._moved(conn, user_ids)
+                if not moved:
+                    yield conn
+                    return
+        raise UserMoved(moved)
+
+    @contextmanager
+    def _scoped(self, method, user_id, register=False):
+        if user_id is None:
+            with getattr(self.main, method)() as conn:
+                yield conn
+            return
+        user_ids = [user_id] if isinstance(user_id, str) else list(user_id)
+        with self._on_shard(method, user_ids, register) as conn:
+            yield conn
+
+    # A write transaction on the shard of user_id (or of a list of users
+    # from one partition() group)
+    def transaction(self, user_id=None):
+        return self._scoped('transaction', user_id, register=True)
+
+    # Reads of one user run in a snapshot, so the move check covers them
+    def snapshot(self, user_id=None):
+        return self._scoped('snapshot', user_id)
+
+    def connection(self, user_id=None):
+        if user_id is None:
+            return self.main.connection()
+        return self._scoped('snapshot', user_id)
+
+    def on_commit(self, callback, user_id=None):
+        self.store(user_id).on_commit(callback)
+
+    def store(self, user_id=None):
+        return self.main if user_id is None else self._shard(self.route(user_id))
+
+    def stores(self):
+        return list(self.shards)
+
+    def partition(self, user_ids):
+        groups = {}
+        for user_id in user_ids:
+            groups.setdefault(self.route(user_id, register=True), []).append(user_id)
+        return list(groups.values())
+
+    def close(self):
+        for store in (self.main, *self.shards):
+            store.close()
+
+
+# Per-user tables of a store: {name: (columns to copy, ORDER BY)}; rows with
+# an INTEGER PRIMARY KEY id get new ids on copy, in the same order
+def _user_tables(conn):
+    tables = {}
+    for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+        if name in _NOT_USER_DATA:
+            continue
+        info = conn.execute(f"PRAGMA table_info({name})").fetchall()
+        columns = [row[1] for row in info]
+        if 'user_id' not in columns:
+            continue
+        if any(row[1] == 'id' and row[5] == 1 and row[2].upper() == 'INTEGER' for row in info):
+            tables[name] = ([column for column in columns if column != 'id'], ' ORDER BY id')
+        else:
+            tables[name] = (columns, '')
+    return tables
+
+
+# Copy one user's rows between connections, replacing any the target has
+def _copy_user(source, target, user_id, tables):
+    rows = 0
+    for name, (columns, order) in tables.items():
+        listed = ', '.join(columns)
+        target.execute(f"DELETE FROM {name} WHERE user_id = ?", (user_id,))
+        copied = source.execute(f"SELECT {listed} FROM {name} WHERE user_id = ?{order}", (user_id,)).fetchall()
+        target.executemany(f"INSERT INTO {name} ({listed}) VALUES ({', '.join('?' * len(columns))})", copied)
+        rows += len(copied)
+    return rows
+
+
+# Move a user's rows to shard `target` while the app keeps running.
+# Returns rows moved.
+def move_user(db, user_id, target):
+    for _ in range(MAX_HOPS):
+        source = db.route(user_id, register=True)
+        if source == target:
+            return 0
+        # The source shard's write lock holds off the user's writers (and
+        # anyone else's on that shard) until the move is done
+        with db._shard(source).transaction() as src:
+            if db._moved(src, [user_id]):
+                continue
+            tables = _user_tables(src)
+            with db._shard(target).transaction() as dst:
+                dst.execute("DELETE FROM moved_users WHERE user_id = ?", (user_id,))
+                rows = _copy_user(src, dst, user_id, tables)
+            for name in tables:
+                src.execute(f"DELETE FROM {name} WHERE user_id = ?", (user_id,))
+            src.execute("INSERT OR REPLACE INTO moved_users (user_id, shard) VALUES (?, ?)", (user_id, target))
+        # If this is lost, the marker still sends everyone to the new shard
+        with db.main.transaction() as conn:
+            conn.execute("INSERT OR REPLACE INTO user_shards (user_id, shard) VALUES (?, ?)", (user_id, target))
+        db._routes[user_id] = target
+        return rows
+    raise UserMoved([user_id])
+
+
+# {shard: {user_id: rows}} for the users each shard is home to
+def shard_loads(db):
+    with db.main.connection() as conn:
+        homes = dict(conn.execute("SELECT user_id, shard FROM user_shards"))
+    loads = {}
+    for index, shard in enumerate(db.shards):
+        counts = {}
+        with shard.connection() as conn:
+            for name in _user_tables(conn):
+                for user_id, rows in conn.execute(f"SELECT user_id, count(*) FROM {name} GROUP BY user_id"):
+                    if homes.get(user_id, index) == index:
+                        counts[user_id] = counts.get(user_id, 0) + rows
+        loads[index] = counts
+    return loads
+
+
+# Moves (user_id, from, to) that bring every shard within `tolerance` of
+# the mean row count, moving as few rows as possible: users from the
+# fullest shard to the emptiest, each time the one that best fills the gap
+def plan_rebalance(loads, tolerance=0.1):
+    totals = {shard: sum(users.values()) for shard, users in loads.items()}
+    users = {shard: dict(counts) for shard, counts in loads.items()}
+    mean = sum(totals.values()) / len(totals) if totals else 0
+    moves = []
+    while mean:
+        fullest = max(totals, key=totals.get)
+        emptiest = min(totals, key=totals.get)
+        if totals[fullest] - mean <= tolerance * mean and mean - totals[emptiest] <= tolerance * mean:
+            break
+        gap = min(totals[fullest] - mean, mean - totals[emptiest])
+        fits = [(rows, user_id) for user_id, rows in users[fullest].items() if rows <= 2 * gap]
+        if not fits:
+            break
+        rows, user_id = min(fits, key=lambda fit: abs(fit[0] - gap))
+        moves.append((user_id, fullest, emptiest))
+        del users[fullest][user_id]
+        users[emptiest][user_id] = rows
+        totals[fullest] -= rows
+        totals[emptiest] += rows
+    return moves
+
+
+def rebalance(db, shards=None, tolerance=0.1, dry_run=False, progress=None):
+    if shards and shards > len(db.shards) and not dry_run:
+        db.add_shards(shards)
+    loads = shard_loads(db)
+    for index in range(len(db.shards), shards or 0):
+        loads[index] = {}  # shards a dry run would add
+    moves = plan_rebalance(loads, tolerance)
+    if not dry_run:
+        for n, (user_id, _, target) in enumerate(moves, 1):
+            move_user(db, user_id, target)
+            if progress:
+                progress(n, len(moves))
+    return moves
+
+
+# Copy a single-file database into an empty sharded one (app stopped)
+def split(source, db):
+    with source.connection() as src:
+        tables = _user_tables(src)
+        users = sorted({user_id for name in tables
+                        for (user_id,) in src.execute(f"SELECT DISTINCT user_id FROM {name}")})
+        with db.main.transaction() as dst:
+            for name in ('uploads', 'cohort_members'):
+                dst.execute(f"DELETE FROM {name}")
+                rows = src.execute(f"SELECT * FROM {name}").fetchall()
+                if rows:
+                    dst.executemany(f"INSERT INTO {name} VALUES ({', '.join('?' * len(rows[0]))})", rows)
+        by_shard = {}
+        for user_id in users:
+            by_shard.setdefault(db.route(user_id, register=True), []).append(user_id)
+        copied = 0
+        for index, shard_users in by_shard.items():
+            for start in range(0, len(shard_users), SPLIT_USERS):
+                with db.shards[index].transaction() as dst:
+                    for user_id in shard_users[start:start + SPLIT_USERS]:
+                        copied += _copy_user(src, dst, user_id, tables)
+    return {'users': len(users), 'rows': copied}
+
+
+# -- libSQL server over HTTP (Hrana v2) --
+
+def _hrana_value(value):
+    if value is None:
+        return {'type': 'null'}
+    if isinstance(value, (bool, int)):
+        return {'type': 'integer', 'value': str(int(value))}
+    if isinstance(value, float):
+        return {'type': 'float', 'value': value}
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'type': 'blob', 'base64': base64.b64encode(bytes(value)).decode()}
+    return {'type': 'text', 'value': str(value)}
+
+
+def _python_value(value):
+    kind = value['type']
+    if kind == 'integer':
+        return int(value['value'])
+    if kind == 'float':
+        return float(value['value'])
+    if kind == 'blob':
+        return base64.b64decode(value['base64'])
+    if kind == 'null':
+        return None
+    return value['value']
+
+
+def _statement(sql, params=()):
+    stmt = {'sql': sql, 'want_rows': True}
+    if isinstance(params, dict):
+        stmt['named_args'] = [{'name': f":{name}", 'value': _hrana_value(value)} for name, value in params.items()]
+    else:
+        stmt['args'] = [_hrana_value(value) for value in params]
+    return stmt
+
+
+def _error(error):
+    message = error.get('message', 'server error')
+    if 'CONSTRAINT' in (error.get('code') or '') or 'constraint failed' in message:
+        return sqlite3.IntegrityError(message)
+    return sqlite3.OperationalError(message)
+
+
+# Cursor over one result, shaped like sqlite3's for the code in this package
+class RemoteCursor:
+    arraysize = 1
+
+    def __init__(self, connection, result=None):
+        self.connection = connection
+        self._set(result)
+
+    def _set(self, result):
+        result = result or {'cols': [], 'rows': []}
+        self.description = tuple((col.get('name'), None, None, None, None, None, None)
+                                 for col in result['cols']) or None
+        self._rows = [tuple(_python_value(value) for value in row) for row in result['rows']]
+        self._position = 0
+        self.rowcount = result.get('affected_row_count', -1) if not result['cols'] else -1
+        rowid = result.get('last_insert_rowid')
+        self.lastrowid = int(rowid) if rowid is not None else None
+
+    def execute(self, sql, params=()):
+        self._set(self.connection._execute(sql, params))
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self.connection.executemany(sql, seq_of_params)
+        self._set(None)
+        return self
+
+    def fetchone(self):
+        if self._position >= len(self._rows):
+            return None
+        self._position += 1
+        return self._rows[self._position - 1]
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows = self._rows[self._position:self._position + size]
+        self._position += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._rows[self._position:]
+        self._position = len(self._rows)
+        return rows
+
+    def __iter__(self):
+        while (row := self.fetchone()) is not None:
+            yield row
+
+    def close(self):
+        self._rows = []
+
+
+# http.client sends headers and body in separate packets; without
+# TCP_NODELAY the body waits for the server's delayed ACK (~40 ms)
+class _HTTPConnection(http.client.HTTPConnection):
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    def connect(self):
+        super().connect()
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+# One server-side connection (a Hrana stream, kept open by its baton).
+# BEGIN is held back and sent with the next statement, so a transaction
+# costs no extra round trip.
+class RemoteConnection:
+    def __init__(self, url, token=None, timeout=30):
+        parts = urlsplit(url)
+        secure = parts.scheme in ('https', 'libsql')
+        connection_class = _HTTPSConnection if secure else _HTTPConnection
+        self._http = connection_class(parts.hostname, parts.port or (443 if secure else 80), timeout=timeout)
+        self._headers = {'Content-Type': 'application/json'}
+        if token:
+            self._headers['Authorization'] = f"Bearer {token}"
+        self._baton = None
+        self._deferred = []
+        self.in_transaction = False
+
+    def _pipeline(self, requests, retry=True):
+        body = json.dumps({'baton': self._baton, 'requests': requests})
+        try:
+            self._http.request('POST', '/v2/pipeline', body, self._headers)
+            response = self._http.getresponse()
+            status, data = response.status, response.read()
+        except (http.client.HTTPException, OSError) as e:
+            self._http.close()
+            status, data = None, str(e).encode()
+        if status != 200:
+            self._baton = None
+            # Outside a transaction nothing is lost with the stream (it
+            # expires when idle): start a new one
+            if retry and not self.in_transaction:
+                return self._pipeline(requests, retry=False)
+            self.in_transaction = False
+            raise sqlite3.OperationalError(f"database server: {status or 'unreachable'} {data[:200]!r}")
+        payload = json.loads(data)
+        self._baton = payload.get('baton')
+        return payload['results']
+
+    def _run(self, requests):
+        requests = [*({'type': 'execute', 'stmt': stmt} for stmt in self._deferred), *requests]
+        self._deferred = []
+        results = self._pipeline(requests)
+        for result in results:
+            if result['type'] == 'error':
+                raise _error(result['error'])
+        return [result['response'] for result in results]
+
+    def _execute(self, sql, params=()):
+        words = sql.split(None, 2)
+        keyword = words[0].upper() if words else ''
+        if keyword == 'BEGIN':
+            self._deferred.append(_statement(sql))
+            self.in_transaction = True
+            return None
+        ends = keyword in ('COMMIT', 'END') or (keyword == 'ROLLBACK' and (len(words) < 2 or words[1].upper() != 'TO'))
+        if ends and self._deferred:
+            # Nothing was sent since BEGIN
+            self._deferred = []
+            self.in_transaction = False
+            return None
+        try:
+            return self._run([{'type': 'execute', 'stmt': _statement(sql, params)}])[-1]['result']
+        finally:
+            if ends:
+                self.in_transaction = False
+
+    def execute(self, sql, params=()):
+        return RemoteCursor(self, self._execute(sql, params))
+
+    # All rows in one round trip, stopping at the first failure
+    def executemany(self, sql, seq_of_params):
+        steps = [{'stmt': {**_statement(sql, params), 'want_rows': False},
+                  'condition': {'type': 'ok', 'step': i - 1} if i else None}
+                 for i, params in enumerate(seq_of_params)]
+        if not steps:
+            return RemoteCursor(self)
+        batch = self._run([{'type': 'batch', 'batch': {'steps': steps}}])[-1]['result']
+        for error in batch['step_errors']:
+            if error:
+                raise _error(error)
+        return RemoteCursor(self)
+
+    def cursor(self):
+        return RemoteCursor(self)
+
+    def commit(self):
+        if self.in_transaction:
+            self._execute("COMMIT")
+
+    def rollback(self):
+        if self.in_transaction:
+            self._execute("ROLLBACK")
+
+    def close(self):
+        if self._baton is not None:
+            try:
+                self._pipeline([{'type': 'close'}])
+            except sqlite3.Error:
+                pass
+        self._http.close()
+
+
+# The store protocol over a libSQL server: pooling, transactions and
+# savepoints as for a local file, one server stream per pooled connection
+class RemoteDatabase(Database):
+    def __init__(self, url, token=None, max_idle=8, timeout=30):
+        super().__init__(url, pragmas={}, max_idle=max_idle)
+        self.url = url
+        self.token = token
+        self.timeout = timeout
+
+    def _open(self):
+        return RemoteConnection(self.url, self.token, self.timeout)
+
+
+def open_backend(spec, token=None, prepare=True):
+    if spec.startswith('sharded:'):
+        parts = urlsplit(spec[len('sharded:'):])
+        shards = parse_qs(parts.query).get('shards')
+        db = ShardedDatabase(parts.path, int(shards[-1]) if shards else None)
+        stores = [db.main, *db.shards]
+    elif re.match(r'(https?|libsql)://', spec):
+        db = RemoteDatabase(spec, token or os.environ.get('NUBODHI_BACKEND_TOKEN'))
+        stores = [db]
+    else:
+        db = Database(spec)
+        stores = [db]
+    if prepare:
+        for store in stores:
+            prepare_store(store)
+    return db
+
+
+def _sharded(spec):
+    db = open_backend(spec)
+    if not isinstance(db, ShardedDatabase):
+        raise SystemExit(f"{spec} is not a sharded backend (sharded:<dir>)")
+    return db
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and rebalance a sharded NuBodhi backend.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    status = commands.add_parser('status', help="users and rows per shard")
+    status.add_argument('backend')
+    move = commands.add_parser('move', help="move one user to a shard")
+    move.add_argument('backend')
+    move.add_argument('user_id')
+    move.add_argument('shard', type=int)
+    balance = commands.add_parser('rebalance', help="even out rows across shards, optionally adding shards")
+    balance.add_argument('backend')
+    balance.add_argument('--shards', type=int, help="grow to this many shards first")
+    balance.add_argument('--tolerance', type=float, default=0.1, help="allowed deviation from the mean")
+    balance.add_argument('--dry-run', action='store_true')
+    split_parser = commands.add_parser('split', help="copy a single-file database into a new sharded one")
+    split_parser.add_argument('source')
+    split_parser.add_argument('backend')
+    split_parser.add_argument('--shards', type=int, default=DEFAULT_SHARDS)
+    args = parser.parse_args(argv)
+
+    if args.command == 'split':
+        spec = args.backend if '?' in args.backend else f"{args.backend}?shards={args.shards}"
+        start = time.perf_counter()
+        stats = split(open_backend(args.source), _sharded(spec))
+        print(f"Copied {stats['rows']:,} rows of {stats['users']:,} users in {time.perf_counter() - start:.1f}s")
+        return
+    db = _sharded(args.backend)
+    if args.command == 'move':
+        if not 0 <= args.shard < len(db.shards):
+            raise SystemExit(f"shard must be 0-{len(db.shards) - 1}")
+        print(f"Moved {move_user(db, args.user_id, args.shard):,} rows of {args.user_id} to shard {args.shard}")
+    elif args.command == 'rebalance':
+        def report(done, total):
+            if done % 100 == 0 or done == total:
+                print(f"  {done:,}/{total:,} users moved")
+
+        start = time.perf_counter()
+        moves = rebalance(db, args.shards, args.tolerance, args.dry_run, progress=report)
+        verb = "Would move" if args.dry_run else "Moved"
+        print(f"{verb} {len(moves):,} users in {time.perf_counter() - start:.1f}s")
+    if args.command in ('status', 'rebalance'):
+        for index, users in shard_loads(db).items():
+            print(f"  shard {index:2d}  {len(users):8,} users  {sum(users.values()):10,} rows")
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
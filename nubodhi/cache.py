@@ -0,0 +1,147 @@
+"""Process-wide read cache for user history.
+
+Entries are keyed by (user_id, data_type) and hold the ``History``
+produced by ``storage.load_profile``. Each entry expires after ``ttl``
+seconds. Least recently used entries are evicted once more than ``max_rows``
+history rows are cached in total, which is the memory cap. Writes update
+cached entries in place (``record_write``), so re-opening a profile after
+saving does not touch the database.
+
+Other processes (more app workers, the sync API, imports) write to the
+same database without telling this cache. Every save also bumps the
+user's change sequence number (``storage.change_seq``), so a profile is
+cached with the seq it was read at, and ``get_profile(user_id, seq)`` only
+returns it while the database is still at that seq. ``record_write``
+counts this process's own saves, which keeps the entry valid after them.
+
+``get`` and ``put`` copy the history, so a session can append to its own
+without touching the cached one. The copies share their columns until one
+side adds a row (see ``History.copy``).
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from .schema import TABLES, encode_row
+
+
+class HistoryCache:
+    def __init__(self, max_rows=100000, ttl=300):
+        self.max_rows = max_rows
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (user_id, data_type) -> (expires_at, History)
+        self._rows = 0
+        self._seqs = {}  # user_id -> change seq the cached profile was read at
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0, 'updates': 0,
+                          'stale': 0}
+
+    def get(self, user_id, data_type):
+        key = (user_id, data_type)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self._counters['misses'] += 1
+                return None
+            if item[0] < time.monotonic():
+                self._drop(key)
+                self._counters['expired'] += 1
+                self._counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters['hits'] += 1
+            return item[1].copy()
+
+    def put(self, user_id, data_type, rows):
+        key = (user_id, data_type)
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            if len(rows) > self.max_rows:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, rows.copy())
+            self._rows += len(rows)
+            while self._rows > self.max_rows:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    # All typed data types for a user, or None unless every one is cached
+    # (and, given the user's current change seq, none was written elsewhere)
+    def get_profile(self, user_id, seq=None):
+        if seq is not None:
+            with self._lock:
+                cached = self._seqs.get(user_id)
+                if cached != seq:
+                    self._counters['misses'] += 1
+                    if cached is not None:
+                        self._counters['stale'] += 1
+                        self._seqs.pop(user_id)
+                        for key in [key for key in self._entries if key[0] == user_id]:
+                            self._drop(key)
+                    return None
+        profile = {}
+        for data_type in TABLES:
+            rows = self.get(user_id, data_type)
+            if rows is None:
+                return None
+            profile[data_type] = rows
+        return profile
+
+    def put_profile(self, user_id, profile, seq=None):
+        for data_type, rows in profile.items():
+            self.put(user_id, data_type, rows)
+        if seq is not None:
+            with self._lock:
+                self._seqs[user_id] = seq
+
+    def invalidate(self, user_id, data_type=None):
+        with self._lock:
+            keys = [key for key in self._entries
+                    if key[0] == user_id and (data_type is None or key[1] == data_type)]
+            for key in keys:
+                self._drop(key)
+            if data_type is None:
+                self._seqs.pop(user_id, None)
+            self._counters['invalidations'] += len(keys)
+
+    # Write-through: add a newly saved value to a cached entry, keeping date
+    # order; called once per committed save, which moved the seq on by one
+    def record_write(self, user_id, data_type, date, value):
+        with self._lock:
+            if user_id in self._seqs:
+                self._seqs[user_id] += 1
+        table = TABLES.get(data_type)
+        if table is None:
+            self.invalidate(user_id, data_type)
+            return
+        row = encode_row(table, value)
+        key = (user_id, data_type)
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return
+            rows = len(item[1])
+            # Daily data types replace the day's row rather than adding one
+            item[1].add_row(date, row)
+            self._rows += len(item[1]) - rows
+            self._counters['updates'] += 1
+            while self._rows > self.max_rows:
+                self._drop(next(iter(self._entries)))
+                self._counters['evictions'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._seqs.clear()
+            self._rows = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), rows=self._rows)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _drop(self, key):
+        _, rows = self._entries.pop(key)
+        self._rows -= len(rows)
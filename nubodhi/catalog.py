@@ -0,0 +1,109 @@
+"""Searchable catalog of the meal plans.
+
+The nested meal-plan dicts are flattened once into an in-memory SQLite
+database with an FTS5 index over dish name, ingredients and recipe text.
+The app keeps one catalog per process, so a search is a single indexed
+query rather than a walk over every plan on each keystroke.
+
+    catalog = MealCatalog({'Vegetarian': vegetarian_meals, 'Meat-Eater': meat_meals})
+    catalog.search("chickpeas")
+    catalog.search(ingredient="paneer", exclude_meat=True)
+    catalog.search(leftovers=True, meal_type="Lunch")
+
+Queries match word prefixes with Porter stemming, so "chickpea" and
+"chickpeas" both find Chana Masala and Besan Cheela (chickpea flour).
+"""
+import re
+import sqlite3
+import threading
+
+MEAT_WORDS = ('chicken', 'mutton', 'lamb', 'goat', 'beef', 'pork', 'keema', 'meat', 'turkey',
+              'fish', 'prawn', 'shrimp')
+EGG_WORDS = ('egg',)
+LEFTOVER_WORDS = ('leftover',)
+
+_DDL = [
+    '''CREATE TABLE meals
+       (id INTEGER PRIMARY KEY, diet TEXT, day TEXT, meal_type TEXT, name TEXT, ingredients TEXT,
+        recipe TEXT, has_meat BOOLEAN, has_egg BOOLEAN, uses_leftovers BOOLEAN)''',
+    '''CREATE VIRTUAL TABLE meals_fts USING fts5
+       (name, ingredients, recipe, content='meals', content_rowid='id',
+        tokenize='porter unicode61 remove_diacritics 2')''',
+]
+
+
+def _mentions(texts, words):
+    text = ' '.join(texts).lower()
+    return any(re.search(rf'\b{word}', text) for word in words)
+
+
+# Turn free text into an FTS5 expression: every word must match as a prefix
+def fts_query(text, column=None):
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return None
+    terms = ' '.join(f'"{word}"*' for word in words)
+    return f'{column} : ({terms})' if column else terms
+
+
+class MealCatalog:
+    def __init__(self, plans):
+        # One shared read-only connection; the lock serializes sessions
+        self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+        self._lock = threading.Lock()
+        for statement in _DDL:
+            self._conn.execute(statement)
+        rows = []
+        for diet, days in plans.items():
+            for day, meals in days.items():
+                for meal_type, details in meals.items():
+                    texts = [details['Meal'], *details['Ingredients']]
+                    rows.append((diet, day, meal_type, details['Meal'], '\n'.join(details['Ingredients']),
+                                 details['Recipe'], _mentions(texts, MEAT_WORDS), _mentions(texts, EGG_WORDS),
+                                 _mentions(texts, LEFTOVER_WORDS)))
+        with self._conn:
+            self._conn.executemany(
+                "INSERT INTO meals (diet, day, meal_type, name, ingredients, recipe, has_meat, has_egg, "
+                "uses_leftovers) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute("INSERT INTO meals_fts (meals_fts) VALUES ('rebuild')")
+        self.diets = list(plans)
+        self.meal_types = list(dict.fromkeys(meal_type for days in plans.values()
+                                             for meals in days.values() for meal_type in meals))
+
+    # Meals matching every given condition, best text match first (plan
+    # order when there is no text query). Returns dicts shaped like the
+    # plan entries plus diet, day and meal_type.
+    def search(self, text='', ingredient='', diet=None, day=None, meal_type=None,
+               exclude_meat=False, exclude_egg=False, leftovers=None, limit=50):
+        match = [query for query in (fts_query(text), fts_query(ingredient, 'ingredients')) if query]
+        conditions, params = [], []
+        for column, value in (('diet', diet), ('day', day), ('meal_type', meal_type)):
+            if value:
+                conditions.append(f"m.{column} = ?")
+                params.append(value)
+        if exclude_meat:
+            conditions.append("NOT m.has_meat")
+        if exclude_egg:
+            conditions.append("NOT m.has_egg")
+        if leftovers is not None:
+            conditions.append("m.uses_leftovers = ?")
+            params.append(bool(leftovers))
+        if match:
+            sql = ("SELECT m.diet, m.day, m.meal_type, m.name, m.ingredients, m.recipe "
+                   "FROM meals_fts JOIN meals m ON m.id = meals_fts.rowid WHERE meals_fts MATCH ?")
+            params.insert(0, ' AND '.join(match))
+            order = "bm25(meals_fts, 10.0, 5.0, 1.0), m.id"
+        else:
+            sql = "SELECT m.diet, m.day, m.meal_type, m.name, m.ingredients, m.recipe FROM meals m WHERE 1"
+            order = "m.id"
+        sql += ''.join(f" AND {condition}" for condition in conditions) + f" ORDER BY {order} LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            rows = self._conn.execute(sql, params).fetchall()
+        return [{'diet': diet, 'day': day, 'meal_type': meal_type, 'Meal': name,
+                 'Ingredients': ingredients.split('\n'), 'Recipe': recipe}
+                for diet, day, meal_type, name, ingredients, recipe in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM meals").fetchone()[0]
@@ -0,0 +1,65 @@
+"""Versioned serialization for values kept in the generic ``user_data`` table.
+
+Each row records the codec version its payload was written with. New rows
+use compact JSON; rows written by the original app (``str(value)``, version
+tag NULL) are read with ``ast.literal_eval`` while ``ACCEPT_LEGACY`` is on,
+never with ``eval``. ``python -m nubodhi.migrate`` re-encodes them, after
+which the transition window can be closed.
+"""
+import ast
+import json
+
+LEGACY = 0  # str(value) from the original app
+JSON = 1
+UNREADABLE = -1  # legacy payload that could not be parsed; kept for inspection
+
+CURRENT_VERSION = JSON
+ACCEPT_LEGACY = True
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _json_encode(value):
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False)
+
+
+def _legacy_encode(value):
+    raise CodecError("the legacy repr format is read-only")
+
+
+# version: (encode, decode)
+CODECS = {
+    LEGACY: (_legacy_encode, ast.literal_eval),
+    JSON: (_json_encode, json.loads),
+}
+
+
+# Add or replace a codec, e.g. a binary format for a new version number
+def register_codec(version, encode, decode):
+    CODECS[version] = (encode, decode)
+
+
+# Return (version, payload) for storage
+def encode(value, version=None):
+    version = CURRENT_VERSION if version is None else version
+    try:
+        return version, CODECS[version][0](value)
+    except KeyError:
+        raise CodecError(f"unknown codec version {version}") from None
+    except (TypeError, ValueError) as e:
+        raise CodecError(f"cannot encode value with codec {version}: {e}") from e
+
+
+def decode(payload, version):
+    if version is None:
+        version = LEGACY
+    if version == LEGACY and not ACCEPT_LEGACY:
+        raise CodecError("legacy repr rows are no longer accepted; run python -m nubodhi.migrate")
+    if version not in CODECS:
+        raise CodecError(f"unknown codec version {version}")
+    try:
+        return CODECS[version][1](payload)
+    except (ValueError, SyntaxError, TypeError, MemoryError, RecursionError) as e:
+        raise CodecError(f"cannot decode payload with codec {version}: {e}") from e
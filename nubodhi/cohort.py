@@ -0,0 +1,182 @@
+"""Cohort analytics for guides.
+
+A cohort is a named group of client user_ids (``cohort_members``), or every
+client with personal info. The cohort's metrics come from three set-based
+queries, each driven by the member list so SQLite can seek its indexes:
+- the first and latest personal info per user (by date, then save order)
+- weekly mood and sleep rollups
+- distinct days with a daily checklist
+
+BMI, calorie targets, weight change and logging compliance are then
+computed column-wise with pandas/NumPy. No Python code runs per user.
+(CROSS JOIN is SQLite's way of keeping the member list as the outer loop.)
+``backend_cohort_frame`` runs the same queries on every shard of a sharded
+backend (see ``nubodhi.backends``) and joins the results.
+"""
+import json
+from datetime import date as Date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from .db import atomic
+from .metrics import ACTIVITY_MULTIPLIERS
+from .rollups import period_starts
+
+BMI_CATEGORIES = [(0, "Unknown"), (0.01, "Underweight"), (18.5, "Healthy"), (25, "Overweight"), (30, "Obese")]
+
+_ALL_MEMBERS = "SELECT DISTINCT user_id FROM personal_info"
+_COHORT_MEMBERS = "SELECT user_id FROM cohort_members WHERE cohort = :cohort"
+_LISTED_MEMBERS = "SELECT value FROM json_each(:members)"
+
+_PERSONAL_SQL = '''
+    WITH members (user_id) AS ({members}),
+    ranked AS (SELECT p.user_id, p.id,
+                      row_number() OVER (PARTITION BY p.user_id ORDER BY p.date, p.id) AS from_first,
+                      row_number() OVER (PARTITION BY p.user_id ORDER BY p.date DESC, p.id DESC) AS from_last
+               FROM members m CROSS JOIN personal_info p ON p.user_id = m.user_id),
+    ends AS (SELECT user_id, max(CASE WHEN from_first = 1 THEN id END) AS first_id,
+                    max(CASE WHEN from_last = 1 THEN id END) AS last_id
+             FROM ranked GROUP BY user_id)
+    SELECT e.user_id, l.name, l.age, l.gender, l.height, l.weight, l.activity,
+           f.weight AS start_weight, f.date AS first_date
+    FROM ends e JOIN personal_info l ON l.id = e.last_id JOIN personal_info f ON f.id = e.first_id'''
+
+_WELLBEING_SQL = '''
+    WITH members (user_id) AS ({members})
+    SELECT r.user_id, r.metric, sum(r.total) / sum(r.count)
+    FROM members m CROSS JOIN rollups r
+      ON r.user_id = m.user_id AND r.metric IN ('mood', 'sleep_hours') AND r.period = 'week'
+     AND r.period_start >= :week
+    GROUP BY r.user_id, r.metric'''
+
+_LOGGED_SQL = '''
+    WITH members (user_id) AS ({members})
+    SELECT d.user_id, count(DISTINCT d.date)
+    FROM members m CROSS JOIN daily_checklist d ON d.user_id = m.user_id AND d.date >= :since AND d.date <= :today
+    GROUP BY d.user_id'''
+
+
+def cohort_names(conn):
+    return [name for (name,) in conn.execute("SELECT DISTINCT cohort FROM cohort_members ORDER BY cohort")]
+
+
+# Replace a cohort's members
+def save_cohort(conn, name, user_ids):
+    with atomic(conn):
+        conn.execute("DELETE FROM cohort_members WHERE cohort = ?", (name,))
+        conn.executemany("INSERT OR IGNORE INTO cohort_members (cohort, user_id) VALUES (?, ?)",
+                         [(name, user_id) for user_id in user_ids])
+
+
+def delete_cohort(conn, name):
+    with atomic(conn):
+        conn.execute("DELETE FROM cohort_members WHERE cohort = ?", (name,))
+
+
+# Vectorized calculate_bmi: 0 where weight or height is missing
+def bmi(weight, height):
+    weight = np.asarray(weight, dtype=float)
+    height = np.asarray(height, dtype=float) / 100
+    with np.errstate(divide='ignore', invalid='ignore'):
+        values = np.where((weight > 0) & (height > 0), weight / height ** 2, 0.0)
+    return np.round(np.nan_to_num(values), 2)
+
+
+# Vectorized calculate_calories: Mifflin-St Jeor BMR times the activity
+# multiplier; 0 where any input is missing
+def calorie_targets(age, gender, weight, height, activity):
+    age, weight, height = (pd.to_numeric(pd.Series(values), errors='coerce').fillna(0).to_numpy()
+                           for values in (age, weight, height))
+    gender = pd.Series(gender).fillna('').to_numpy()
+    multiplier = pd.Series(activity).map(ACTIVITY_MULTIPLIERS).fillna(0).to_numpy()
+    bmr = 10 * weight + 6.25 * height - 5 * age + np.where(gender == "Male", 5, -161)
+    complete = (age > 0) & (weight > 0) & (height > 0) & (gender != '') & (multiplier > 0)
+    return np.where(complete, np.round(bmr * multiplier), 0).astype(int)
+
+
+def bmi_category(values):
+    bounds = [bound for bound, _ in BMI_CATEGORIES]
+    labels = np.array([label for _, label in BMI_CATEGORIES])
+    return labels[np.searchsorted(bounds, values, side='right') - 1]
+
+
+# A query's rows as a DataFrame (as pd.read_sql_query, for any connection
+# of nubodhi.backends)
+def _read(conn, sql, params, index_col=None):
+    cursor = conn.execute(sql, params)
+    frame = pd.DataFrame.from_records(cursor.fetchall(), columns=[column[0] for column in cursor.description],
+                                      coerce_float=True)
+    return frame.set_index(index_col) if index_col else frame
+
+
+# One row per cohort member with their latest profile and metrics over the
+# last `days` days up to `today` (ISO date, default: today). `members`, a
+# list of user_ids, replaces the cohort's member list.
+def cohort_frame(conn, cohort=None, days=30, today=None, members=None):
+    today = today or Date.today().isoformat()
+    since = (Date.fromisoformat(today) - timedelta(days=days - 1)).isoformat()
+    params = {'cohort': cohort, 'since': since, 'today': today, 'week': period_starts(since)['week'],
+              'members': json.dumps(members)}
+    members = _LISTED_MEMBERS if members is not None else _COHORT_MEMBERS if cohort else _ALL_MEMBERS
+
+    frame = _read(conn, _PERSONAL_SQL.format(members=members), params, index_col='user_id')
+    wellbeing = _read(conn, _WELLBEING_SQL.format(members=members), params)
+    logged = _read(conn, _LOGGED_SQL.format(members=members), params, index_col='user_id')
+
+    if not wellbeing.empty:
+        wellbeing = wellbeing.pivot(index='user_id', columns='metric', values=wellbeing.columns[2])
+    frame['mood'] = wellbeing['mood'] if 'mood' in wellbeing else np.nan
+    frame['sleep_hours'] = wellbeing['sleep_hours'] if 'sleep_hours' in wellbeing else np.nan
+    frame['days_logged'] = logged.iloc[:, 0] if not logged.empty else 0
+    frame['days_logged'] = frame['days_logged'].fillna(0).astype(int)
+
+    frame['bmi'] = bmi(frame['weight'], frame['height'])
+    frame['bmi_category'] = bmi_category(frame['bmi'])
+    frame['calories'] = calorie_targets(frame['age'], frame['gender'], frame['weight'], frame['height'],
+                                        frame['activity'])
+    weight = pd.to_numeric(frame['weight'], errors='coerce')
+    start_weight = pd.to_numeric(frame['start_weight'], errors='coerce')
+    frame['weight_change'] = (weight - start_weight).where((weight > 0) & (start_weight > 0))
+    # Compliance counts days since the client joined, if that is within the window
+    first = pd.to_datetime(frame['first_date'], format='%Y-%m-%d', errors='coerce')
+    start = first.where(first > pd.Timestamp(since), pd.Timestamp(since))
+    window = (pd.Timestamp(today) - start).dt.days + 1
+    frame['compliance'] = (frame['days_logged'] / window.clip(lower=1)).clip(upper=1.0)
+    return frame.drop(columns=['start_weight', 'first_date']).sort_index()
+
+
+# cohort_frame for a backend: cohort members come from the main store,
+# their rows from every shard
+def backend_cohort_frame(db, cohort=None, days=30, today=None):
+    stores = db.stores()
+    if stores == [db.store()]:
+        with db.connection() as conn:
+            return cohort_frame(conn, cohort, days, today)
+    members = None
+    if cohort:
+        with db.connection() as conn:
+            members = [user_id for (user_id,) in conn.execute(_COHORT_MEMBERS, {'cohort': cohort})]
+    frames = []
+    for store in stores:
+        with store.connection() as conn:
+            frames.append(cohort_frame(conn, days=days, today=today, members=members))
+    return pd.concat([frame for frame in frames if not frame.empty] or frames[:1]).sort_index()
+
+
+# Cohort-level figures for the dashboard header
+def cohort_summary(frame):
+    if frame.empty:
+        return {'clients': 0}
+    known_bmi = frame['bmi'][frame['bmi'] > 0]
+    return {
+        'clients': len(frame),
+        'mean_bmi': known_bmi.mean() if not known_bmi.empty else None,
+        'bmi_categories': frame['bmi_category'].value_counts().to_dict(),
+        'mean_calories': frame['calories'][frame['calories'] > 0].mean(),
+        'mean_weight_change': frame['weight_change'].mean(),
+        'mean_mood': frame['mood'].mean(),
+        'mean_sleep_hours': frame['sleep_hours'].mean(),
+        'mean_compliance': frame['compliance'].mean(),
+        'active_clients': int((frame['days_logged'] > 0).sum()),
+    }
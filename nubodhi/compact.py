@@ -0,0 +1,229 @@
+"""Collapse duplicate daily rows and hand the freed space back.
+
+Before saves of daily data types (personal info, the daily checklist, mood
+and measurements; see ``schema.Table``) became upserts, every click of a
+save button appended another row for the same day. Compaction keeps the
+last row saved for each (user_id, date) and deletes the rest, then swaps
+the table's plain (user_id, date) index for the unique one the upserts
+need.
+
+It runs online: users are processed in batches of about ``batch_rows``
+rows, each batch in its own
+short transaction that also rebuilds the rollups of the users it changed,
+with an optional pause in between so the app's writes get the lock. Only
+the last step per table (a final sweep for duplicates saved meanwhile, then
+building the unique index) holds the write lock for a whole-table pass.
+
+Opening a database does not compact it (see ``service.prepare_store``):
+the app runs ``compact_in_background`` on every store that needs it, or the
+CLI below does it with progress on the terminal. Until a table's unique
+index exists, saves to it delete the day's rows and insert instead of
+upserting (see ``schema.insert_rows_statements``), so they work throughout.
+
+Freed pages are returned to the filesystem with ``PRAGMA
+incremental_vacuum`` in small steps. That needs ``auto_vacuum =
+INCREMENTAL``, which new databases get (see ``db.PRAGMAS``); an older
+database needs one full ``VACUUM`` to switch (``--enable-incremental``).
+
+The database is a file path or a backend spec (see ``nubodhi.backends``);
+a sharded backend is compacted one shard at a time.
+
+Usage: python -m nubodhi.compact [nubodhi_data.db | sharded:data] [--batch-rows N] [--pause S] [--enable-incremental]
+"""
+import argparse
+import logging
+import threading
+import time
+
+from .db import atomic
+from .rollups import rebuild_rollups
+from .schema import TABLES, init_schema, tables_to_compact, unique_index
+
+logger = logging.getLogger(__name__)
+
+BATCH_ROWS = 5000
+VACUUM_PAGES = 1000
+# Seconds compact_in_background sleeps between batches, leaving the write
+# lock to the app
+BACKGROUND_PAUSE = 0.05
+
+
+def needs_compaction(conn):
+    return bool(tables_to_compact(conn))
+
+
+# Delete all but the last row of each (user_id, date) among `where`, and
+# rebuild the table's rollups for the users that had duplicates. Returns
+# rows deleted.
+def _collapse(conn, table, where, params, stats):
+    users = [row[0] for row in conn.execute(
+        f"SELECT DISTINCT user_id FROM (SELECT user_id FROM {table.name} WHERE {where} "
+        f"GROUP BY user_id, date HAVING count(*) > 1)", params)]
+    if not users:
+        return 0
+    marks = ', '.join('?' * len(users))
+    removed = conn.execute(
+        f"DELETE FROM {table.name} WHERE user_id IN ({marks}) AND id NOT IN "
+        f"(SELECT max(id) FROM {table.name} WHERE user_id IN ({marks}) GROUP BY user_id, date)",
+        users + users).rowcount
+    rebuild_rollups(conn, users, [data_type for data_type, other in TABLES.items() if other is table])
+    stats['users'] += len(users)
+    return removed
+
+
+def _locked(stats, start):
+    stats['max_lock_ms'] = max(stats['max_lock_ms'], (time.perf_counter() - start) * 1000)
+
+
+# The next users after last_user, with about batch_rows rows between them
+# (at least one user)
+def _next_users(conn, table, last_user, batch_rows):
+    users, rows = [], 0
+    cursor = conn.execute(f"SELECT user_id, count(*) FROM {table.name} WHERE user_id > ? GROUP BY user_id "
+                          f"ORDER BY user_id", (last_user,))
+    for user_id, count in cursor:
+        users.append(user_id)
+        rows += count
+        if rows >= batch_rows:
+            break
+    cursor.close()
+    return users
+
+
+def compact(conn, batch_rows=BATCH_ROWS, pause=0.0, progress=None):
+    init_schema(conn)
+    started = time.perf_counter()
+    stats = {'removed': 0, 'users': 0, 'batches': 0, 'max_lock_ms': 0.0, 'tables': {}}
+    for table in tables_to_compact(conn):
+        stats['tables'][table.name] = 0
+        last_user = ''
+        while True:
+            users = _next_users(conn, table, last_user, batch_rows)
+            if not users:
+                break
+            start = time.perf_counter()
+            with atomic(conn):
+                removed = _collapse(conn, table, f"user_id IN ({', '.join('?' * len(users))})", users, stats)
+            _locked(stats, start)
+            stats['tables'][table.name] += removed
+            stats['removed'] += removed
+            last_user = users[-1]
+            stats['batches'] += 1
+            if progress:
+                progress(table.name, stats)
+            if pause:
+                time.sleep(pause)
+        # Rows another process saved behind the cursor, then the unique index
+        # (from here on every save is an upsert)
+        start = time.perf_counter()
+        # (IF [NOT] EXISTS: another process may be compacting too)
+        with atomic(conn):
+            removed = _collapse(conn, table, "1", (), stats)
+            conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {unique_index(table)} ON {table.name} (user_id, date)")
+            conn.execute(f"DROP INDEX IF EXISTS idx_{table.name}_user_date")
+        _locked(stats, start)
+        stats['tables'][table.name] += removed
+        stats['removed'] += removed
+    stats['seconds'] = time.perf_counter() - started
+    return stats
+
+
+# Compact the stores of a backend that need it in a daemon thread, logging
+# progress; each store's saves go back to upserts once it is done. Returns
+# the thread, or None if there is nothing to do.
+def compact_in_background(db, batch_rows=BATCH_ROWS, pause=BACKGROUND_PAUSE):
+    stores = [store for store in db.stores() if store.compacting]
+    if not stores:
+        return None
+
+    def report(table, stats):
+        if stats['batches'] % 20 == 0:
+            logger.info("compacting %s: %d rows removed so far, %d batches", table, stats['removed'], stats['batches'])
+
+    def run():
+        for store in stores:
+            try:
+                with store.connection() as conn:
+                    stats = compact(conn, batch_rows, pause, progress=report)
+                    store.compacting = frozenset(table.name for table in tables_to_compact(conn))
+            except Exception:
+                logger.exception("compacting %s failed; run python -m nubodhi.compact", store.path)
+                continue
+            logger.info("compacted %s: %d duplicate rows removed in %.1fs (longest write lock %.0f ms)",
+                        store.path, stats['removed'], stats['seconds'], stats['max_lock_ms'])
+
+    thread = threading.Thread(target=run, name='nubodhi-compact', daemon=True)
+    thread.start()
+    return thread
+
+
+# Return free pages to the filesystem, `pages` at a time. Returns bytes
+# freed, or None if the database does not use incremental auto-vacuum.
+def incremental_vacuum(conn, pages=VACUUM_PAGES, pause=0.0):
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        return None
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    freed = 0
+    while True:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if not free:
+            return freed * page_size
+        conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+        freed += free - conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if pause:
+            time.sleep(pause)
+
+
+def _compact_store(conn, args):
+    def report(table, stats):
+        if stats['batches'] % 20 == 0:
+            print(f"  {table}: {stats['removed']:,} rows removed so far, {stats['batches']:,} batches")
+
+    stats = compact(conn, args.batch_rows, args.pause, progress=report)
+    for table, removed in stats['tables'].items():
+        print(f"  {table:<18} {removed:10,} duplicate rows removed")
+    print(f"Removed {stats['removed']:,} rows for {stats['users']:,} users in {stats['seconds']:.1f}s "
+          f"({stats['batches']:,} batches, longest write lock {stats['max_lock_ms']:.0f} ms)")
+
+    if args.enable_incremental and conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+        start = time.perf_counter()
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print(f"Switched to incremental auto-vacuum (full VACUUM, {time.perf_counter() - start:.1f}s)")
+    start = time.perf_counter()
+    freed = incremental_vacuum(conn, pause=args.pause)
+    if freed is None:
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+        print(f"{free / 2 ** 20:.1f} MiB free inside the file; run with --enable-incremental to reclaim it")
+    else:
+        print(f"Reclaimed {freed / 2 ** 20:.1f} MiB in {time.perf_counter() - start:.1f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove duplicate daily rows and reclaim their space.")
+    parser.add_argument('db_path', nargs='?', default='nubodhi_data.db', help="database path or backend spec")
+    parser.add_argument('--batch-rows', type=int, default=BATCH_ROWS, help="rows per transaction (whole users)")
+    parser.add_argument('--pause', type=float, default=0.0, help="seconds to sleep between batches")
+    parser.add_argument('--enable-incremental', action='store_true',
+                        help="switch an older database to incremental auto-vacuum (one full VACUUM)")
+    args = parser.parse_args(argv)
+
+    # Imported here: opening a backend goes through the service, which
+    # imports this module. prepare=False, or opening would compact first.
+    from .backends import open_backend
+    db = open_backend(args.db_path, prepare=False)
+    stores = db.stores()
+    try:
+        for store in stores:
+            if len(stores) > 1:
+                print(f"{store.path}:")
+            # Store connections autocommit, so atomic() and the PRAGMAs
+            # control transactions
+            with store.connection() as conn:
+                _compact_store(conn, args)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
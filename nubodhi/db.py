@@ -0,0 +1,169 @@
+"""Shared SQLite access for the whole process.
+
+One ``Database`` is created per process (the app keeps it in Streamlit's
+resource cache). It hands out pooled connections, one thread at a time, with
+WAL and tuned pragmas applied, and groups writes into transactions so a
+button handler commits once instead of once per INSERT.
+
+    db = Database('nubodhi_data.db')
+    with db.connection() as conn:      # reads
+        rows = load_values(conn, user_id, 'mood_log')
+    with db.transaction() as conn:     # writes, committed together
+        save_value(conn, ...)
+        save_value(conn, ...)
+    with db.snapshot() as conn:        # several reads of one state
+        ...
+
+Nested ``connection()``/``transaction()`` calls on the same thread reuse the
+outer connection; nested transactions become savepoints. ``on_commit()``
+defers work such as cache updates until the outermost transaction commits.
+
+``Database`` is also the single-file storage backend: the methods take the
+``user_id`` whose rows they are for, which only sharded backends use (see
+``nubodhi.backends``).
+"""
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from itertools import count
+
+PRAGMAS = {
+    # Takes effect on new databases only (it must precede WAL); lets
+    # nubodhi.compact hand free pages back without a full VACUUM
+    'auto_vacuum': 'INCREMENTAL',
+    'journal_mode': 'WAL',         # readers never block the writer
+    'synchronous': 'NORMAL',       # fsync at checkpoints, not every commit (safe with WAL)
+    'busy_timeout': 5000,          # wait for the write lock instead of failing
+    'temp_store': 'MEMORY',
+    'cache_size': -16000,          # ~16 MB page cache per connection
+    'mmap_size': 128 * 1024 * 1024,
+}
+
+_savepoints = count()
+
+
+# Run a block in a transaction on a plain connection: BEGIN IMMEDIATE at the
+# outermost level (taking the write lock up front avoids upgrade deadlocks),
+# a savepoint when already inside one
+@contextmanager
+def atomic(conn):
+    if conn.in_transaction:
+        name = f"sp_{next(_savepoints)}"
+        conn.execute(f"SAVEPOINT {name}")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute(f"ROLLBACK TO {name}")
+            conn.execute(f"RELEASE {name}")
+            raise
+        conn.execute(f"RELEASE {name}")
+        return
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+class Database:
+    def __init__(self, path, pragmas=None, max_idle=8):
+        self.path = path
+        self.pragmas = dict(PRAGMAS if pragmas is None else pragmas)
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._local = threading.local()
+        # Daily tables nubodhi.compact has not finished (see service.prepare_store)
+        self.compacting = frozenset()
+
+    def _open(self):
+        # isolation_level=None: no implicit transactions; atomic() decides
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    # Borrow a connection for the current thread
+    @contextmanager
+    def connection(self, user_id=None):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            yield conn
+            return
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            conn = self._open()
+        self._local.conn = conn
+        try:
+            yield conn
+        finally:
+            self._local.conn = None
+            if conn.in_transaction:
+                conn.rollback()
+            try:
+                self._idle.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self, user_id=None):
+        with self.connection() as conn:
+            outermost = not conn.in_transaction
+            if outermost:
+                self._local.on_commit = []
+            mark = len(self._local.on_commit)
+            try:
+                with atomic(conn):
+                    yield conn
+            except BaseException:
+                # Forget callbacks registered inside the rolled-back block
+                del self._local.on_commit[mark:]
+                raise
+            if outermost:
+                callbacks, self._local.on_commit = self._local.on_commit, []
+                for callback in callbacks:
+                    callback()
+
+    # Reads that must see one consistent state: a deferred (read)
+    # transaction, which under WAL never blocks or waits for writers
+    @contextmanager
+    def snapshot(self, user_id=None):
+        with self.connection() as conn:
+            if conn.in_transaction:
+                yield conn
+                return
+            conn.execute("BEGIN")
+            try:
+                yield conn
+            finally:
+                conn.rollback()
+
+    # Run callback once the current transaction commits (right away if none
+    # is open); dropped if it rolls back
+    def on_commit(self, callback, user_id=None):
+        conn = getattr(self._local, 'conn', None)
+        callbacks = getattr(self._local, 'on_commit', None)
+        if conn is None or not conn.in_transaction or callbacks is None:
+            callback()
+        else:
+            callbacks.append(callback)
+
+    # The store holding a user's rows, every per-user store (for queries
+    # across users), and user IDs grouped by store; one file holds them all
+    def store(self, user_id=None):
+        return self
+
+    def stores(self):
+        return [self]
+
+    def partition(self, user_ids):
+        return [list(user_ids)]
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
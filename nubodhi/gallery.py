@@ -0,0 +1,110 @@
+"""Progress-photo gallery: filtering, pagination and a cached file index.
+
+The gallery only renders one page of entries per rerun, and only that
+page's entries are built from the history: filtering, paging and the
+compare view work on ``date_order``, the entries' positions sorted by date
+(read from the history's date column; the app caches it per user and
+change seq). Whether a photo
+exists on disk, its size and its rendered thumbnails are kept in a
+``PhotoIndex`` shared by all sessions, so a rerun does no filesystem calls
+for photos it has already seen. The index is dropped when the ``uploads``
+table changes (a new upload, or gc removing files). Entries still waiting
+for a thumbnail are re-checked until it appears.
+"""
+import math
+import os
+import threading
+from collections import namedtuple
+
+from .thumbnails import SIZES, derivative_for
+from .uploads import UPLOAD_ROOT
+
+PhotoInfo = namedtuple('PhotoInfo', ['path', 'exists', 'size', 'derived'])
+
+PAGE_SIZES = (3, 5, 10)
+
+
+class PhotoIndex:
+    def __init__(self, root=UPLOAD_ROOT):
+        self.root = root
+        self._entries = {}
+        self._generation = None
+        self._lock = threading.Lock()
+
+    # Drop everything if the upload store changed since the last sync
+    def sync(self, generation):
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+
+    def lookup(self, path):
+        with self._lock:
+            info = self._entries.get(path)
+        if info is not None and (not info.exists or all(info.derived.values())):
+            return info
+        if info is None:
+            try:
+                size = os.path.getsize(path)
+                exists = True
+            except OSError:
+                size, exists = 0, False
+        else:
+            size, exists = info.size, info.exists
+        derived = {name: derivative_for(path, name, self.root) if exists else None for name in SIZES}
+        info = PhotoInfo(path, exists, size, derived)
+        with self._lock:
+            self._entries[path] = info
+        return info
+
+    def invalidate(self, path=None):
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(path, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# [(date, position)] of a History's entries, newest first; entries saved on
+# the same day stay in save order
+def date_order(entries):
+    dates = entries.dates()
+    positions = sorted(range(len(dates)), key=dates.__getitem__, reverse=True)
+    return [(dates[i], i) for i in positions]
+
+
+# Positions of the entries dated within [start, end] (ISO strings, either
+# may be None), newest first
+def filter_positions(order, start=None, end=None):
+    return [i for date, i in order if (start is None or date >= start) and (end is None or date <= end)]
+
+
+# Entries dated within [start, end], newest first
+def filter_entries(entries, start=None, end=None):
+    return [entries[i] for i in filter_positions(date_order(entries), start, end)]
+
+
+# One page of entries (pages count from 1) and the number of pages
+def paginate(entries, page, page_size):
+    pages = max(1, math.ceil(len(entries) / page_size))
+    page = min(max(1, page), pages)
+    start = (page - 1) * page_size
+    return entries[start:start + page_size], pages
+
+
+# Distinct photo dates, newest first
+def entry_dates(order):
+    return list(dict.fromkeys(date for date, _ in order))
+
+
+# Latest entry saved on a date, or None; several saves on one day are merged
+# so the newest photo of each view wins
+def entry_for_date(entries, order, date):
+    photos = {}
+    for other, i in order:
+        if other == date:
+            photos.update({view: path for view, path in entries[i]['photos'].items() if path})
+    return {'date': date, 'photos': photos} if photos else None
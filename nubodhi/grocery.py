@@ -0,0 +1,172 @@
+"""Weekly shopping lists from the meal plans.
+
+Free-text ingredient lines such as "1 cup chickpea flour", "200g paneer",
+"2 garlic cloves" or "Salt, pepper to taste" are parsed into quantity, unit
+and item. Units are normalized to millilitres, grams, cloves or a plain count, and
+lines for the same item are added together over a range of days. "Leftover
+..." lines are already covered by an earlier meal, so they are listed
+separately and not bought again.
+
+``GroceryPlanner`` precomputes the full-week list for every diet and
+memoizes other day ranges, so the Meals page can show and download a list
+without re-parsing the plans on each rerun.
+"""
+import csv
+import io
+import re
+from collections import namedtuple
+from fractions import Fraction
+from functools import lru_cache
+
+# unit -> (dimension, size in the dimension's base unit: ml, g or cloves);
+# lines without a unit are plain counts
+UNITS = {
+    'cup': ('volume', 240), 'cups': ('volume', 240),
+    'tbsp': ('volume', 15), 'tsp': ('volume', 5),
+    'ml': ('volume', 1), 'l': ('volume', 1000),
+    'g': ('mass', 1), 'kg': ('mass', 1000),
+    'clove': ('clove', 1), 'cloves': ('clove', 1),
+}
+# Bought anyway, never worth a line on the list
+SKIP_ITEMS = {'water'}
+# Descriptions dropped when grouping lines for the same item
+_DESCRIPTORS = re.compile(r'\b(small|medium|large|boiled|chopped|grated|mashed|fresh)\b\s*')
+_QUANTITY = re.compile(r'^(?P<quantity>\d+(?:\.\d+)?(?:/\d+)?)\s*(?P<unit>[a-z]+\b)?\s*(?P<item>.*)$')
+
+# quantity: Fraction or None (to taste), unit: as written, item: grouping key
+Ingredient = namedtuple('Ingredient', ['quantity', 'unit', 'item', 'text', 'leftover', 'to_taste'])
+# quantity in the dimension's base unit (None: to taste), meals: number of uses
+ShoppingItem = namedtuple('ShoppingItem', ['item', 'quantity', 'dimension', 'meals'])
+
+
+def _singular(word):
+    if word.endswith('oes'):
+        return word[:-2]
+    if word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+
+def _item_key(text):
+    text = re.sub(r'\(.*?\)', '', text.lower())
+    text = _DESCRIPTORS.sub('', text)
+    words = text.split()
+    if words:
+        words[-1] = _singular(words[-1])
+    return ' '.join(words)
+
+
+# Parse one ingredient line into one or more Ingredients ("Salt, pepper"
+# names two items)
+@lru_cache(maxsize=1024)
+def parse_ingredient(text):
+    line = text.strip()
+    if line.lower().startswith('leftover'):
+        return (Ingredient(None, None, _item_key(line[len('leftover'):]), text, True, False),)
+    match = _QUANTITY.match(line.lower())
+    if match is None:
+        # "Salt to taste", "Salt, pepper": no amount given
+        names = re.sub(r'\bto taste\b', '', line.lower())
+        return tuple(Ingredient(None, None, _item_key(name), text, False, True)
+                     for name in names.split(',') if name.strip())
+    quantity = Fraction(match['quantity'])
+    unit, item = match['unit'], match['item']
+    if unit not in UNITS:
+        item = f"{unit} {item}" if unit else item
+        unit = None
+    # "2 garlic cloves": the unit follows the item
+    words = item.split()
+    if unit is None and words and words[-1] in UNITS and UNITS[words[-1]][0] == 'clove':
+        unit = words[-1]
+        item = ' '.join(words[:-1])
+    return (Ingredient(quantity, unit, _item_key(item), text, False, False),)
+
+
+def _base_quantity(ingredient):
+    if ingredient.unit is None:
+        return 'count', ingredient.quantity
+    dimension, size = UNITS[ingredient.unit]
+    return dimension, ingredient.quantity * size
+
+
+# Consolidate the ingredient lines of some meals. Returns (items to buy,
+# sorted by item; leftover dishes reused)
+def aggregate(ingredient_lines):
+    totals = {}
+    leftovers = []
+    for text in ingredient_lines:
+        for ingredient in parse_ingredient(text):
+            if ingredient.leftover:
+                leftovers.append(ingredient.item)
+                continue
+            if ingredient.item in SKIP_ITEMS:
+                continue
+            if ingredient.to_taste:
+                key = (ingredient.item, None)
+                quantity = None
+            else:
+                dimension, quantity = _base_quantity(ingredient)
+                key = (ingredient.item, dimension)
+            total, meals = totals.get(key, (None if quantity is None else Fraction(0), 0))
+            totals[key] = (None if quantity is None else total + quantity, meals + 1)
+    items = [ShoppingItem(item, quantity, dimension, meals)
+             for (item, dimension), (quantity, meals) in totals.items()]
+    items.sort(key=lambda entry: (entry.item, entry.dimension or ''))
+    # Tuples: memoized lists are shared between sessions
+    return tuple(items), tuple(sorted(set(leftovers)))
+
+
+def _fraction_text(value):
+    value = Fraction(value).limit_denominator(4)
+    whole, rest = divmod(value, 1)
+    if not rest:
+        return str(whole)
+    return f"{whole} {rest}" if whole else str(rest)
+
+
+# Human-readable amount in the largest sensible unit
+def format_quantity(item):
+    if item.quantity is None:
+        return "to taste"
+    quantity = item.quantity
+    if item.dimension == 'volume':
+        for unit, size in (('cup', 240), ('tbsp', 15), ('tsp', 5)):
+            if quantity >= size or unit == 'tsp':
+                amount = Fraction(quantity / size).limit_denominator(4)
+                plural = 's' if unit == 'cup' and amount > 1 else ''
+                return f"{_fraction_text(amount)} {unit}{plural}"
+    if item.dimension == 'mass':
+        return f"{float(quantity) / 1000:g} kg" if quantity >= 1000 else f"{float(quantity):g} g"
+    if item.dimension == 'clove':
+        return f"{_fraction_text(quantity)} clove{'s' if quantity > 1 else ''}"
+    return _fraction_text(quantity)
+
+
+def to_csv(items):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(['Item', 'Quantity', 'Used in meals'])
+    for item in items:
+        writer.writerow([item.item, format_quantity(item), item.meals])
+    return buffer.getvalue()
+
+
+class GroceryPlanner:
+    def __init__(self, plans):
+        self.plans = plans
+        self._lists = lru_cache(maxsize=256)(self._build)
+        # Full weeks are what guides ask for most
+        for diet, days in plans.items():
+            self._lists(diet, tuple(days))
+
+    def _build(self, diet, days):
+        plan = self.plans[diet]
+        return aggregate(text for day in days for details in plan[day].values()
+                         for text in details['Ingredients'])
+
+    # (items, leftovers) for the days from first to last inclusive, in plan order
+    def shopping_list(self, diet, first=None, last=None):
+        days = list(self.plans[diet])
+        start = days.index(first) if first else 0
+        end = days.index(last) if last else len(days) - 1
+        return self._lists(diet, tuple(days[start:end + 1]))
@@ -0,0 +1,279 @@
+"""Compact, column-oriented history for one user and data_type.
+
+The tracking page keeps a history per data_type in session state, and the
+shared read cache keeps another. Held as lists of per-day dicts (with nested
+``measurements``/``metrics`` dicts and a date string in each), a year of one
+client's history costs hundreds of kilobytes per session. ``History`` stores
+the same rows as columns instead:
+- dates as integer day ordinals in an ``array('i')``
+- INTEGER and REAL columns as ``array('d')``, with NaN for missing values
+- BOOLEAN columns as ``array('b')``, with -1 for missing values
+- TEXT columns as plain lists
+
+Histories of daily data types (see ``schema.Table``) mirror the storage
+upsert: adding a row for a date that is already there replaces it.
+
+It is a read-only ``Sequence`` of history entries plus ``append``, so code
+written for the old lists keeps working: ``history[-1]``, iteration and
+slicing build the same ``{'date': ..., ...}`` dicts ``schema.ENTRY_DECODERS``
+does, on demand. Charts read whole columns with ``ordinals`` and ``column``
+and never build the dicts.
+
+A value that does not fit its column's array (text in an INTEGER column, or
+a date that is not ``YYYY-MM-DD``, both possible in migrated data) turns
+that column into a plain list, so nothing is ever lost or altered.
+"""
+import math
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from collections.abc import Sequence
+from datetime import date as Date
+
+from .schema import ENTRY_DECODERS, TABLES, encode_row
+
+_NUMERIC = {'INTEGER', 'REAL'}
+_MISSING_BOOL = -1
+
+# kinds: sql type per column, paths: history-entry key path -> column index,
+# decode: the table's entry decoder, scalar: values are one bare column,
+# daily: one row per date
+_Layout = namedtuple('_Layout', ['kinds', 'paths', 'decode', 'scalar', 'daily'])
+
+
+def _layout(table):
+    scalar = len(table.columns) == 1 and not table.columns[0][2]
+    paths = {}
+    for i, (column, _, path) in enumerate(table.columns):
+        # Scalar values are keyed by column name in history entries
+        paths[path or (column,)] = i
+    return _Layout([sql_type for _, sql_type, _ in table.columns], paths, ENTRY_DECODERS[table.name], scalar,
+                   table.daily)
+
+
+_LAYOUTS = {data_type: _layout(table) for data_type, table in TABLES.items()}
+
+
+def _empty_column(kind):
+    if kind in _NUMERIC:
+        return array('d')
+    if kind == 'BOOLEAN':
+        return array('b')
+    return []
+
+
+def _pack(kind, value):
+    if kind in _NUMERIC:
+        if value is None:
+            return math.nan
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise TypeError(value)
+        # Beyond 2**53 a float would round the integer
+        if isinstance(value, int) and abs(value) > 2 ** 53:
+            raise TypeError(value)
+        return value
+    if kind == 'BOOLEAN':
+        if value is None:
+            return _MISSING_BOOL
+        if value not in (0, 1):
+            raise TypeError(value)
+        return int(value)
+    return value
+
+
+def _unpack(kind, value):
+    if kind in _NUMERIC:
+        if value != value:  # NaN
+            return None
+        # REAL columns stay floats; INTEGER columns give back ints
+        return int(value) if kind == 'INTEGER' and value.is_integer() else value
+    if kind == 'BOOLEAN':
+        return None if value == _MISSING_BOOL else value
+    return value
+
+
+def _is_iso_date(text):
+    # fromisoformat also accepts forms like '20240501' that would not round-trip
+    return isinstance(text, str) and len(text) == 10 and text[4] == '-' and text[7] == '-'
+
+
+def _pack_date(text):
+    if not _is_iso_date(text):
+        raise TypeError(text)
+    try:
+        return Date.fromisoformat(text).toordinal()
+    except ValueError:
+        raise TypeError(text) from None
+
+
+# A whole column at once; falls back to a list like _insert does
+def _bulk_column(kind, values):
+    if kind in _NUMERIC:
+        if kind == 'INTEGER' and any(type(value) is int and abs(value) > 2 ** 53 for value in values):
+            return list(values)
+        try:
+            return array('d', [math.nan if value is None else value for value in values])
+        except TypeError:
+            return list(values)
+    if kind == 'BOOLEAN':
+        if not set(values) <= {0, 1, None}:
+            return list(values)
+        return array('b', [_MISSING_BOOL if value is None else value for value in values])
+    return list(values)
+
+
+def _bulk_dates(dates):
+    if all(map(_is_iso_date, dates)):
+        try:
+            return array('i', [Date.fromisoformat(date).toordinal() for date in dates])
+        except ValueError:
+            pass
+    return list(dates)
+
+
+class History(Sequence):
+    __slots__ = ('data_type', 'user_id', '_layout', '_dates', '_columns', '_shared')
+
+    def __init__(self, data_type, user_id, rows=()):
+        self.data_type = data_type
+        self.user_id = user_id
+        self._layout = _LAYOUTS[data_type]
+        self._dates = array('i')
+        self._columns = [_empty_column(kind) for kind in self._layout.kinds]
+        self._shared = False
+        for date, row in rows:
+            self.append_row(date, row)
+
+    # Build from whole columns: dates and one sequence of values per table
+    # column, in table order (much faster than appending row by row)
+    @classmethod
+    def from_columns(cls, data_type, user_id, dates, columns):
+        history = cls(data_type, user_id)
+        history._dates = _bulk_dates(dates)
+        history._columns = [_bulk_column(kind, values) for kind, values in zip(history._layout.kinds, columns)]
+        return history
+
+    def __len__(self):
+        return len(self._dates)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._entry(i) for i in range(*index.indices(len(self._dates)))]
+        if index < 0:
+            index += len(self._dates)
+        if not 0 <= index < len(self._dates):
+            raise IndexError('history index out of range')
+        return self._entry(index)
+
+    def __repr__(self):
+        return f"History({self.data_type!r}, {self.user_id!r}, {len(self)} entries)"
+
+    def _entry(self, i):
+        row = [_unpack(kind, column[i]) if isinstance(column, array) else column[i]
+               for kind, column in zip(self._layout.kinds, self._columns)]
+        return self._layout.decode(self.user_id, self.date(i), row)
+
+    def date(self, i):
+        if isinstance(self._dates, array):
+            return Date.fromordinal(self._dates[i]).isoformat()
+        return self._dates[i]
+
+    # All dates as ISO strings
+    def dates(self):
+        if isinstance(self._dates, array):
+            return [Date.fromordinal(ordinal).isoformat() for ordinal in self._dates]
+        return list(self._dates)
+
+    # Dates as day ordinals (date.toordinal), or None if some date is not ISO
+    def ordinals(self):
+        return self._dates if isinstance(self._dates, array) else None
+
+    # The stored column for a history-entry key path such as ('mood',) or
+    # ('measurements', 'waist'): an array of floats (NaN for missing) for
+    # numeric columns, else a list. None for unknown paths. Read-only.
+    def column(self, path):
+        i = self._layout.paths.get(tuple(path))
+        return None if i is None else self._columns[i]
+
+    # Add a row of column values in table order (as stored in the database)
+    def append_row(self, date, row):
+        self._own()
+        self._drop_date(date)
+        self._insert(len(self._dates), date, row)
+
+    # Add a row after any rows with the same or an earlier date
+    def add_row(self, date, row):
+        self._own()
+        self._drop_date(date)
+        if isinstance(self._dates, array):
+            try:
+                position = bisect_right(self._dates, _pack_date(date))
+            except TypeError:
+                position = len(self._dates)
+        else:
+            position = bisect_right(self._dates, date)
+        self._insert(position, date, row)
+
+    # Add a history entry ({'date': ..., ...}, as the tracking page builds them)
+    def append(self, entry):
+        if self._layout.scalar:
+            row = [entry.get(next(iter(self._layout.paths))[0])]
+        else:
+            row = encode_row(TABLES[self.data_type], entry)
+        self.append_row(entry['date'], row)
+
+    def extend(self, entries):
+        for entry in entries:
+            self.append(entry)
+
+    # Stop sharing columns with copies before changing them
+    def _own(self):
+        if self._shared:
+            self._dates = self._dates[:]
+            self._columns = [column[:] for column in self._columns]
+            self._shared = False
+
+    # Daily data types keep one row per date: remove the current one
+    def _drop_date(self, date):
+        if not self._layout.daily:
+            return
+        if isinstance(self._dates, array):
+            try:
+                date = _pack_date(date)
+            except TypeError:
+                return
+        for i in reversed([i for i, other in enumerate(self._dates) if other == date]):
+            del self._dates[i]
+            for column in self._columns:
+                del column[i]
+
+    def _insert(self, position, date, row):
+        if isinstance(self._dates, array):
+            try:
+                self._dates.insert(position, _pack_date(date))
+            except TypeError:
+                self._dates = self.dates()
+        if not isinstance(self._dates, array):
+            self._dates.insert(position, date)
+        for i, (kind, value) in enumerate(zip(self._layout.kinds, row)):
+            column = self._columns[i]
+            if isinstance(column, array):
+                try:
+                    column.insert(position, _pack(kind, value))
+                    continue
+                except (TypeError, OverflowError):
+                    column = self._columns[i] = [_unpack(kind, item) for item in column]
+            column.insert(position, value)
+
+    # An independent copy. The columns are shared until either side adds a
+    # row, so handing a cached history to each session costs nothing until
+    # the session saves something.
+    def copy(self):
+        other = History.__new__(History)
+        other.data_type = self.data_type
+        other.user_id = self.user_id
+        other._layout = self._layout
+        other._dates = self._dates
+        other._columns = list(self._columns)
+        other._shared = self._shared = True
+        return other
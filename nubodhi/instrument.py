@@ -0,0 +1,234 @@
+"""Lightweight timings and counters for finding where a rerun spends its time.
+
+A ``Recorder`` keeps a summary (count, sum, max) per metric name and label
+set, plus a bounded list of recent events:
+
+    recorder = Recorder(log_path='metrics.jsonl')
+    with recorder.context(user_id='u1', session='3f2a'):
+        with recorder.timer('sql', statement='insert:mood_log') as event:
+            event['rows'] = cursor.rowcount
+
+``timer`` records ``<name>_seconds``. Any number stored on the yielded
+event is summarized as ``<name>_<key>`` under the same labels, e.g.
+``sql_rows`` or ``upload_bytes``. Events also carry the thread's context
+fields, which are kept out of the summary labels: users and sessions
+belong in the JSON log, not in Prometheus series.
+
+Collectors (``add_collector``) are polled at export time for gauges that
+other components already track, such as cache hit rates. Export formats
+are Prometheus text (``to_prometheus``, ``write_prometheus``) and one JSON
+object per event appended to ``log_path``. Log lines are written in
+batches by a background thread through one open file, so recording an
+event does not wait on disk (unless the writer falls ``LOG_QUEUE_MAX``
+events behind). ``close()`` writes out what is queued; events recorded
+after it are kept in memory but not logged. It also runs at interpreter
+exit.
+"""
+import atexit
+import json
+import os
+import queue
+import re
+import tempfile
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PREFIX = 'nubodhi'
+LOG_QUEUE_MAX = 10000
+
+_STOP = object()
+
+_STATEMENT = re.compile(r'^\s*(INSERT|SELECT|UPDATE|DELETE|WITH)\b.*?\b(?:INTO|FROM|UPDATE)\s+(\w+)',
+                        re.IGNORECASE | re.DOTALL)
+
+
+# Short label for a SQL statement, e.g. 'insert:mood_log'; rollup upserts
+# are 'insert:rollups'
+def statement_label(sql):
+    match = _STATEMENT.match(sql)
+    if match is None:
+        return sql.split(None, 1)[0].lower() if sql.strip() else 'unknown'
+    return f"{match[1].lower()}:{match[2]}"
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{key}="{_escape(value)}"' for key, value in labels)
+    return '{' + pairs + '}'
+
+
+def _metric_name(name):
+    return re.sub(r'[^a-zA-Z0-9_]', '_', f"{PREFIX}_{name}")
+
+
+class Recorder:
+    def __init__(self, log_path=None, max_events=500):
+        self.log_path = log_path
+        self._summaries = {}  # (name, labels) -> [count, sum, max]
+        self._events = deque(maxlen=max_events)
+        self._collectors = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_export = 0.0
+        self._log_queue = None
+        # Guards _log_queue, so no event is queued behind the writer's stop
+        self._log_lock = threading.Lock()
+        if log_path:
+            self._log_queue = queue.Queue(maxsize=LOG_QUEUE_MAX)
+            self._log_thread = threading.Thread(target=self._write_log, args=(self._log_queue,),
+                                                name='nubodhi-metrics-log', daemon=True)
+            self._log_thread.start()
+            atexit.register(self.close)
+
+    # Fields added to every event recorded by this thread inside the block
+    @contextmanager
+    def context(self, **fields):
+        previous = getattr(self._local, 'fields', {})
+        self._local.fields = {**previous, **fields}
+        try:
+            yield
+        finally:
+            self._local.fields = previous
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            summary = self._summaries.get(key)
+            if summary is None:
+                self._summaries[key] = [1, value, value]
+            else:
+                summary[0] += 1
+                summary[1] += value
+                summary[2] = max(summary[2], value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        event = {}
+        start = time.perf_counter()
+        try:
+            yield event
+        finally:
+            seconds = time.perf_counter() - start
+            self.observe(f"{name}_seconds", seconds, **labels)
+            for key, value in event.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    self.observe(f"{name}_{key}", value, **labels)
+            self.record({'name': name, **labels, 'ms': round(seconds * 1000, 3), **event})
+
+    # Keep an event (and append it to the JSON log, if any)
+    def record(self, event):
+        event = {'ts': round(time.time(), 3), **getattr(self._local, 'fields', {}), **event}
+        with self._lock:
+            self._events.append(event)
+        with self._log_lock:
+            if self._log_queue is not None:
+                self._log_queue.put(event)
+
+    # Log writer thread: writes whatever is queued in one go, then flushes
+    def _write_log(self, log_queue):
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            while True:
+                events = [log_queue.get()]
+                while len(events) < LOG_QUEUE_MAX:
+                    try:
+                        events.append(log_queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = _STOP in events
+                f.write(''.join(json.dumps(event, default=str) + '\n' for event in events if event is not _STOP))
+                f.flush()
+                if stop:
+                    return
+
+    # Write out the queued log lines and stop the log writer
+    def close(self, timeout=5):
+        with self._log_lock:
+            if self._log_queue is None:
+                return
+            self._log_queue.put(_STOP)
+            self._log_queue = None
+        self._log_thread.join(timeout)
+
+    # func() -> {key: number}, exported as gauges named <name>_<key>
+    def add_collector(self, name, func):
+        self._collectors[name] = func
+
+    # Most recent events first
+    def events(self, limit=None):
+        with self._lock:
+            events = list(self._events)
+        events.reverse()
+        return events[:limit] if limit else events
+
+    # {name: [{labels..., count, sum, max, mean}]}
+    def summaries(self):
+        with self._lock:
+            items = [(name, labels, list(values)) for (name, labels), values in self._summaries.items()]
+        result = {}
+        for name, labels, (count, total, maximum) in sorted(items):
+            result.setdefault(name, []).append({**dict(labels), 'count': count, 'sum': total, 'max': maximum,
+                                                'mean': total / count})
+        return result
+
+    def gauges(self):
+        gauges = {}
+        for name, func in list(self._collectors.items()):
+            for key, value in (func() or {}).items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    gauges[f"{name}_{key}"] = value
+        return gauges
+
+    def snapshot(self):
+        return {'summaries': self.summaries(), 'gauges': self.gauges(), 'events': self.events(50)}
+
+    def to_prometheus(self):
+        lines = []
+        with self._lock:
+            items = sorted(self._summaries.items())
+        for name in dict.fromkeys(name for (name, _), _ in items):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric} summary")
+            maxima = []
+            for (other, labels), (count, total, maximum) in items:
+                if other != name:
+                    continue
+                lines.append(f"{metric}_count{_label_text(labels)} {count}")
+                lines.append(f"{metric}_sum{_label_text(labels)} {total:g}")
+                maxima.append(f"{metric}_max{_label_text(labels)} {maximum:g}")
+            lines.append(f"# TYPE {metric}_max gauge")
+            lines.extend(maxima)
+        for name, value in sorted(self.gauges().items()):
+            metric = _metric_name(name)
+            lines.append(f"# TYPE {metric} gauge")
+            lines.append(f"{metric} {value:g}")
+        return '\n'.join(lines) + '\n'
+
+    # Atomically replace path with the Prometheus text (for node_exporter's
+    # textfile collector); at most once per min_interval seconds
+    def write_prometheus(self, path, min_interval=0):
+        now = time.monotonic()
+        if min_interval and now - self._last_export < min_interval:
+            return False
+        self._last_export = now
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(self.to_prometheus())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+        return True
+
+    def reset(self):
+        with self._lock:
+            self._summaries.clear()
+            self._events.clear()
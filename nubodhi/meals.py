@@ -0,0 +1,31 @@
+"""The weekly meal plans.
+
+The plans live in ``data/meal_plans.json`` as {diet: {day: {meal type:
+{'Meal', 'Ingredients', 'Recipe'}}}} and are read on first use, so
+importing the package (or a page that never shows meals) does not pay for
+them. The returned dicts are shared; treat them as read-only.
+"""
+import json
+import os
+from functools import lru_cache
+
+MEAL_PLANS_PATH = os.path.join(os.path.dirname(__file__), 'data', 'meal_plans.json')
+
+
+@lru_cache(maxsize=1)
+def meal_plans():
+    with open(MEAL_PLANS_PATH, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def diets():
+    return list(meal_plans())
+
+
+def meal_plan(diet):
+    return meal_plans()[diet]
+
+
+# Days of the week in plan order (every diet covers the same days)
+def plan_days():
+    return list(next(iter(meal_plans().values())))
@@ -0,0 +1,27 @@
+"""Per-client health calculations shown on the tracking page.
+
+Scalar versions; ``nubodhi.cohort`` has vectorized equivalents for whole
+cohorts that share the constants below.
+"""
+
+ACTIVITY_MULTIPLIERS = {"Sedentary": 1.2, "Lightly Active": 1.375, "Moderately Active": 1.55, "Very Active": 1.725}
+
+
+# BMI rounded to 2 places; 0 when weight or height is missing
+def calculate_bmi(weight, height):
+    try:
+        return round((weight / ((height / 100) ** 2)), 2) if weight and height else 0
+    except ZeroDivisionError:
+        return 0
+
+
+# Daily calorie target: Mifflin-St Jeor BMR times the activity multiplier;
+# 0 when any input is missing
+def calculate_calories(age, gender, weight, height, activity_level):
+    if not all([age, weight, height, gender, activity_level]):
+        return 0
+    try:
+        bmr = 10 * weight + 6.25 * height - 5 * age + (5 if gender == "Male" else -161)
+        return round(bmr * ACTIVITY_MULTIPLIERS[activity_level])
+    except (ZeroDivisionError, KeyError):
+        return 0
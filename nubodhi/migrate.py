@@ -0,0 +1,100 @@
+"""Move legacy ``user_data`` rows into the typed tables.
+
+The old schema stored every value as ``str(value)`` in one table. Rows are
+converted in rowid order, one batch per transaction, and each batch deletes
+the legacy rows it converted in the same commit. Legacy rows of data types
+without a typed table stay in ``user_data`` but are re-encoded with the
+current codec. An interrupted run simply picks up where it stopped the next
+time it is started.
+
+Usage: python -m nubodhi.migrate [nubodhi_data.db] [--batch-size N] [--vacuum]
+"""
+import argparse
+import sqlite3
+import time
+
+from . import codec
+from .db import atomic
+from .schema import LEGACY_TABLE, TABLES, encode_row, init_schema, insert_rows_statements, tables_to_compact
+
+BATCH_SIZE = 5000
+
+
+# True if user_data still holds rows in the legacy repr format
+def needs_migration(conn):
+    row = conn.execute(f"SELECT 1 FROM {LEGACY_TABLE} WHERE codec IS NULL LIMIT 1").fetchone()
+    return row is not None
+
+
+def migrate_legacy_rows(conn, batch_size=BATCH_SIZE, progress=None):
+    init_schema(conn)
+    # Daily data types upsert: of several legacy rows for a day, the last wins
+    compacting = {table.name for table in tables_to_compact(conn)}
+    stats = {'migrated': 0, 'reencoded': 0, 'skipped': 0, 'batches': 0}
+    last_rowid = 0
+    while True:
+        rows = conn.execute(
+            f"SELECT rowid, user_id, data_type, date, value FROM {LEGACY_TABLE} "
+            f"WHERE rowid > ? AND codec IS NULL ORDER BY rowid LIMIT ?",
+            (last_rowid, batch_size)).fetchall()
+        if not rows:
+            break
+        batches = {}
+        converted = []
+        reencoded = []
+        unreadable = []
+        for rowid, user_id, data_type, date, value in rows:
+            try:
+                decoded = codec.decode(value, codec.LEGACY)
+                if data_type not in TABLES:
+                    version, payload = codec.encode(decoded)
+                    reencoded.append((payload, version, rowid))
+                    continue
+                row = encode_row(TABLES[data_type], decoded)
+            except codec.CodecError:
+                # Leave unreadable rows in user_data for manual inspection
+                unreadable.append((codec.UNREADABLE, rowid))
+                continue
+            batches.setdefault(data_type, []).append((user_id, date, *row))
+            converted.append((rowid,))
+        with atomic(conn):
+            for data_type, batch in batches.items():
+                for sql, params in insert_rows_statements(TABLES[data_type], batch, compacting):
+                    conn.executemany(sql, params)
+            conn.executemany(f"DELETE FROM {LEGACY_TABLE} WHERE rowid = ?", converted)
+            conn.executemany(f"UPDATE {LEGACY_TABLE} SET value = ?, codec = ? WHERE rowid = ?", reencoded)
+            conn.executemany(f"UPDATE {LEGACY_TABLE} SET codec = ? WHERE rowid = ?", unreadable)
+        last_rowid = rows[-1][0]
+        stats['migrated'] += len(converted)
+        stats['reencoded'] += len(reencoded)
+        stats['skipped'] += len(unreadable)
+        stats['batches'] += 1
+        if progress:
+            progress(stats)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Convert legacy user_data rows to the typed schema.")
+    parser.add_argument('db_path', nargs='?', default='nubodhi_data.db')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--vacuum', action='store_true', help="reclaim the space freed in user_data")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db_path)
+    start = time.perf_counter()
+
+    def report(stats):
+        if stats['batches'] % 20 == 0:
+            print(f"  {stats['migrated']:,} rows migrated ({time.perf_counter() - start:.1f}s)")
+
+    stats = migrate_legacy_rows(conn, args.batch_size, progress=report)
+    print(f"Migrated {stats['migrated']:,} rows, re-encoded {stats['reencoded']:,}, "
+          f"skipped {stats['skipped']:,} unreadable rows in {time.perf_counter() - start:.1f}s")
+    if args.vacuum:
+        conn.execute("VACUUM")
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
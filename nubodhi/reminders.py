@@ -0,0 +1,582 @@
+"""Server-side scheduler for exercise-snack reminders.
+
+Every enrolled client gets up to ``target_daily`` reminders a day, at random
+times between 07:00 and 21:00: the window is cut into equal shares and each
+share gets one slot, at least 30 minutes before the next share starts. The
+times are drawn from a generator seeded with the user and the day, so every
+process plans the same slots. Only each client's next slot is queued, in
+one heap ordered by due time, so ``run_due()`` pops just the reminders that
+are due (O(log n) each) however many clients there are. Entries made stale
+by a completion or a new target are skipped when they come up.
+
+State is kept in the ``reminders`` table: the day's slots, the next one
+due, ``completed_today``, the last reminder sent and the last snack
+completed. A restarted scheduler carries on from there. A slot more than
+``grace`` seconds in the past (say the scheduler was down) is skipped
+rather than sent late. Times are the server's local time, as the tracking
+page has always used.
+
+Due reminders go to every delivery hook, a callable taking a ``Reminder``:
+- ``webhook(url)`` POSTs it as JSON to a push gateway
+- ``outbox(path)`` is the local stub for a gateway: it appends one JSON
+  line per reminder to a file
+
+Run exactly one scheduler per database; two would each send every
+reminder. Everything the app's sessions do goes through the table instead,
+so it works in any number of server processes:
+- ``enroll_client()`` adds a client when their profile is opened;
+  the scheduler picks up new rows every ``SYNC_INTERVAL`` seconds
+- ``SessionInbox`` reads the last reminder sent from the table, for every
+  session of the client to show once, until it is ``max_age`` old or a
+  snack is completed
+- ``complete_snack()`` adds to ``completed_today`` in a write transaction.
+  The scheduler's own saves never lower the day's count, and it takes in
+  counts from other processes when it syncs
+
+The scheduler runs inside the app when NUBODHI_REMINDERS=1 (set it on one
+server process only), or as its own service (with ``--enroll-all`` to
+enroll every client with a profile up front):
+
+    python -m nubodhi.reminders run [--db nubodhi_data.db] [--enroll-all] [--webhook URL] [--outbox FILE]
+    python -m nubodhi.reminders status [--db nubodhi_data.db] [--user USER_ID]
+"""
+import argparse
+import heapq
+import json
+import logging
+import random
+import threading
+import time
+import urllib.request
+from collections import namedtuple
+from datetime import date as Date, datetime, timedelta
+
+from .backends import UserMoved, open_backend
+
+logger = logging.getLogger(__name__)
+
+WINDOW_START = 7 * 3600
+WINDOW_END = 21 * 3600
+MIN_GAP = 1800
+TARGET_DAILY = 4
+GRACE = 1800
+# Longest the scheduler thread sleeps before looking at the clock again
+MAX_SLEEP = 60.0
+# Seconds between reads of the table for clients enrolled, and snacks
+# completed, by other processes
+SYNC_INTERVAL = 60.0
+# Attempts at saving state for users who are being moved between shards
+_MOVE_RETRIES = 3
+
+Reminder = namedtuple('Reminder', ['user_id', 'due', 'slot', 'target_daily', 'completed_today'])
+
+_COLUMNS = "user_id, day, slots, next_slot, completed_today, target_daily, last_reminder, last_completed"
+# The scheduler's save. Completions are counted in the table by
+# complete_snack(), so a save keeps the day's count if it is higher, leaves
+# last_completed alone and never takes a row back to an earlier day
+SAVE_SQL = (f"INSERT INTO reminders ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (user_id) DO UPDATE SET day = excluded.day, slots = excluded.slots, "
+            "next_slot = excluded.next_slot, target_daily = excluded.target_daily, "
+            "last_reminder = excluded.last_reminder, completed_today = CASE WHEN reminders.day = excluded.day "
+            "THEN max(reminders.completed_today, excluded.completed_today) ELSE excluded.completed_today END "
+            "WHERE excluded.day >= reminders.day")
+# A whole row, read and changed in the same write transaction
+REPLACE_SQL = f"INSERT OR REPLACE INTO reminders ({_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+LOAD_SQL = f"SELECT {_COLUMNS} FROM reminders WHERE user_id = ?"
+
+
+# Seconds after midnight of one day's reminders for a client, in order
+def plan_slots(user_id, day, target_daily=TARGET_DAILY):
+    target = max(0, min(target_daily, (WINDOW_END - WINDOW_START) // MIN_GAP))
+    if not target:
+        return []
+    rng = random.Random(f"{user_id}/{day}")
+    share = (WINDOW_END - WINDOW_START) // target
+    return [WINDOW_START + n * share + rng.randrange(share - MIN_GAP + 1) for n in range(target)]
+
+
+def _clock_time(seconds):
+    return f"{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _seconds(clock_time):
+    hours, minutes, seconds = map(int, clock_time.split(':'))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+# Timestamp of a local time of day (DST-safe: goes through the wall clock)
+def _at(day, seconds):
+    return (datetime.combine(day, datetime.min.time()) + timedelta(seconds=seconds)).timestamp()
+
+
+def _day(timestamp):
+    return Date.fromtimestamp(timestamp)
+
+
+def _iso(timestamp):
+    return datetime.fromtimestamp(timestamp).isoformat(timespec='seconds')
+
+
+# One client's state: the reminders row, plus gen to spot stale heap entries
+# and the slots column as saved (slots only change once a day)
+class _State:
+    __slots__ = ('user_id', 'day', 'slots', 'next_slot', 'completed_today', 'target_daily', 'last_reminder',
+                 'last_completed', 'gen', 'slots_text')
+
+    def __init__(self, user_id, day, slots, next_slot=0, completed_today=0, target_daily=TARGET_DAILY,
+                 last_reminder=None, last_completed=None):
+        self.user_id = user_id
+        self.day = day
+        self.slots = slots
+        self.next_slot = next_slot
+        self.completed_today = completed_today
+        self.target_daily = target_daily
+        self.last_reminder = last_reminder
+        self.last_completed = last_completed
+        self.gen = 0
+        self.slots_text = None
+
+    @classmethod
+    def from_row(cls, row):
+        user_id, day, slots, next_slot, completed_today, target_daily, last_reminder, last_completed = row
+        state = cls(user_id, Date.fromisoformat(day), [_seconds(slot) for slot in json.loads(slots)],
+                    next_slot, completed_today, target_daily, last_reminder, last_completed)
+        state.slots_text = slots
+        return state
+
+    # A newly enrolled client: today's slots, minus those already behind us
+    @classmethod
+    def enrolled(cls, user_id, target_daily, now):
+        today = _day(now)
+        state = cls(user_id, today, plan_slots(user_id, today, target_daily), target_daily=target_daily)
+        state.skip_past(now)
+        return state
+
+    def skip_past(self, now):
+        while self.next_slot < len(self.slots) and _at(self.day, self.slots[self.next_slot]) < now:
+            self.next_slot += 1
+
+    def set_slots(self, slots):
+        self.slots = slots
+        self.slots_text = None
+
+    def row(self):
+        if self.slots_text is None:
+            self.slots_text = json.dumps([_clock_time(slot) for slot in self.slots])
+        return (self.user_id, self.day.isoformat(), self.slots_text,
+                self.next_slot, self.completed_today, self.target_daily, self.last_reminder, self.last_completed)
+
+    # Start a new day: fresh slots, nothing sent or completed yet
+    def roll(self, day):
+        if day > self.day:
+            self.day = day
+            self.set_slots(plan_slots(self.user_id, day, self.target_daily))
+            self.next_slot = 0
+            self.completed_today = 0
+
+    def active(self):
+        return self.next_slot < len(self.slots) and self.completed_today < self.target_daily
+
+    # Due time of the next reminder: today's next slot, else tomorrow's first
+    def next_due(self):
+        if self.active():
+            return _at(self.day, self.slots[self.next_slot])
+        tomorrow = self.day + timedelta(days=1)
+        slots = plan_slots(self.user_id, tomorrow, self.target_daily)
+        return _at(tomorrow, slots[0]) if slots else None
+
+    # The session's view of a client: the keys of user_data['exercise_reminders']
+    # plus today's slots and the next reminder
+    def view(self, now):
+        self.roll(_day(now))
+        next_due = self.next_due()
+        return {
+            'last_reminder': self.last_reminder,
+            'completed_today': self.completed_today,
+            'target_daily': self.target_daily,
+            'slots': [_clock_time(slot) for slot in self.slots],
+            'next_reminder': _iso(next_due) if next_due is not None else None,
+        }
+
+    # The last reminder sent, unless it is more than max_age seconds old or
+    # a snack was completed since
+    def pending(self, now, max_age):
+        if self.last_reminder is None or now - datetime.fromisoformat(self.last_reminder).timestamp() > max_age:
+            return None
+        if self.last_completed is not None and self.last_completed >= self.last_reminder:
+            return None
+        slot = self.next_slot - 1
+        due = _iso(_at(self.day, self.slots[slot])) if 0 <= slot < len(self.slots) else self.last_reminder
+        return Reminder(self.user_id, due, slot, self.target_daily, self.completed_today)
+
+
+def _read(conn, user_id):
+    row = conn.execute(LOAD_SQL, (user_id,)).fetchone()
+    return None if row is None else _State.from_row(row)
+
+
+# Start reminding a client, from any process (a no-op if they are enrolled
+# already); returns their view, as for ReminderScheduler.state
+def enroll_client(db, user_id, target_daily=TARGET_DAILY, now=None):
+    now = time.time() if now is None else now
+    with db.snapshot(user_id) as conn:
+        state = _read(conn, user_id)
+    if state is None:
+        with db.transaction(user_id) as conn:
+            state = _read(conn, user_id)
+            if state is None:
+                state = _State.enrolled(user_id, target_daily, now)
+                conn.execute(SAVE_SQL, state.row())
+    return state.view(now)
+
+
+# A client's view, read from the table (None if not enrolled)
+def client_state(db, user_id, now=None):
+    now = time.time() if now is None else now
+    with db.snapshot(user_id) as conn:
+        state = _read(conn, user_id)
+    return None if state is None else state.view(now)
+
+
+def _complete(db, user_id, now):
+    with db.transaction(user_id) as conn:
+        state = _read(conn, user_id) or _State.enrolled(user_id, TARGET_DAILY, now)
+        state.roll(_day(now))
+        state.completed_today += 1
+        state.last_completed = _iso(now)
+        conn.execute(REPLACE_SQL, state.row())
+    return state
+
+
+# Count one exercise snack done today, from any process; returns the
+# client's view
+def complete_snack(db, user_id, now=None):
+    now = time.time() if now is None else now
+    return _complete(db, user_id, now).view(now)
+
+
+class ReminderScheduler:
+    def __init__(self, db, hooks=(), grace=GRACE, target_daily=TARGET_DAILY, clock=time.time):
+        self.db = db
+        self.hooks = list(hooks)
+        self.grace = grace
+        self.target_daily = target_daily
+        self.clock = clock
+        self._states = {}
+        self._heap = []
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        # Held from reading states to committing them, so saves land in order
+        self._save_lock = threading.Lock()
+        self._stats = {'sent': 0, 'missed': 0, 'hook_errors': 0, 'save_errors': 0}
+        self._loaded = None
+        self._thread = None
+        self._stopping = False
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    # Queue the state's next reminder; older heap entries for it go stale
+    def _push(self, state):
+        state.gen += 1
+        due = state.next_due()
+        if due is not None:
+            heapq.heappush(self._heap, (due, state.user_id, state.gen))
+
+    # Take in a client's row: queue a new client's next reminder, or count
+    # the snacks completed in another process
+    def _merge(self, row, today):
+        saved = _State.from_row(row)
+        saved.roll(today)
+        state = self._states.get(saved.user_id)
+        if state is None:
+            self._states[saved.user_id] = saved
+            self._push(saved)
+            return
+        state.roll(today)
+        if saved.day == state.day and saved.completed_today > state.completed_today:
+            state.completed_today = saved.completed_today
+            state.last_completed = saved.last_completed
+            # Done for the day: the queued reminder goes stale
+            self._push(state)
+
+    # Read every client's state from the database and queue the reminders of
+    # those not seen before; run again every SYNC_INTERVAL by the thread
+    def load(self, now=None):
+        now = self.clock() if now is None else now
+        rows = []
+        for store in self.db.stores():
+            with store.connection() as conn:
+                rows += conn.execute(f"SELECT {_COLUMNS} FROM reminders").fetchall()
+        with self._wake:
+            for row in rows:
+                self._merge(row, _day(now))
+            self._loaded = now
+            self._wake.notify()
+        return len(rows)
+
+    # Start reminding clients (no-op for those already enrolled, unless
+    # target_daily changes); returns how many were new
+    def enroll(self, user_ids, target_daily=None, now=None):
+        now = self.clock() if now is None else now
+        today = _day(now)
+        changed = []
+        with self._wake:
+            for user_id in user_ids:
+                state = self._states.get(user_id)
+                if state is None:
+                    state = _State.enrolled(user_id, target_daily or self.target_daily, now)
+                    self._states[user_id] = state
+                elif target_daily is None or target_daily == state.target_daily:
+                    continue
+                else:
+                    state.roll(today)
+                    state.target_daily = target_daily
+                    state.set_slots(plan_slots(user_id, today, target_daily))
+                    state.next_slot = 0
+                    # Slots already behind us today are not reminders any more
+                    state.skip_past(now)
+                changed.append(user_id)
+                self._push(state)
+            self._wake.notify()
+        self._save(changed)
+        return len(changed)
+
+    # Enroll every client with a profile
+    def enroll_all(self, now=None):
+        user_ids = []
+        for store in self.db.stores():
+            with store.connection() as conn:
+                user_ids += [row[0] for row in conn.execute("SELECT DISTINCT user_id FROM personal_info")]
+        return self.enroll(user_ids, now=now)
+
+    def user_ids(self):
+        with self._lock:
+            return list(self._states)
+
+    # Count one exercise snack done today (see complete_snack); returns the
+    # client's state
+    def complete(self, user_id, now=None):
+        now = self.clock() if now is None else now
+        row = _complete(self.db, user_id, now).row()
+        with self._wake:
+            self._merge(row, _day(now))
+            self._wake.notify()
+        return self.state(user_id, now)
+
+    # The client's view as this scheduler has it (None if not enrolled)
+    def state(self, user_id, now=None):
+        now = self.clock() if now is None else now
+        with self._lock:
+            state = self._states.get(user_id)
+            return None if state is None else state.view(now)
+
+    # Send every reminder due by `now`; returns those sent
+    def run_due(self, now=None):
+        now = self.clock() if now is None else now
+        sent, changed = [], []
+        with self._lock:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                due, user_id, gen = heapq.heappop(heap)
+                state = self._states[user_id]
+                if gen != state.gen:
+                    continue
+                state.roll(_day(due))
+                if now - due > self.grace:
+                    self._stats['missed'] += 1
+                else:
+                    state.last_reminder = _iso(now)
+                    sent.append(Reminder(user_id, _iso(due), state.next_slot, state.target_daily,
+                                         state.completed_today))
+                state.next_slot += 1
+                changed.append(user_id)
+                self._push(state)
+            self._stats['sent'] += len(sent)
+        self._save(changed)
+        for reminder in sent:
+            self._deliver(reminder)
+        return sent
+
+    def _deliver(self, reminder):
+        for hook in self.hooks:
+            try:
+                hook(reminder)
+            except Exception:
+                logger.exception("reminder hook %r failed for %s", hook, reminder.user_id)
+                with self._lock:
+                    self._stats['hook_errors'] += 1
+
+    # Write the current state of these clients, one transaction per store
+    def _save(self, user_ids):
+        if not user_ids:
+            return
+        with self._save_lock:
+            with self._lock:
+                rows = {user_id: self._states[user_id].row() for user_id in user_ids}
+            pending = list(rows)
+            for attempt in range(_MOVE_RETRIES):
+                moved = []
+                for members in self.db.partition(pending):
+                    try:
+                        with self.db.transaction(members) as conn:
+                            conn.executemany(SAVE_SQL, [rows[user_id] for user_id in members])
+                    except UserMoved:
+                        if attempt < _MOVE_RETRIES - 1:
+                            moved += members
+                            continue
+                        logger.exception("reminder state for %d users not saved", len(members))
+                        with self._lock:
+                            self._stats['save_errors'] += 1
+                if not moved:
+                    break
+                pending = moved
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['users'] = len(self._states)
+            stats['queued'] = len(self._heap)
+            stats['next_due_s'] = max(0.0, self._heap[0][0] - self.clock()) if self._heap else None
+        return stats
+
+    # Run in a background thread, loading state first
+    def start(self):
+        if self._thread is not None:
+            return
+        self.load()
+        self._thread = threading.Thread(target=self._run, name='nubodhi-reminders', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        with self._wake:
+            self._stopping = True
+            self._wake.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        while True:
+            try:
+                if self.clock() - self._loaded >= SYNC_INTERVAL:
+                    self.load()
+                self.run_due()
+            except Exception:
+                logger.exception("reminder run failed")
+            with self._wake:
+                if self._stopping:
+                    return
+                delay = self._heap[0][0] - self.clock() if self._heap else MAX_SLEEP
+                if delay > 0:
+                    self._wake.wait(min(delay, MAX_SLEEP))
+                if self._stopping:
+                    return
+
+
+# Reminders for the app's sessions to pick up. They are read from the
+# reminders table, so sessions in every server process see what the
+# scheduler sent; this process remembers which sessions have shown each one
+class SessionInbox:
+    def __init__(self, db, max_age=GRACE):
+        self.db = db
+        self.max_age = max_age
+        self._shown = {}  # user_id -> (last_reminder, session IDs)
+        self._lock = threading.Lock()
+
+    # The client's pending reminder if this session has not shown it yet. It
+    # stays for the client's other sessions until it is more than max_age
+    # seconds old or a snack is completed
+    def take(self, user_id, session_id, now=None):
+        now = time.time() if now is None else now
+        with self.db.snapshot(user_id) as conn:
+            state = _read(conn, user_id)
+        reminder = None if state is None else state.pending(now, self.max_age)
+        with self._lock:
+            if reminder is None:
+                self._shown.pop(user_id, None)
+                return None
+            sent, shown = self._shown.get(user_id, (None, None))
+            if sent != state.last_reminder:
+                shown = set()
+                self._shown[user_id] = (state.last_reminder, shown)
+            if session_id in shown:
+                return None
+            shown.add(session_id)
+            return reminder
+
+
+# Hook that POSTs each reminder as JSON, e.g. to a push notification gateway
+def webhook(url, token=None, timeout=5.0):
+    headers = {'Content-Type': 'application/json'}
+    if token:
+        headers['Authorization'] = f"Bearer {token}"
+
+    def deliver(reminder):
+        request = urllib.request.Request(url, json.dumps(reminder._asdict()).encode(), headers, method='POST')
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+
+    return deliver
+
+
+# Stand-in for a push gateway: appends each reminder to a JSON-lines file
+def outbox(path):
+    lock = threading.Lock()
+
+    def deliver(reminder):
+        line = json.dumps(reminder._asdict()) + '\n'
+        with lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    return deliver
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Exercise-snack reminder scheduler.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="send reminders until interrupted")
+    run.add_argument('--db', default='nubodhi_data.db', help="database path or backend spec")
+    run.add_argument('--enroll-all', action='store_true', help="enroll every client with a profile")
+    run.add_argument('--webhook', help="POST reminders to this URL")
+    run.add_argument('--outbox', help="append reminders to this JSON-lines file")
+    status = commands.add_parser('status', help="enrolled clients and today's reminders")
+    status.add_argument('--db', default='nubodhi_data.db', help="database path or backend spec")
+    status.add_argument('--user')
+    args = parser.parse_args(argv)
+
+    db = open_backend(args.db)
+    scheduler = ReminderScheduler(db)
+    scheduler.load()
+    if args.command == 'status':
+        if args.user:
+            state = scheduler.state(args.user)
+            print(json.dumps(state, indent=2) if state else f"{args.user} is not enrolled")
+            return
+        states = [scheduler.state(user_id) for user_id in scheduler.user_ids()]
+        sent_today = sum(1 for state in states if state['last_reminder'] and
+                         state['last_reminder'][:10] == Date.today().isoformat())
+        done = sum(1 for state in states if state['completed_today'] >= state['target_daily'])
+        print(f"{len(states):,} clients enrolled, {sent_today:,} reminded today, {done:,} at their daily target")
+        return
+
+    if args.enroll_all:
+        print(f"Enrolled {scheduler.enroll_all():,} clients")
+    scheduler.add_hook(lambda reminder: print(f"{reminder.due} {reminder.user_id} "
+                                              f"slot {reminder.slot + 1}/{reminder.target_daily}", flush=True))
+    if args.webhook:
+        scheduler.add_hook(webhook(args.webhook))
+    if args.outbox:
+        scheduler.add_hook(outbox(args.outbox))
+    scheduler.start()
+    print(f"Scheduling reminders for {scheduler.stats()['users']:,} clients; Ctrl-C to stop", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        scheduler.stop()
+    db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+"""Per-user daily, weekly and monthly aggregates of tracked metrics.
+
+Every saved reading of a numeric metric (mood, energy, sleep, measurements,
+weight, lab values, ...) is folded into three ``rollups`` rows: one each for
+its day, its ISO week (keyed by the Monday) and its month (keyed by the 1st).
+Each row keeps count, total, min, max and the last value. The upserts run in
+the same transaction as the INSERT of the reading, so trend and summary
+views read a few dozen rollup rows instead of the raw history.
+
+Aggregates are over saved readings, so a day saved twice counts twice,
+except for daily data types (see ``schema.Table``): saving one of those
+again replaces the day's row, so instead of being added to, its day, week
+and month rows are recomputed from the table. To (re)build the table from
+the history tables, for example after a migration, run:
+
+    python -m nubodhi.rollups rebuild [--db nubodhi_data.db | sharded:data] [--user USER_ID]
+"""
+import argparse
+from datetime import date as Date, timedelta
+
+from .db import atomic
+from .schema import MEASUREMENTS, TABLES, encode_row, init_schema
+
+PERIODS = ('day', 'week', 'month')
+
+# data_type -> columns rolled up; each column name doubles as the metric name
+ROLLUP_COLUMNS = {
+    'personal_info': ['weight'],
+    'mood_log': ['mood', 'energy', 'sleep_hours', 'sleep_quality'],
+    'body_measurements_history': list(MEASUREMENTS),
+    'biophotonic_scan': ['score'],
+    'blood_work': ['blood_sugar', 'hemoglobin'],
+    'body_composition': ['body_fat', 'muscle_mass'],
+}
+
+# Metrics whose forms default to 0, which means "not measured"
+ZERO_IS_MISSING = {'weight', 'score', 'body_fat', 'muscle_mass', *MEASUREMENTS}
+
+UPSERT_SQL = (
+    "INSERT INTO rollups (user_id, metric, period, period_start, count, total, min, max, last, last_date) "
+    "VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (user_id, metric, period, period_start) DO UPDATE SET "
+    "count = count + 1, total = total + excluded.total, "
+    "min = min(min, excluded.min), max = max(max, excluded.max), "
+    # Readings arrive in save order, so a tie on date goes to the newer one
+    "last = CASE WHEN excluded.last_date >= last_date THEN excluded.last ELSE last END, "
+    "last_date = max(last_date, excluded.last_date)"
+)
+
+# Same period keys as period_starts(), computed by SQLite during rebuilds
+_PERIOD_SQL = {
+    'day': "date",
+    'week': "date(date, 'weekday 0', '-6 days')",
+    'month': "strftime('%Y-%m-01', date)",
+}
+
+
+# Start of the day, ISO week and month containing an ISO date
+def period_starts(date):
+    return {period: start for period, (start, _) in period_bounds(date).items()}
+
+
+# [start, end) of the day, ISO week and month containing an ISO date
+def period_bounds(date):
+    day = Date.fromisoformat(date[:10])
+    week = day - timedelta(days=day.weekday())
+    month = day.replace(day=1)
+    next_month = (month + timedelta(days=31)).replace(day=1)
+    return {
+        'day': (day.isoformat(), (day + timedelta(days=1)).isoformat()),
+        'week': (week.isoformat(), (week + timedelta(days=7)).isoformat()),
+        'month': (month.isoformat(), next_month.isoformat()),
+    }
+
+
+# SQL condition for rows holding a reading of metric
+def _has_reading(metric):
+    conditions = f"typeof({metric}) IN ('integer', 'real')"
+    if metric in ZERO_IS_MISSING:
+        conditions += f" AND {metric} != 0"
+    return conditions
+
+
+# Recompute one user's rows of a daily data type's metrics for one period
+# (:user_id, :period, :start, :end). Runs after the deletes below, so a
+# period left without readings disappears; both are idempotent, so
+# executemany may group them.
+def _refresh_sql(data_type):
+    table = TABLES[data_type].name
+    selects = []
+    for metric in ROLLUP_COLUMNS[data_type]:
+        rows = (f"FROM {table} WHERE user_id = :user_id AND date >= :start AND date < :end "
+                f"AND {_has_reading(metric)}")
+        selects.append(
+            f"SELECT :user_id, '{metric}', :period, :start, count(*), sum({metric}), min({metric}), "
+            f"max({metric}), (SELECT {metric} {rows} ORDER BY date DESC, id DESC LIMIT 1), max(date) "
+            f"{rows} GROUP BY user_id")
+    metrics = ', '.join(f"'{metric}'" for metric in ROLLUP_COLUMNS[data_type])
+    return (f"DELETE FROM rollups WHERE user_id = :user_id AND metric IN ({metrics}) "
+            f"AND period = :period AND period_start = :start",
+            "INSERT OR REPLACE INTO rollups (user_id, metric, period, period_start, count, total, min, max, "
+            "last, last_date) " + ' UNION ALL '.join(selects))
+
+
+REFRESH_SQL = {data_type: _refresh_sql(data_type) for data_type in ROLLUP_COLUMNS if TABLES[data_type].daily}
+
+
+# (sql, params) recomputing the periods around date for a daily data type
+def refresh_statements(user_id, data_type, date):
+    delete_sql, insert_sql = REFRESH_SQL[data_type]
+    params = [{'user_id': user_id, 'period': period, 'start': start, 'end': end}
+              for period, (start, end) in period_bounds(date).items()]
+    return [(delete_sql, item) for item in params] + [(insert_sql, item) for item in params]
+
+
+def _readings(data_type, value):
+    table = TABLES[data_type]
+    row = dict(zip((column for column, _, _ in table.columns), encode_row(table, value)))
+    for metric in ROLLUP_COLUMNS.get(data_type, ()):
+        reading = row.get(metric)
+        if isinstance(reading, bool) or not isinstance(reading, (int, float)):
+            continue
+        if reading == 0 and metric in ZERO_IS_MISSING:
+            continue
+        yield metric, float(reading)
+
+
+# (sql, params) folding one saved value into the rollups; run them after
+# the value's INSERT
+def rollup_statements(user_id, data_type, date, value):
+    if data_type not in ROLLUP_COLUMNS:
+        return []
+    if data_type in REFRESH_SQL:
+        return refresh_statements(user_id, data_type, date)
+    readings = list(_readings(data_type, value))
+    if not readings:
+        return []
+    starts = period_starts(date)
+    return [(UPSERT_SQL, (user_id, metric, period, starts[period], reading, reading, reading, reading, date))
+            for metric, reading in readings for period in PERIODS]
+
+
+# Recompute rollups from the history tables for one user (or a list of
+# users) or everyone, optionally only for some data types
+def rebuild_rollups(conn, user_id=None, data_types=None):
+    users = [user_id] if isinstance(user_id, str) else user_id
+    where = f"user_id IN ({', '.join('?' * len(users))})" if users is not None else "1"
+    params = tuple(users) if users is not None else ()
+    data_types = list(ROLLUP_COLUMNS) if data_types is None else [data_type for data_type in data_types
+                                                                   if data_type in ROLLUP_COLUMNS]
+    metrics = ', '.join(f"'{metric}'" for data_type in data_types for metric in ROLLUP_COLUMNS[data_type])
+    if not metrics:
+        return
+    with atomic(conn):
+        conn.execute(f"DELETE FROM rollups WHERE {where} AND metric IN ({metrics})", params)
+        for data_type in data_types:
+            table = TABLES[data_type].name
+            for metric in ROLLUP_COLUMNS[data_type]:
+                conditions = f"{_has_reading(metric)} AND {where}"
+                for period in PERIODS:
+                    # Every row of a group carries the group's last value, so
+                    # the bare `last` column is well defined
+                    conn.execute(
+                        f"INSERT INTO rollups (user_id, metric, period, period_start, count, total, min, max, "
+                        f"last, last_date) "
+                        f"SELECT user_id, '{metric}', '{period}', start, count(*), sum(value), min(value), "
+                        f"max(value), last, max(date) FROM "
+                        f"(SELECT user_id, {_PERIOD_SQL[period]} AS start, date, {metric} AS value, "
+                        f"last_value({metric}) OVER (PARTITION BY user_id, {_PERIOD_SQL[period]} "
+                        f"ORDER BY date, id ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING) AS last "
+                        f"FROM {table} WHERE {conditions}) "
+                        f"GROUP BY user_id, start",
+                        params)
+
+
+# Rollups are empty but history exists: built by an older version, or just migrated
+def needs_rebuild(conn):
+    if conn.execute("SELECT 1 FROM rollups LIMIT 1").fetchone():
+        return False
+    return any(conn.execute(f"SELECT 1 FROM {TABLES[data_type].name} LIMIT 1").fetchone()
+               for data_type in ROLLUP_COLUMNS)
+
+
+# Aggregates for one metric, oldest period first, each with its mean
+def load_rollups(conn, user_id, metric, period, start=None, end=None, limit=None):
+    sql = ("SELECT period_start, count, total, min, max, last, last_date FROM rollups "
+           "WHERE user_id = ? AND metric = ? AND period = ? AND period_start >= ? AND period_start <= ? "
+           "ORDER BY period_start DESC")
+    params = [user_id, metric, period, start or '', end or '9999']
+    if limit is not None:
+        sql += " LIMIT ?"
+        params.append(limit)
+    rows = [{'period_start': row[0], 'count': row[1], 'mean': row[2] / row[1], 'min': row[3], 'max': row[4],
+             'last': row[5], 'last_date': row[6]} for row in conn.execute(sql, params)]
+    rows.reverse()
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rebuild NuBodhi rollup tables from history.")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--db', default='nubodhi_data.db', help="database path or backend spec")
+    parser.add_argument('--user', default=None, help="only this user_id")
+    args = parser.parse_args(argv)
+
+    # Imported here: opening a backend goes through the service, which
+    # imports this module
+    from .backends import open_backend
+    db = open_backend(args.db, prepare=False)
+    rows = 0
+    try:
+        for store in ([db.store(args.user)] if args.user else db.stores()):
+            with store.connection() as conn:
+                init_schema(conn)
+                rebuild_rollups(conn, args.user)
+                rows += conn.execute("SELECT count(*) FROM rollups").fetchone()[0]
+    finally:
+        db.close()
+    print(f"Rebuilt rollups: {rows:,} rows")
+
+
+if __name__ == '__main__':
+    main()
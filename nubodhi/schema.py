@@ -0,0 +1,237 @@
+"""Typed storage schema for NuBodhi user data.
+
+Every data_type the app saves has its own table with real columns and a
+composite (user_id, date) index. Tables flagged ``daily`` hold at most one
+row per user and date: the index is UNIQUE and saves are upserts, so saving
+the same day again replaces that day's row. Each column maps to a key path inside the
+value dict the app hands to ``save_to_db``, so values can be flattened into a
+row on write and rebuilt in the same shape on read.
+"""
+from collections import namedtuple
+
+# name: table name, columns: (column, sql type, key path into the saved value),
+# echo: row fields that the app also keeps inside the saved value,
+# daily: one row per (user_id, date), last write wins
+Table = namedtuple('Table', ['name', 'columns', 'echo', 'daily'], defaults=(False,))
+
+MEASUREMENTS = ('arms', 'chest', 'waist', 'hips', 'thighs', 'calves')
+CHECKLIST_ITEMS = ('trme_supplements', 'exercise_snack', 'healthy_drinks', 'no_processed_food')
+PHOTO_VIEWS = ('front', 'side', 'back', 'outfit')
+
+TABLES = {
+    'personal_info': Table('personal_info', [
+        ('name', 'TEXT', ('name',)),
+        ('age', 'INTEGER', ('age',)),
+        ('gender', 'TEXT', ('gender',)),
+        ('height', 'INTEGER', ('height',)),
+        ('weight', 'INTEGER', ('weight',)),
+        ('activity', 'TEXT', ('activity',)),
+    ], ('user_id',), daily=True),
+    'daily_checklist': Table('daily_checklist', [
+        *[(item, 'BOOLEAN', ('items', item)) for item in CHECKLIST_ITEMS],
+        ('mood', 'INTEGER', ('mood',)),
+        ('energy', 'INTEGER', ('energy',)),
+        ('sleep_hours', 'REAL', ('sleep_hours',)),
+        ('sleep_quality', 'INTEGER', ('sleep_quality',)),
+        *[(part, 'INTEGER', (part,)) for part in MEASUREMENTS],
+    ], ('date',), daily=True),
+    'mood_log': Table('mood_log', [
+        ('mood', 'INTEGER', ('mood',)),
+        ('energy', 'INTEGER', ('energy',)),
+        ('sleep_hours', 'REAL', ('sleep_hours',)),
+        ('sleep_quality', 'INTEGER', ('sleep_quality',)),
+    ], (), daily=True),
+    'body_measurements_history': Table('body_measurements', [
+        (part, 'INTEGER', ('measurements', part)) for part in MEASUREMENTS
+    ], (), daily=True),
+    'biophotonic_scan': Table('biophotonic_scan', [
+        ('score', 'INTEGER', ()),
+    ], ()),
+    'blood_work': Table('blood_work', [
+        ('blood_pressure', 'TEXT', ('metrics', 'blood_pressure')),
+        ('blood_sugar', 'REAL', ('metrics', 'blood_sugar')),
+        ('hemoglobin', 'REAL', ('metrics', 'hemoglobin')),
+        ('report_file', 'TEXT', ('report_file',)),
+    ], ('date',)),
+    'body_composition': Table('body_composition', [
+        ('body_fat', 'REAL', ('metrics', 'body_fat')),
+        ('muscle_mass', 'REAL', ('metrics', 'muscle_mass')),
+        ('report_file', 'TEXT', ('report_file',)),
+    ], ('date',)),
+    'progress_photos': Table('progress_photos', [
+        (view, 'TEXT', ('photos', view)) for view in PHOTO_VIEWS
+    ], ('date',)),
+}
+
+# Catch-all table for data types without a typed table (and the legacy store);
+# values are serialized with nubodhi.codec and tagged with the codec version
+LEGACY_TABLE = 'user_data'
+
+# Columns holding paths of uploaded files, by data_type
+FILE_COLUMNS = {
+    'progress_photos': PHOTO_VIEWS,
+    'blood_work': ('report_file',),
+    'body_composition': ('report_file',),
+}
+
+# Tables that are not per-user history
+SUPPORT_DDL = [
+    # Metadata for files in the content-addressed upload store
+    '''CREATE TABLE IF NOT EXISTS uploads
+       (path TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL,
+        original_name TEXT, created_at TEXT NOT NULL)''',
+    "CREATE INDEX IF NOT EXISTS idx_uploads_sha256 ON uploads (sha256)",
+    # Per-user daily/weekly/monthly aggregates, maintained by nubodhi.rollups
+    '''CREATE TABLE IF NOT EXISTS rollups
+       (user_id TEXT NOT NULL, metric TEXT NOT NULL, period TEXT NOT NULL, period_start TEXT NOT NULL,
+        count INTEGER NOT NULL, total REAL NOT NULL, min REAL NOT NULL, max REAL NOT NULL,
+        last REAL NOT NULL, last_date TEXT NOT NULL,
+        PRIMARY KEY (user_id, metric, period, period_start)) WITHOUT ROWID''',
+    # Latest change per (user_id, data_type, date) for delta sync
+    # (nubodhi.api); seq counts up per user with every save
+    '''CREATE TABLE IF NOT EXISTS changes
+       (user_id TEXT NOT NULL, data_type TEXT NOT NULL, date TEXT NOT NULL, seq INTEGER NOT NULL,
+        PRIMARY KEY (user_id, data_type, date)) WITHOUT ROWID''',
+    "CREATE INDEX IF NOT EXISTS idx_changes_user_seq ON changes (user_id, seq)",
+    # Exercise-snack reminder state per client (nubodhi.reminders): the day's
+    # slots as a JSON list of "HH:MM:SS" and the index of the next one due
+    '''CREATE TABLE IF NOT EXISTS reminders
+       (user_id TEXT PRIMARY KEY, day TEXT NOT NULL, slots TEXT NOT NULL, next_slot INTEGER NOT NULL,
+        completed_today INTEGER NOT NULL, target_daily INTEGER NOT NULL, last_reminder TEXT,
+        last_completed TEXT) WITHOUT ROWID''',
+    # Named groups of clients for the guide dashboard (nubodhi.cohort)
+    '''CREATE TABLE IF NOT EXISTS cohort_members
+       (cohort TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (cohort, user_id)) WITHOUT ROWID''',
+]
+
+
+def table_ddl(table):
+    columns = ''.join(f', {column} {sql_type}' for column, sql_type, _ in table.columns)
+    return [
+        f"CREATE TABLE IF NOT EXISTS {table.name} "
+        f"(id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, date TEXT NOT NULL{columns})",
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {unique_index(table)} ON {table.name} (user_id, date)" if table.daily
+        else f"CREATE INDEX IF NOT EXISTS idx_{table.name}_user_date ON {table.name} (user_id, date)",
+    ]
+
+
+def unique_index(table):
+    return f"uq_{table.name}_user_date"
+
+
+# Daily tables created before saves were upserts: they still have the plain
+# (user_id, date) index and may hold several rows per day. nubodhi.compact
+# collapses those and swaps in the unique index.
+def tables_to_compact(conn):
+    indexes = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    return [table for table in TABLES.values()
+            if table.daily and f"idx_{table.name}_user_date" in indexes and unique_index(table) not in indexes]
+
+
+# The INSERT for one row (user_id, date, columns...); an upsert for daily tables
+def insert_sql(table, upsert=True):
+    columns = [column for column, _, _ in table.columns]
+    sql = (f"INSERT INTO {table.name} (user_id, date, {', '.join(columns)}) "
+           f"VALUES ({', '.join('?' * (len(columns) + 2))})")
+    if table.daily and upsert:
+        sql += (" ON CONFLICT (user_id, date) DO UPDATE SET "
+                + ', '.join(f"{column} = excluded.{column}" for column in columns))
+    return sql
+
+
+# Daily tables waiting for nubodhi.compact have no unique index for the
+# upsert to use. Until it is built, saves delete the day's rows and insert
+# instead, which keeps last-write-wins and collapses that day's duplicates.
+def delete_day_sql(table):
+    return f"DELETE FROM {table.name} WHERE user_id = ? AND date = ?"
+
+
+# (sql, [params]) pairs, in order, to store rows (user_id, date, columns...)
+# in a table; `compacting` names the tables still waiting for compaction
+def insert_rows_statements(table, rows, compacting=()):
+    if not (table.daily and table.name in compacting):
+        return [(insert_sql(table), rows)]
+    # The last row given for a day wins, as with the upsert
+    rows = list({(row[0], row[1]): row for row in rows}.values())
+    return [(delete_day_sql(table), [row[:2] for row in rows]), (insert_sql(table, upsert=False), rows)]
+
+
+# Create all tables and indexes; safe to run on every start
+def init_schema(conn):
+    c = conn.cursor()
+    c.execute(f'''CREATE TABLE IF NOT EXISTS {LEGACY_TABLE}
+                 (user_id TEXT, data_type TEXT, date TEXT, value TEXT, codec INTEGER)''')
+    # Databases from the original app predate the per-row codec version tag
+    if 'codec' not in [row[1] for row in c.execute(f"PRAGMA table_info({LEGACY_TABLE})")]:
+        c.execute(f"ALTER TABLE {LEGACY_TABLE} ADD COLUMN codec INTEGER")
+    pending = tables_to_compact(conn)
+    for table in TABLES.values():
+        for statement in table_ddl(table):
+            # Building the unique index has to wait for the duplicates to go
+            if table in pending and unique_index(table) in statement:
+                continue
+            c.execute(statement)
+    for statement in SUPPORT_DDL:
+        c.execute(statement)
+    # Reminder tables from before completions were timestamped
+    if 'last_completed' not in [row[1] for row in c.execute("PRAGMA table_info(reminders)")]:
+        c.execute("ALTER TABLE reminders ADD COLUMN last_completed TEXT")
+    conn.commit()
+
+
+# Flatten a saved value into column values in table order
+def encode_row(table, value):
+    row = []
+    for _, _, path in table.columns:
+        item = value
+        for key in path:
+            item = item.get(key) if isinstance(item, dict) else None
+        row.append(item)
+    return row
+
+
+# Build a row decoder for a table. Plain decoders rebuild the saved value;
+# entry decoders add the row date, giving the {'date': ..., ...} history
+# entries kept in session state (scalar values are keyed by column name).
+def _decoder(table, as_entry=False):
+    if len(table.columns) == 1 and not table.columns[0][2]:
+        column = table.columns[0][0]
+        if as_entry:
+            return lambda user_id, date, row: {'date': date, column: row[0]}
+        return lambda user_id, date, row: row[0]
+    bools = [i for i, (_, sql_type, _) in enumerate(table.columns) if sql_type == 'BOOLEAN']
+    flat = [(i, path[0]) for i, (_, _, path) in enumerate(table.columns) if len(path) == 1]
+    nested = {}
+    for i, (_, _, path) in enumerate(table.columns):
+        if len(path) == 2:
+            nested.setdefault(path[0], []).append((i, path[1]))
+    echo = table.echo
+    if as_entry and 'date' not in echo:
+        echo = ('date', *echo)
+
+    def decode(user_id, date, row):
+        if bools:
+            row = list(row)
+            for i in bools:
+                if row[i] is not None:
+                    row[i] = bool(row[i])
+        value = {key: row[i] for i, key in flat}
+        for parent, keys in nested.items():
+            value[parent] = {key: row[i] for i, key in keys}
+        if echo:
+            fields = {'user_id': user_id, 'date': date}
+            for field in echo:
+                value[field] = fields[field]
+        return value
+
+    return decode
+
+
+# Row decoders built once per table; key paths are at most two levels deep
+DECODERS = {table.name: _decoder(table) for table in TABLES.values()}
+ENTRY_DECODERS = {table.name: _decoder(table, as_entry=True) for table in TABLES.values()}
+
+
+# Rebuild the value dict (or scalar) the app originally saved
+def decode_row(table, user_id, date, row):
+    return DECODERS[table.name](user_id, date, row)
@@ -0,0 +1,212 @@
+"""Headless user-data service: what the tracking page does, without Streamlit.
+
+``open_database`` prepares a database (schema, legacy migration,
+rollups); ``nubodhi.backends`` does the same for sharded and server
+backends. Duplicate daily rows from before saves were upserts are left to
+``compact.compact_in_background`` (or the compact CLI), so opening an old
+database does not wait for them.
+``UserDataService`` saves and loads history through the shared read cache,
+optionally via a write-behind queue. ``default_user_data`` and
+``user_data_from_profile`` build the ``user_data`` dict the app keeps in
+session state, so workers, CLIs and benchmarks see the same shape:
+
+    service = UserDataService(open_database('nubodhi_data.db'), HistoryCache())
+    service.save('u1', 'mood_log', '2024-05-01', {'mood': 7, ...})
+    user_data = default_user_data()
+    user_data.update(user_data_from_profile('u1', service.profile('u1')))
+"""
+from contextlib import nullcontext
+from datetime import datetime
+
+from .db import Database
+from .history import History
+from .instrument import Recorder, statement_label
+from .migrate import migrate_legacy_rows, needs_migration
+from .rollups import needs_rebuild, rebuild_rollups
+from .schema import CHECKLIST_ITEMS, MEASUREMENTS, init_schema, tables_to_compact
+from .storage import change_seq, load_profile, load_values, write_statements
+
+HEALTH_METRICS = ('biophotonic_scan', 'blood_work', 'body_composition', 'progress_photos')
+
+
+# Open a database and bring it up to date: typed schema, rows left by the
+# old single-table schema, rollups for history saved before they existed
+def open_database(path):
+    db = Database(path)
+    prepare_store(db)
+    return db
+
+
+# The same for one store of any backend. Duplicate daily rows are left to
+# nubodhi.compact (compact_in_background, or its CLI); saves work meanwhile
+def prepare_store(db):
+    with db.connection() as conn:
+        init_schema(conn)
+        db.compacting = frozenset(table.name for table in tables_to_compact(conn))
+        migrated = needs_migration(conn)
+        if migrated:
+            migrate_legacy_rows(conn)
+        if migrated or needs_rebuild(conn):
+            rebuild_rollups(conn)
+
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+# The form defaults for today's checklist
+def default_checklist(today=None):
+    return {
+        'date': today or _today(),
+        'items': {item: False for item in CHECKLIST_ITEMS},
+        'mood': 5,
+        'energy': 5,
+        'sleep_hours': 7.0,
+        'sleep_quality': 5,
+        **{part: 0 for part in MEASUREMENTS},
+    }
+
+
+# Per-user fields of user_data, as for a client with no history. Histories
+# are nubodhi.history.History; weight_history is a list of (date, weight).
+def empty_profile_data(user_id='', today=None):
+    return {
+        'user_id': user_id,
+        'name': '',
+        'age': 0,
+        'gender': '',
+        'height': 0,
+        'weight': 0,
+        'weight_history': [],
+        'body_measurements_history': History('body_measurements_history', user_id),
+        'mood_log': History('mood_log', user_id),
+        'health_metrics': {metric: History(metric, user_id) for metric in HEALTH_METRICS},
+        'daily_checklist': default_checklist(today),
+    }
+
+
+# A fresh session's user_data: no client loaded yet
+def default_user_data(today=None):
+    return {
+        **empty_profile_data('', today),
+        'exercise_reminders': {
+            'last_reminder': None,
+            'completed_today': 0,
+            'target_daily': 4
+        },
+        'week_number': 1
+    }
+
+
+# The per-user fields of user_data for a loaded profile ({data_type:
+# History}, see storage.load_profile). Histories are the profile's own, as
+# service.profile hands out copies; today's checklist is a private copy.
+def user_data_from_profile(user_id, profile, today=None):
+    today = today or _today()
+    data = empty_profile_data(user_id, today)
+    personal_info = profile['personal_info']
+    if personal_info:
+        latest_info = dict(personal_info[-1])  # Get the latest entry
+        latest_info.pop('date')
+        data.update(latest_info)
+        data['user_id'] = user_id
+        data['weight_history'] = [(info['date'], info['weight']) for info in personal_info]
+    daily_checklist = profile['daily_checklist']
+    if daily_checklist and daily_checklist[-1]['date'] == today:
+        data['daily_checklist'] = daily_checklist[-1]  # built fresh by History
+    data['mood_log'] = profile['mood_log']
+    data['body_measurements_history'] = profile['body_measurements_history']
+    for metric in HEALTH_METRICS:
+        data['health_metrics'][metric] = profile[metric]
+    return data
+
+
+# Number of history entries held in a user_data dict
+def history_size(user_data):
+    return (len(user_data['weight_history']) + len(user_data['body_measurements_history'])
+            + len(user_data['mood_log']) + sum(len(entries) for entries in user_data['health_metrics'].values()))
+
+
+# Timings go to ``recorder`` (see nubodhi.instrument): 'save' per saved
+# value, 'sql' per statement with its row count. With a write queue 'save'
+# only covers queueing; give the queue the same recorder for its commits.
+class UserDataService:
+    def __init__(self, db, cache, write_queue=None, recorder=None):
+        self.db = db
+        self.cache = cache
+        self.write_queue = write_queue
+        self.recorder = recorder or Recorder()
+
+    # Save one value; joins the caller's transaction if one is open. With a
+    # write queue, returns a ticket whose wait() confirms the commit.
+    def save(self, user_id, data_type, date, value):
+        if self.write_queue is not None:
+            with self.recorder.timer('save', data_type=data_type, mode='queued'):
+                ticket = self.write_queue.submit(user_id, data_type, date, value)
+            # As on_commit below: the cache only sees writes that were stored
+            ticket.on_commit(lambda: self.cache.record_write(user_id, data_type, date, value))
+            return ticket
+        with self.recorder.timer('save', data_type=data_type, mode='direct'):
+            compacting = self.db.store(user_id).compacting
+            with self.db.transaction(user_id) as conn:
+                for sql, params in write_statements(user_id, data_type, date, value, compacting):
+                    with self.recorder.timer('sql', statement=statement_label(sql)) as event:
+                        event['rows'] = conn.execute(sql, params).rowcount
+                self.db.on_commit(lambda: self.cache.record_write(user_id, data_type, date, value), user_id)
+
+    # Save [(data_type, date, value)] of one user so that they are stored or
+    # fail together: one transaction, or one write-behind item whose ticket
+    # is returned
+    def save_many(self, user_id, writes):
+        if self.write_queue is not None:
+            with self.recorder.timer('save', data_type='batch', mode='queued'):
+                ticket = self.write_queue.submit_many(user_id, writes)
+
+            def record_writes():
+                for data_type, date, value in writes:
+                    self.cache.record_write(user_id, data_type, date, value)
+
+            ticket.on_commit(record_writes)
+            return ticket
+        with self.db.transaction(user_id):
+            for data_type, date, value in writes:
+                self.save(user_id, data_type, date, value)
+
+    # Group several saves of one user: one transaction, or one queue batch
+    # (which may be split across commits; use save_many when that matters)
+    def writes(self, user_id=None):
+        if self.write_queue is not None:
+            return nullcontext()
+        return self.db.transaction(user_id)
+
+    # Make queued writes visible before reading them back
+    def flush(self):
+        if self.write_queue is not None:
+            self.write_queue.flush()
+
+    # [(date, value)] oldest first
+    def load(self, user_id, data_type):
+        self.flush()
+        with self.db.connection(user_id) as conn:
+            with self.recorder.timer('sql', statement=f"select:{data_type}") as event:
+                values = load_values(conn, user_id, data_type)
+                event['rows'] = len(values)
+        return values
+
+    # {data_type: History} from the shared cache while the user's change seq
+    # says nobody wrote since (one indexed lookup), else one query; the
+    # histories are the caller's to append to
+    def profile(self, user_id):
+        with self.db.snapshot(user_id) as conn:
+            seq = change_seq(conn, user_id)
+        profile = self.cache.get_profile(user_id, seq)
+        if profile is None:
+            self.flush()
+            # The profile and its seq from the same snapshot
+            with self.db.snapshot(user_id) as conn:
+                with self.recorder.timer('sql', statement='select:profile') as event:
+                    seq = change_seq(conn, user_id)
+                    profile = load_profile(conn, user_id)
+                    event['rows'] = sum(len(entries) for entries in profile.values())
+            self.cache.put_profile(user_id, profile, seq)
+        return profile
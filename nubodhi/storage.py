@@ -0,0 +1,107 @@
+"""Read and write user data through the typed schema."""
+from . import codec
+from .history import History
+from .rollups import rollup_statements
+from .schema import LEGACY_TABLE, TABLES, decode_row, delete_day_sql, encode_row, insert_sql
+
+
+_INSERT_SQL = {data_type: insert_sql(table) for data_type, table in TABLES.items()}
+_APPEND_SQL = {data_type: insert_sql(table, upsert=False) for data_type, table in TABLES.items()}
+
+
+# Build the (sql, params) INSERT for one saved value; daily data types
+# upsert (see schema.Table), data types without a typed table go to user_data
+def insert_statement(user_id, data_type, date, value):
+    table = TABLES.get(data_type)
+    if table is None:
+        version, payload = codec.encode(value)
+        return (f"INSERT INTO {LEGACY_TABLE} (user_id, data_type, date, value, codec) VALUES (?, ?, ?, ?, ?)",
+                (user_id, data_type, date, payload, version))
+    return _INSERT_SQL[data_type], (user_id, date, *encode_row(table, value))
+
+
+# Marks a user's day of a data_type as changed with the user's next
+# sequence number, for delta sync (see nubodhi.api)
+CHANGE_SQL = ("INSERT INTO changes (user_id, data_type, date, seq) "
+              "VALUES (?1, ?2, ?3, (SELECT coalesce(max(seq), 0) + 1 FROM changes WHERE user_id = ?1)) "
+              "ON CONFLICT (user_id, data_type, date) DO UPDATE SET seq = excluded.seq")
+
+
+# The user's latest change sequence number (0 before their first save); it
+# goes up by one with every save, whichever process makes it
+def change_seq(conn, user_id):
+    return conn.execute("SELECT coalesce(max(seq), 0) FROM changes WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+# Every (sql, params) a save runs: the INSERT, the change mark and the
+# rollup updates, which must commit together and run in this order.
+# `compacting`: the store's daily tables still waiting for nubodhi.compact,
+# whose rows are replaced with a delete and an insert instead of an upsert
+def write_statements(user_id, data_type, date, value, compacting=()):
+    insert = insert_statement(user_id, data_type, date, value)
+    table = TABLES.get(data_type)
+    if table is not None and table.name in compacting:
+        inserts = [(delete_day_sql(table), (user_id, date)), (_APPEND_SQL[data_type], insert[1])]
+    else:
+        inserts = [insert]
+    return [*inserts, (CHANGE_SQL, (user_id, data_type, date)), *rollup_statements(user_id, data_type, date, value)]
+
+
+# Insert one saved value. The caller owns the transaction (see nubodhi.db).
+def save_value(conn, user_id, data_type, date, value):
+    for statement in write_statements(user_id, data_type, date, value):
+        conn.execute(*statement)
+
+
+# Return [(date, value)] oldest first, with values decoded to what was saved
+def load_values(conn, user_id, data_type):
+    c = conn.cursor()
+    table = TABLES.get(data_type)
+    if table is None:
+        c.execute(f"SELECT date, value, codec FROM {LEGACY_TABLE} "
+                  f"WHERE user_id = ? AND data_type = ? AND codec IS NOT ? ORDER BY date",
+                  (user_id, data_type, codec.UNREADABLE))
+        return [(date, codec.decode(value, version)) for date, value, version in c.fetchall()]
+    columns = ', '.join(column for column, _, _ in table.columns)
+    c.execute(f"SELECT date, {columns} FROM {table.name} WHERE user_id = ? ORDER BY date, id",
+              (user_id,))
+    return [(row[0], decode_row(table, user_id, row[0], row[1:])) for row in c.fetchall()]
+
+
+# One statement covering every typed table: (data_type, date, id, c1..cN),
+# with narrower tables padded by NULL columns
+def _profile_sql():
+    width = max(len(table.columns) for table in TABLES.values())
+    selects = []
+    for data_type, table in TABLES.items():
+        columns = [column for column, _, _ in table.columns]
+        columns += ['NULL'] * (width - len(columns))
+        selects.append(f"SELECT '{data_type}', date, id, {', '.join(columns)} "
+                       f"FROM {table.name} WHERE user_id = :user_id")
+    # Ordering by (date, id) alone lets every branch stream from its index
+    return ' UNION ALL '.join(selects) + ' ORDER BY 2, 3'
+
+
+PROFILE_SQL = _profile_sql()
+
+
+# Histories from PROFILE_SQL rows: {data_type: History}, oldest first
+def profile_from_rows(user_id, rows):
+    grouped = {data_type: [] for data_type in TABLES}
+    for row in rows:
+        grouped[row[0]].append(row)
+    profile = {}
+    for data_type, table_rows in grouped.items():
+        if not table_rows:
+            profile[data_type] = History(data_type, user_id)
+            continue
+        _, dates, _, *columns = zip(*table_rows)
+        profile[data_type] = History.from_columns(data_type, user_id, dates, columns[:len(TABLES[data_type].columns)])
+    return profile
+
+
+# Load every typed data_type for a user in a single query. Returns
+# {data_type: History} oldest first; rows go straight into the history
+# columns without building per-entry dicts (see nubodhi.history).
+def load_profile(conn, user_id):
+    return profile_from_rows(user_id, conn.execute(PROFILE_SQL, {'user_id': user_id}))
@@ -0,0 +1,147 @@
+"""Thumbnails and medium previews for progress photos.
+
+Derivatives are EXIF-orientation corrected JPEGs cached on disk under
+``uploads/derived/<aa>/<sha256>_<size>.jpg``, keyed by the hash of the
+source file, so identical photos share them and they never go stale. New
+photos are rendered in a background process pool when they are saved;
+existing uploads can be backfilled with:
+
+    python -m nubodhi.thumbnails backfill [--db nubodhi_data.db] [--root uploads]
+
+(--db takes any backend spec, see ``nubodhi.backends``.)
+"""
+import argparse
+import atexit
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageOps
+
+from .backends import open_backend
+from .schema import PHOTO_VIEWS, TABLES
+from .uploads import UPLOAD_ROOT, content_hash
+
+SIZES = {'thumb': 200, 'medium': 800}
+DERIVED_DIR = 'derived'  # also known to uploads.collect_garbage
+JPEG_QUALITY = 85
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def derivative_path(sha256, size, root=UPLOAD_ROOT):
+    return os.path.join(root, DERIVED_DIR, sha256[:2], f"{sha256}_{size}.jpg")
+
+
+# Render every missing derivative of one image; runs in a worker process
+def render_derivatives(source, sha256, root=UPLOAD_ROOT):
+    targets = {size: derivative_path(sha256, size, root) for size in SIZES}
+    todo = {size: path for size, path in targets.items() if not os.path.exists(path)}
+    if todo:
+        with Image.open(source) as image:
+            image = ImageOps.exif_transpose(image).convert('RGB')
+            for size, path in todo.items():
+                copy = image.copy()
+                copy.thumbnail((SIZES[size], SIZES[size]))
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.tmp"
+                copy.save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+                os.replace(tmp_path, path)
+    return targets
+
+
+# Path of a ready derivative, or None if it has not been rendered yet
+def derivative_for(path, size='thumb', root=UPLOAD_ROOT):
+    try:
+        candidate = derivative_path(content_hash(path), size, root)
+    except OSError:
+        return None
+    return candidate if os.path.exists(candidate) else None
+
+
+class DerivativePool:
+    def __init__(self, root=UPLOAD_ROOT, max_workers=2):
+        self.root = root
+        # spawn: workers must not inherit the app's threads and open connections
+        self._executor = ProcessPoolExecutor(max_workers=max_workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+        self._pending = {}
+        self._lock = threading.Lock()
+        atexit.register(self.shutdown)
+
+    # Queue derivatives for an image; returns a future (shared while in flight)
+    def submit(self, path):
+        if not path.lower().endswith(IMAGE_EXTENSIONS):
+            return None
+        sha256 = content_hash(path)
+        with self._lock:
+            future = self._pending.get(sha256)
+            if future is None:
+                future = self._executor.submit(render_derivatives, path, sha256, self.root)
+                self._pending[sha256] = future
+                future.add_done_callback(lambda _: self._forget(sha256))
+        return future
+
+    def _forget(self, sha256):
+        with self._lock:
+            self._pending.pop(sha256, None)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait, cancel_futures=not wait)
+
+
+# Every progress photo path referenced by a saved row
+def photo_paths(conn):
+    table = TABLES['progress_photos'].name
+    paths = set()
+    for row in conn.execute(f"SELECT {', '.join(PHOTO_VIEWS)} FROM {table}"):
+        paths.update(path for path in row if path)
+    return sorted(paths)
+
+
+def backfill(db, root=UPLOAD_ROOT, max_workers=None, progress=None):
+    stats = {'rendered': 0, 'up_to_date': 0, 'missing': 0, 'failed': 0}
+    paths = set()
+    for store in db.stores():
+        with store.connection() as conn:
+            paths.update(photo_paths(conn))
+    paths = sorted(paths)
+    futures = []
+    with ProcessPoolExecutor(max_workers=max_workers,
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        for path in paths:
+            if not os.path.exists(path):
+                stats['missing'] += 1
+                continue
+            sha256 = content_hash(path)
+            if all(os.path.exists(derivative_path(sha256, size, root)) for size in SIZES):
+                stats['up_to_date'] += 1
+                continue
+            futures.append((path, executor.submit(render_derivatives, path, sha256, root)))
+        for path, future in futures:
+            try:
+                future.result()
+                stats['rendered'] += 1
+            except Exception as e:
+                stats['failed'] += 1
+                if progress:
+                    progress(f"failed: {path}: {e}")
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render thumbnails for existing progress photos.")
+    parser.add_argument('command', choices=['backfill'])
+    parser.add_argument('--db', default='nubodhi_data.db')
+    parser.add_argument('--root', default=UPLOAD_ROOT)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    db = open_backend(args.db)
+    stats = backfill(db, args.root, args.workers, progress=print)
+    print(f"Rendered {stats['rendered']} photos, {stats['up_to_date']} already done, "
+          f"{stats['missing']} missing on disk, {stats['failed']} failed")
+
+
+if __name__ == '__main__':
+    main()
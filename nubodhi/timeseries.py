@@ -0,0 +1,147 @@
+"""Time series for the progress charts.
+
+Each chartable metric is read out of the session's histories once (whole
+columns at a time for ``nubodhi.history.History``),
+turned into a date-indexed pandas Series with one value per day (the last
+save of the day wins), optionally resampled to weeks or months and smoothed
+with a rolling mean, and finally downsampled with Largest-Triangle-Three-
+Buckets (LTTB) to a fixed point budget. The chart payload stays the same
+size however long the history is, and peaks and dips survive the
+downsampling, which plain decimation would drop.
+"""
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from .history import History
+
+# label: chart column, source: key path to the history list in user_data,
+# date/value: key paths inside one history entry,
+# zero_is_missing: 0 means "not entered" (form defaults), not a reading
+Metric = namedtuple('Metric', ['label', 'source', 'date', 'value', 'zero_is_missing'])
+
+METRICS = {
+    'weight': Metric('Weight (kg)', ('weight_history',), (0,), (1,), True),
+    'waist': Metric('Waist (cm)', ('body_measurements_history',), ('date',), ('measurements', 'waist'), True),
+    'hips': Metric('Hips (cm)', ('body_measurements_history',), ('date',), ('measurements', 'hips'), True),
+    'mood': Metric('Mood (1-10)', ('mood_log',), ('date',), ('mood',), False),
+    'energy': Metric('Energy (1-10)', ('mood_log',), ('date',), ('energy',), False),
+    'sleep_hours': Metric('Sleep (hours)', ('mood_log',), ('date',), ('sleep_hours',), False),
+    'sleep_quality': Metric('Sleep Quality (1-10)', ('mood_log',), ('date',), ('sleep_quality',), False),
+    'body_fat': Metric('Body Fat %', ('health_metrics', 'body_composition'), ('date',), ('metrics', 'body_fat'), True),
+    'muscle_mass': Metric('Muscle Mass (kg)', ('health_metrics', 'body_composition'), ('date',),
+                          ('metrics', 'muscle_mass'), True),
+    'biophotonic': Metric('Biophotonic Score', ('health_metrics', 'biophotonic_scan'), ('date',), ('score',), True),
+}
+
+FREQUENCIES = {'Day': 'D', 'Week': 'W', 'Month': 'ME'}
+MAX_POINTS = 500
+
+# date.toordinal() of 1970-01-01
+_EPOCH_ORDINAL = 719163
+
+
+def _get(item, path):
+    for key in path:
+        if item is None:
+            return None
+        try:
+            item = item[key]
+        except (KeyError, IndexError, TypeError):
+            return None
+    return item
+
+
+# The history list a metric reads from
+def history_for(user_data, metric):
+    return _get(user_data, METRICS[metric].source) or []
+
+
+# (dates, values) straight from a History's columns, or None if the metric
+# is not stored as a numeric column there
+def _columns(entries, spec):
+    if not isinstance(entries, History) or spec.date != ('date',):
+        return None
+    ordinals, column = entries.ordinals(), entries.column(spec.value)
+    if ordinals is None or column is None or isinstance(column, list):
+        return None
+    days = np.asarray(ordinals, dtype=np.int64) - _EPOCH_ORDINAL
+    return pd.DatetimeIndex(days.astype('datetime64[D]').astype('datetime64[ns]')), np.array(column, dtype=float)
+
+
+# Date-indexed float Series of one metric, one value per day
+def metric_series(entries, metric):
+    spec = METRICS[metric]
+    columns = _columns(entries, spec)
+    if columns is not None:
+        index, values = columns
+    else:
+        dates = [_get(entry, spec.date) for entry in entries]
+        values = pd.to_numeric(pd.Series([_get(entry, spec.value) for entry in entries], dtype=object),
+                               errors='coerce').to_numpy(dtype=float)
+        index = pd.to_datetime(dates, format='%Y-%m-%d', errors='coerce')
+    series = pd.Series(values, index=index, name=spec.label)
+    if spec.zero_is_missing:
+        series = series.where(series != 0)
+    series = series[series.index.notna()].dropna()
+    # Several saves on one day: keep the last one
+    series = series[~series.index.duplicated(keep='last')]
+    return series.sort_index(kind='stable')
+
+
+# Mean per calendar period; freq is a pandas alias or a FREQUENCIES label
+def resample(series, freq='D'):
+    freq = FREQUENCIES.get(freq, freq)
+    if freq == 'D' or series.empty:
+        return series
+    return series.resample(freq).mean().dropna()
+
+
+# Mean over the trailing `days` calendar days (not the trailing n points)
+def rolling_mean(series, days):
+    return series.rolling(f"{days}D", min_periods=1).mean()
+
+
+# Indices of the points LTTB keeps out of (x, y), always including both ends
+def lttb(x, y, threshold):
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    # Bucket edges for the n - 2 interior points
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    keep = np.empty(threshold, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        # Average of the next bucket is the third triangle corner
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(area.argmax())
+        keep[i + 1] = a
+    return keep
+
+
+# Shrink a Series to at most max_points with LTTB
+def downsample(series, max_points=MAX_POINTS):
+    if len(series) <= max_points:
+        return series
+    x = series.index.asi8 if isinstance(series.index, pd.DatetimeIndex) else np.arange(len(series))
+    return series.iloc[lttb(x, series.to_numpy(), max_points)]
+
+
+# Chart-ready frame for one metric: resampled, optionally with a rolling
+# mean column, downsampled, indexed by date
+def chart_frame(entries, metric, freq='D', rolling_days=None, max_points=MAX_POINTS):
+    series = resample(metric_series(entries, metric), freq)
+    frame = series.to_frame()
+    if rolling_days and not series.empty:
+        frame[f"{rolling_days}-day average"] = rolling_mean(series, rolling_days)
+    if len(frame) > max_points:
+        frame = frame.iloc[lttb(frame.index.asi8, series.to_numpy(), max_points)]
+    return frame
@@ -0,0 +1,358 @@
+"""Bulk export and import of user histories.
+
+Export streams one data_type at a time with ``fetchmany``, so memory stays
+flat however many rows are written. Typed tables produce one column per
+field (``user_id, date, mood, energy, ...``), which makes the CSV easy to
+fill from a spreadsheet. Data types without a typed table produce
+``user_id, date, value`` with the value as JSON. Parquet output (pyarrow)
+is written one row group per chunk.
+
+Import reads the same layout from CSV or Parquet. Each row is validated
+and converted to the column's type, and rows are loaded with
+``executemany``, one transaction per chunk (per store the chunk touches)
+together with their rollup updates, so the app's saves get the write lock
+in between. Rows for daily data types replace any row already saved for
+that day. An invalid row stops the import unless ``skip_invalid`` is set;
+chunks committed before it stay. With ``atomic=True`` (``--atomic``) the
+whole import is one transaction per store instead: nothing is written
+unless every row is, but the app's saves wait for it, and fail once they
+have waited ``busy_timeout``.
+
+``--db`` takes a file path or a backend spec (see ``nubodhi.backends``).
+On a sharded backend, export reads every shard (one after another, so rows
+are sorted by user within each shard) and takes cohort membership from
+``main.db``; import registers new users and writes each to their shard.
+
+    python -m nubodhi.transfer export --data-type mood_log --user u1 --out mood.csv
+    python -m nubodhi.transfer export --data-type all --cohort spring --format parquet --out exports/
+    python -m nubodhi.transfer import mood.csv --data-type mood_log [--skip-invalid] [--atomic]
+    python -m nubodhi.transfer --db sharded:data export --data-type all --out exports/
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import zipfile
+from contextlib import ExitStack
+from datetime import date as Date
+
+from . import codec
+from .backends import open_backend
+from .rollups import rollup_statements
+from .schema import DECODERS, LEGACY_TABLE, TABLES, insert_rows_statements
+from .storage import CHANGE_SQL
+
+CHUNK_SIZE = 5000
+FORMATS = ('csv', 'parquet')
+
+
+# stats: what an import had saved when it stopped (see import_records)
+class TransferError(ValueError):
+    def __init__(self, message, stats=None):
+        super().__init__(message)
+        self.stats = stats
+
+
+# Column names of a data_type's export, after user_id and date
+def export_columns(data_type):
+    table = TABLES.get(data_type)
+    if table is None:
+        return ['value']
+    return [column for column, _, _ in table.columns]
+
+
+def _members_sql(user_ids, cohort):
+    if cohort is not None:
+        return " AND user_id IN (SELECT user_id FROM cohort_members WHERE cohort = ?)", [cohort]
+    if user_ids:
+        # One parameter however many users (SQLite caps the number of ?s)
+        return " AND user_id IN (SELECT value FROM json_each(?))", [json.dumps(list(user_ids))]
+    return "", []
+
+
+# Yield lists of up to chunk_size rows (user_id, date, *export_columns) for
+# the given users, a cohort, or everyone
+def export_chunks(conn, data_type, user_ids=None, cohort=None, chunk_size=CHUNK_SIZE):
+    members, params = _members_sql(user_ids, cohort)
+    table = TABLES.get(data_type)
+    if table is None:
+        cursor = conn.execute(f"SELECT user_id, date, value, codec FROM {LEGACY_TABLE} "
+                              f"WHERE data_type = ? AND codec IS NOT ?{members} ORDER BY user_id, date",
+                              [data_type, codec.UNREADABLE, *params])
+    else:
+        columns = ', '.join(export_columns(data_type))
+        # SQLite hands BOOLEAN columns back as 0/1
+        bools = {i + 2 for i, (_, sql_type, _) in enumerate(table.columns) if sql_type == 'BOOLEAN'}
+        cursor = conn.execute(f"SELECT user_id, date, {columns} FROM {table.name} WHERE 1{members} "
+                              f"ORDER BY user_id, date, id", params)
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        if table is None:
+            rows = [(user_id, date, json.dumps(codec.decode(value, version), default=str))
+                    for user_id, date, value, version in rows]
+        elif bools:
+            rows = [tuple(bool(value) if i in bools and value is not None else value
+                          for i, value in enumerate(row)) for row in rows]
+        yield rows
+
+
+# The same for every store of a backend. A cohort's members are read from
+# the store with the global tables, since shards have no cohort_members
+def backend_export_chunks(db, data_type, user_ids=None, cohort=None, chunk_size=CHUNK_SIZE):
+    if cohort is not None:
+        with db.connection() as conn:
+            user_ids = [row[0] for row in conn.execute(
+                "SELECT user_id FROM cohort_members WHERE cohort = ? ORDER BY user_id", (cohort,))]
+        if not user_ids:
+            return
+    for store in db.stores():
+        with store.snapshot() as conn:
+            yield from export_chunks(conn, data_type, user_ids, chunk_size=chunk_size)
+
+
+def write_csv(fileobj, data_type, chunks):
+    writer = csv.writer(fileobj)
+    writer.writerow(['user_id', 'date', *export_columns(data_type)])
+    count = 0
+    for rows in chunks:
+        writer.writerows(rows)
+        count += len(rows)
+    return count
+
+
+def export_csv(conn, fileobj, data_type, user_ids=None, cohort=None, chunk_size=CHUNK_SIZE):
+    return write_csv(fileobj, data_type, export_chunks(conn, data_type, user_ids, cohort, chunk_size))
+
+
+def _arrow_schema(data_type):
+    import pyarrow as pa
+    types = {'INTEGER': pa.int64(), 'REAL': pa.float64(), 'BOOLEAN': pa.bool_(), 'TEXT': pa.string()}
+    table = TABLES.get(data_type)
+    fields = [('user_id', pa.string()), ('date', pa.string())]
+    if table is None:
+        fields.append(('value', pa.string()))
+    else:
+        fields += [(column, types[sql_type]) for column, sql_type, _ in table.columns]
+    return pa.schema(fields)
+
+
+def write_parquet(path, data_type, chunks):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise TransferError("Parquet export needs pyarrow (pip install pyarrow)") from None
+    schema = _arrow_schema(data_type)
+    count = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for rows in chunks:
+            columns = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(values, type=field.type)
+                                                     for values, field in zip(columns, schema)], schema=schema))
+            count += len(rows)
+    return count
+
+
+def export_parquet(conn, path, data_type, user_ids=None, cohort=None, chunk_size=CHUNK_SIZE):
+    return write_parquet(path, data_type, export_chunks(conn, data_type, user_ids, cohort, chunk_size))
+
+
+# Every data_type of the given users as CSV files in one zip, in memory;
+# meant for a single client's download
+def export_zip(conn, user_ids):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for data_type in TABLES:
+            text = io.StringIO()
+            if export_csv(conn, text, data_type, user_ids):
+                archive.writestr(f"{data_type}.csv", text.getvalue())
+    return buffer.getvalue()
+
+
+_BOOLEANS = {'1': True, 'true': True, 'yes': True, 'y': True, '0': False, 'false': False, 'no': False, 'n': False}
+
+
+def _convert(value, sql_type):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        return None
+    if sql_type == 'INTEGER':
+        number = float(value)
+        if not number.is_integer():
+            raise ValueError(f"{value!r} is not a whole number")
+        return int(number)
+    if sql_type == 'REAL':
+        return float(value)
+    if sql_type == 'BOOLEAN':
+        if isinstance(value, bool):
+            return value
+        try:
+            return _BOOLEANS[str(value).strip().lower()]
+        except KeyError:
+            raise ValueError(f"{value!r} is not true/false") from None
+    return str(value)
+
+
+# Validate one record (a dict keyed by column) into (user_id, date, *values)
+def validate_record(data_type, record):
+    user_id = str(record.get('user_id') or '').strip()
+    if not user_id:
+        raise ValueError("missing user_id")
+    try:
+        date = Date.fromisoformat(str(record.get('date') or '').strip()[:10]).isoformat()
+    except ValueError:
+        raise ValueError(f"bad date {record.get('date')!r}, expected YYYY-MM-DD") from None
+    table = TABLES.get(data_type)
+    if table is None:
+        try:
+            value = json.loads(record.get('value') or 'null')
+        except ValueError as e:
+            raise ValueError(f"value is not JSON: {e}") from None
+        return (user_id, date, value)
+    values = []
+    for column, sql_type, _ in table.columns:
+        try:
+            values.append(_convert(record.get(column), sql_type))
+        except ValueError as e:
+            raise ValueError(f"{column}: {e}") from None
+    return (user_id, date, *values)
+
+
+def read_csv(fileobj):
+    yield from csv.DictReader(fileobj)
+
+
+def read_parquet(path, chunk_size=CHUNK_SIZE):
+    try:
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise TransferError("Parquet import needs pyarrow (pip install pyarrow)") from None
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        yield from batch.to_pylist()
+
+
+def _statements(data_type, rows, compacting=()):
+    table = TABLES.get(data_type)
+    if table is None:
+        sql = f"INSERT INTO {LEGACY_TABLE} (user_id, data_type, date, value, codec) VALUES (?, ?, ?, ?, ?)"
+        return {sql: [(user_id, data_type, date, *reversed(codec.encode(value))) for user_id, date, value in rows]}
+    statements = dict(insert_rows_statements(table, rows, compacting))
+    statements[CHANGE_SQL] = list(dict.fromkeys((user_id, data_type, date) for user_id, date, *_ in rows))
+    decode = DECODERS[table.name]
+    # Daily data types recompute whole periods, once per period is enough
+    refreshed = set()
+    for user_id, date, *values in rows:
+        value = decode(user_id, date, values)
+        for sql, params in rollup_statements(user_id, data_type, date, value):
+            if table.daily:
+                key = (sql, *params.values())
+                if key in refreshed:
+                    continue
+                refreshed.add(key)
+            statements.setdefault(sql, []).append(params)
+    return statements
+
+
+# Load records (dicts keyed by column) into a data_type, committing each
+# chunk_size chunk (its users registered and written to their stores) as it
+# goes, or everything at once if atomic. Returns stats: imported, skipped,
+# users and the first few errors
+def import_records(db, data_type, records, skip_invalid=False, chunk_size=CHUNK_SIZE, atomic=False):
+    stats = {'imported': 0, 'skipped': 0, 'users': set(), 'errors': []}
+    with ExitStack() as stack:
+        if atomic:
+            # The chunks' transactions join these, which commit at the end
+            for store in db.stores():
+                stack.enter_context(store.transaction())
+        batch = []
+        for number, record in enumerate(records, 1):
+            try:
+                batch.append(validate_record(data_type, record))
+            except ValueError as e:
+                if not skip_invalid:
+                    raise TransferError(f"row {number}: {e}", stats) from None
+                stats['skipped'] += 1
+                if len(stats['errors']) < 20:
+                    stats['errors'].append(f"row {number}: {e}")
+                continue
+            if len(batch) >= chunk_size:
+                _load_batch(db, data_type, batch, stats)
+                batch = []
+        _load_batch(db, data_type, batch, stats)
+    return stats
+
+
+def _load_batch(db, data_type, rows, stats):
+    for group in db.partition(dict.fromkeys(row[0] for row in rows)):
+        members = set(group)
+        with db.transaction(group) as conn:
+            _load(conn, data_type, [row for row in rows if row[0] in members], stats,
+                  db.store(group[0]).compacting)
+
+
+def _load(conn, data_type, rows, stats, compacting=()):
+    for sql, params in _statements(data_type, rows, compacting).items():
+        conn.executemany(sql, params)
+    stats['imported'] += len(rows)
+    stats['users'].update(row[0] for row in rows)
+
+
+def import_file(db, path, data_type, skip_invalid=False, chunk_size=CHUNK_SIZE, atomic=False):
+    if path.endswith('.parquet'):
+        return import_records(db, data_type, read_parquet(path, chunk_size), skip_invalid, chunk_size, atomic)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return import_records(db, data_type, read_csv(f), skip_invalid, chunk_size, atomic)
+
+
+def _export(db, args):
+    data_types = list(TABLES) if args.data_type == 'all' else [args.data_type]
+    if args.data_type == 'all':
+        os.makedirs(args.out, exist_ok=True)
+    for data_type in data_types:
+        path = (os.path.join(args.out, f"{data_type}.{args.format}") if args.data_type == 'all' else args.out)
+        chunks = backend_export_chunks(db, data_type, args.user, args.cohort)
+        if args.format == 'parquet':
+            count = write_parquet(path, data_type, chunks)
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                count = write_csv(f, data_type, chunks)
+        print(f"{data_type}: {count:,} rows -> {path}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk export and import of NuBodhi user histories.")
+    parser.add_argument('--db', default='nubodhi_data.db', help="database path or backend spec")
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help="write rows to CSV or Parquet")
+    export.add_argument('--data-type', required=True, help="a data_type, or 'all' (one file each in --out)")
+    export.add_argument('--user', action='append', help="repeat for several users (default: everyone)")
+    export.add_argument('--cohort', help="export the members of this cohort")
+    export.add_argument('--format', choices=FORMATS, default='csv')
+    export.add_argument('--out', required=True, help="output file, or directory with --data-type all")
+    load = commands.add_parser('import', help="load rows from CSV or Parquet")
+    load.add_argument('path')
+    load.add_argument('--data-type', required=True)
+    load.add_argument('--skip-invalid', action='store_true', help="skip bad rows instead of aborting")
+    load.add_argument('--atomic', action='store_true',
+                      help="all or nothing: one transaction, which holds the write lock until the end")
+    args = parser.parse_args(argv)
+
+    db = open_backend(args.db)
+    if args.command == 'export':
+        _export(db, args)
+        return
+    try:
+        stats = import_file(db, args.path, args.data_type, args.skip_invalid, atomic=args.atomic)
+    except TransferError as e:
+        saved = (f"{e.stats['imported']:,} rows before it were saved" if e.stats and not args.atomic
+                 else "nothing was written")
+        parser.exit(1, f"Import aborted, {saved}: {e}\n")
+    print(f"Imported {stats['imported']:,} rows for {len(stats['users']):,} users; skipped {stats['skipped']:,}")
+    for error in stats['errors']:
+        print(f"  {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,188 @@
+"""Content-addressed store for uploaded files.
+
+Uploads are streamed to a temporary file in fixed-size chunks and hashed
+while they are written. The file is then renamed atomically to
+``uploads/<aa>/<bb>/<sha256><ext>``. Identical content is stored once, the
+two-level sharding keeps directories small, and a crash never leaves a
+half-written file under its final name. Size and hash are recorded in the
+``uploads`` table.
+
+Files no longer referenced by any progress_photos, blood_work or
+body_composition row can be removed with:
+
+    python -m nubodhi.uploads gc [--db nubodhi_data.db] [--root uploads] [--dry-run]
+
+(--db takes any backend spec, see ``nubodhi.backends``; every shard is
+searched for references.)
+
+Files written by the old app directly under ``uploads/`` are left alone.
+Derived images (``uploads/derived/``, see ``thumbnails``) are removed with
+their source.
+"""
+import argparse
+import hashlib
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+from functools import lru_cache
+
+from .backends import open_backend
+from .schema import FILE_COLUMNS, TABLES
+
+UPLOAD_ROOT = 'uploads'
+CHUNK_SIZE = 1024 * 1024
+# Unreferenced files younger than this may belong to a save still in progress
+GC_GRACE_SECONDS = 3600
+_TMP_DIR = 'tmp'
+_DERIVED_DIR = 'derived'
+
+
+def _extension(name):
+    ext = os.path.splitext(name or '')[1].lower()
+    return ext if re.fullmatch(r'\.[a-z0-9]{1,8}', ext) else ''
+
+
+def store_path(sha256, ext, root=UPLOAD_ROOT):
+    return os.path.join(root, sha256[:2], sha256[2:4], sha256 + ext)
+
+
+@lru_cache(maxsize=4096)
+def _hash_file(path, mtime):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Content hash of an uploaded file; free for files in the store, which are
+# named by their hash
+def content_hash(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    if re.fullmatch(r'[0-9a-f]{64}', name):
+        return name
+    return _hash_file(path, os.path.getmtime(path))
+
+
+# Stream a file-like object into the store; returns its path
+def store_upload(db, fileobj, name=None, root=UPLOAD_ROOT):
+    name = name or getattr(fileobj, 'name', '')
+    tmp_dir = os.path.join(root, _TMP_DIR)
+    os.makedirs(tmp_dir, exist_ok=True)
+    digest = hashlib.sha256()
+    size = 0
+    if hasattr(fileobj, 'seek'):
+        fileobj.seek(0)
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            while True:
+                chunk = fileobj.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                f.write(chunk)
+                size += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        sha256 = digest.hexdigest()
+        path = store_path(sha256, _extension(name), root)
+        if os.path.exists(path):
+            # Same content is already stored; refresh its mtime so a
+            # concurrent gc pass treats it as new
+            os.remove(tmp_path)
+            os.utime(path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    with db.transaction() as conn:
+        conn.execute("INSERT OR IGNORE INTO uploads (path, sha256, size, original_name, created_at) "
+                     "VALUES (?, ?, ?, ?, ?)",
+                     (path, sha256, size, name, datetime.now().isoformat(timespec='seconds')))
+    return path
+
+
+# Changes whenever a file is added to or removed from the store
+def upload_generation(conn):
+    return conn.execute("SELECT count(*), coalesce(max(rowid), 0) FROM uploads").fetchone()
+
+
+# Every upload path referenced by a saved row
+def referenced_paths(conn):
+    paths = set()
+    for data_type, columns in FILE_COLUMNS.items():
+        table = TABLES[data_type].name
+        for column in columns:
+            for (path,) in conn.execute(f"SELECT DISTINCT {column} FROM {table} WHERE {column} IS NOT NULL"):
+                paths.add(os.path.normpath(path))
+    return paths
+
+
+# Remove stored files (and their metadata) that no row references
+def collect_garbage(db, root=UPLOAD_ROOT, grace_seconds=GC_GRACE_SECONDS, dry_run=False):
+    stats = {'removed': 0, 'bytes': 0, 'kept': 0, 'stale_tmp': 0, 'missing': 0}
+    cutoff = time.time() - grace_seconds
+    referenced = set()
+    for store in db.stores():
+        with store.connection() as conn:
+            referenced |= referenced_paths(conn)
+    with db.connection() as conn:
+        known = {os.path.normpath(path): path for (path,) in conn.execute("SELECT path FROM uploads")}
+    missing = [(path,) for norm, path in known.items() if norm not in referenced and not os.path.exists(norm)]
+    referenced_hashes = {content_hash(path) for path in referenced if os.path.exists(path)}
+    derived_root = os.path.normpath(os.path.join(root, _DERIVED_DIR))
+    removed = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        if os.path.normpath(dirpath) == os.path.normpath(root):
+            # Only the sharded store; flat files from the old app stay put
+            dirnames[:] = [d for d in dirnames if re.fullmatch(r'[0-9a-f]{2}', d) or d in (_TMP_DIR, _DERIVED_DIR)]
+            continue
+        is_tmp = os.path.basename(dirpath) == _TMP_DIR
+        is_derived = os.path.normpath(dirpath).startswith(derived_root)
+        for filename in filenames:
+            path = os.path.normpath(os.path.join(dirpath, filename))
+            stat = os.stat(path)
+            if is_derived:
+                keep = filename[:64] in referenced_hashes
+            else:
+                keep = not is_tmp and path in referenced
+            if stat.st_mtime > cutoff or keep:
+                stats['kept'] += 1
+                continue
+            stats['stale_tmp' if is_tmp else 'removed'] += 1
+            stats['bytes'] += stat.st_size
+            if not dry_run:
+                os.remove(path)
+            if path in known:
+                removed.append((known[path],))
+    stats['missing'] = len(missing)
+    if not dry_run:
+        with db.transaction() as conn:
+            conn.executemany("DELETE FROM uploads WHERE path = ?", removed + missing)
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Maintain the NuBodhi upload store.")
+    parser.add_argument('command', choices=['gc'])
+    parser.add_argument('--db', default='nubodhi_data.db')
+    parser.add_argument('--root', default=UPLOAD_ROOT)
+    parser.add_argument('--grace', type=int, default=GC_GRACE_SECONDS, help="seconds before an unreferenced file may go")
+    parser.add_argument('--dry-run', action='store_true')
+    args = parser.parse_args(argv)
+
+    db = open_backend(args.db)
+    stats = collect_garbage(db, args.root, args.grace, args.dry_run)
+    verb = "Would remove" if args.dry_run else "Removed"
+    print(f"{verb} {stats['removed']} unreferenced files and {stats['stale_tmp']} stale temp files "
+          f"({stats['bytes']:,} bytes); kept {stats['kept']}; {stats['missing']} metadata rows had no file")
+
+
+if __name__ == '__main__':
+    main()
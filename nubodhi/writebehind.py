@@ -0,0 +1,237 @@
+"""Write-behind queue for saves.
+
+Instead of blocking a button handler on SQLite, ``submit()`` encodes the
+value, puts its statements (the INSERT and rollup upserts) on a bounded
+queue and returns a ticket. A single
+background thread drains the queue, groups statements with ``executemany``
+and commits once per batch: after ``max_rows`` rows or ``max_delay_ms``
+after the first queued row, whichever comes first. With a sharded backend
+(see ``nubodhi.backends``) a batch commits once per shard it touches.
+
+- Memory is bounded by ``max_pending`` queued rows. When the queue is full,
+  ``submit()`` blocks for up to ``put_timeout`` seconds and then raises
+  ``WriteQueueFull``.
+- ``submit_many()`` queues several writes of one user as one item: they
+  always land in the same batch and commit or fail together.
+- ``ticket.wait()`` returns once the row is committed and re-raises the
+  error if its batch (its shard's part of the batch) failed. ``flush()``
+  waits for everything submitted so far. ``ticket.on_commit(callback)``
+  runs the callback in the writer thread once the row is committed, and
+  never if it failed.
+- ``close()`` drains the queue and stops the thread. It also runs at
+  interpreter exit.
+- ``stats()`` reports queue depth, batch sizes and flush latency. Each
+  commit is also timed on ``recorder`` (see ``nubodhi.instrument``):
+  'commit' per store transaction and 'sql' per grouped statement.
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from .backends import UserMoved
+from .instrument import Recorder, statement_label
+from .storage import write_statements
+
+logger = logging.getLogger(__name__)
+
+_STOP = object()
+# Attempts at a batch whose users are being moved between shards
+_MOVE_RETRIES = 3
+
+
+class WriteQueueFull(RuntimeError):
+    pass
+
+
+def _run_callback(callback):
+    try:
+        callback()
+    except Exception:
+        logger.exception("write-behind commit callback failed")
+
+
+# Durability acknowledgement for one queued write
+class WriteTicket:
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.error = None
+
+    def _resolve(self, error=None):
+        with self._lock:
+            self.error = error
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        if error is None:
+            for callback in callbacks:
+                _run_callback(callback)
+
+    # Run callback once the write is committed (now, if it already is)
+    def on_commit(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        if self.error is None:
+            _run_callback(callback)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    # Block until committed; returns False on timeout, raises if the write failed
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            return False
+        if self.error is not None:
+            raise self.error
+        return True
+
+
+class WriteBehindQueue:
+    def __init__(self, db, max_rows=200, max_delay_ms=50, max_pending=10000, put_timeout=5.0, recorder=None):
+        self.db = db
+        self.recorder = recorder or Recorder()
+        self.max_rows = max_rows
+        self.max_delay = max_delay_ms / 1000
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._stats = {
+            'submitted': 0, 'written': 0, 'failed': 0, 'batches': 0,
+            'last_batch_rows': 0, 'last_flush_ms': 0.0, 'max_flush_ms': 0.0, 'total_flush_ms': 0.0,
+        }
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='nubodhi-write-behind', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, user_id, data_type, date, value):
+        return self.submit_many(user_id, [(data_type, date, value)])
+
+    # [(data_type, date, value)] of one user, committed in one transaction
+    def submit_many(self, user_id, writes):
+        if self._closed:
+            raise RuntimeError("write-behind queue is closed")
+        # Encode now so bad values fail in the caller, not in the writer thread
+        compacting = self.db.store(user_id).compacting
+        statements = [statement for data_type, date, value in writes
+                      for statement in write_statements(user_id, data_type, date, value, compacting)]
+        ticket = WriteTicket()
+        try:
+            self._queue.put((user_id, statements, ticket), timeout=self.put_timeout)
+        except queue.Full:
+            raise WriteQueueFull(f"{self._queue.maxsize} writes already pending") from None
+        with self._lock:
+            self._stats['submitted'] += 1
+        return ticket
+
+    # Wait until every write submitted before this call is committed
+    def flush(self, timeout=None):
+        if self._closed:
+            self._thread.join(timeout)
+            return not self._thread.is_alive()
+        marker = WriteTicket()
+        self._queue.put((None, None, marker), timeout=timeout)
+        return marker.wait(timeout)
+
+    def close(self, timeout=10):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['queue_depth'] = self._queue.qsize()
+        stats['mean_flush_ms'] = stats['total_flush_ms'] / stats['batches'] if stats['batches'] else 0.0
+        return stats
+
+    def _next_batch(self):
+        item = self._queue.get()
+        if item is _STOP:
+            return [], True
+        batch = [item]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_rows:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch, stop = self._next_batch()
+            if stop:
+                # Drain whatever is still queued before exiting
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+
+    def _write(self, batch):
+        writes = [(user_id, statements) for user_id, statements, _ in batch if statements is not None]
+        start = time.perf_counter()
+        errors = {}
+        pending = {user_id for user_id, _ in writes}
+        for attempt in range(_MOVE_RETRIES):
+            moved = set()
+            for user_ids in self.db.partition(pending):
+                members = set(user_ids)
+                try:
+                    self._commit(user_ids, [item for item in writes if item[0] in members])
+                except UserMoved as e:
+                    if attempt == _MOVE_RETRIES - 1:
+                        errors.update(dict.fromkeys(user_ids, e))
+                    else:
+                        moved.update(user_ids)
+                except Exception as e:
+                    logger.exception("write-behind batch for %d users failed", len(user_ids))
+                    errors.update(dict.fromkeys(user_ids, e))
+            if not moved:
+                break
+            pending = moved
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        failed = sum(1 for user_id, _ in writes if user_id in errors)
+        with self._lock:
+            self._stats['written'] += len(writes) - failed
+            self._stats['failed'] += failed
+            if writes:
+                self._stats['batches'] += 1
+                self._stats['last_batch_rows'] = len(writes)
+                self._stats['last_flush_ms'] = elapsed_ms
+                self._stats['max_flush_ms'] = max(self._stats['max_flush_ms'], elapsed_ms)
+                self._stats['total_flush_ms'] += elapsed_ms
+        logger.debug("write-behind: %d rows in %.1f ms, %d queued", len(writes), elapsed_ms, self._queue.qsize())
+        for user_id, statements, ticket in batch:
+            ticket._resolve(errors.get(user_id) if statements is not None else None)
+
+    # One transaction for the writes of users that share a store
+    def _commit(self, user_ids, writes):
+        statements = {}
+        for _, item_statements in writes:
+            for sql, params in item_statements:
+                statements.setdefault(sql, []).append(params)
+        with self.recorder.timer('commit', mode='queued') as commit:
+            commit['rows'] = len(writes)
+            with self.db.transaction(user_ids) as conn:
+                for sql, params in statements.items():
+                    with self.recorder.timer('sql', statement=statement_label(sql)) as event:
+                        conn.executemany(sql, params)
+                        event['rows'] = len(params)
@@ -0,0 +1,64 @@
+import json
+
+import pytest
+
+from nubodhi.api import Api
+from nubodhi.cache import HistoryCache
+from nubodhi.service import UserDataService, open_database
+from nubodhi.writebehind import WriteBehindQueue
+
+MOOD = {'data_type': 'mood_log', 'date': '2024-05-01', 'mood': 7, 'energy': 6, 'sleep_hours': 7.5,
+        'sleep_quality': 8}
+SCAN = {'data_type': 'biophotonic_scan', 'date': '2024-05-01', 'score': 42000}
+
+
+@pytest.fixture(params=['direct', 'write-behind'])
+def api(request, tmp_path):
+    db = open_database(str(tmp_path / 'api.db'))
+    # One row per queue batch, so a batch queued record by record would be split
+    write_queue = WriteBehindQueue(db, max_rows=1, max_delay_ms=0) if request.param == 'write-behind' else None
+    yield Api(UserDataService(db, HistoryCache(), write_queue))
+    if write_queue is not None:
+        write_queue.close()
+    db.close()
+
+
+def post_batch(api, user_id, writes):
+    return api.handle('POST', f'/v1/users/{user_id}/batch', body=json.dumps({'writes': writes}).encode())
+
+
+def count(api, sql, *params):
+    with api.db.connection() as conn:
+        return conn.execute(sql, params).fetchone()[0]
+
+
+def test_batch_saves_every_record(api):
+    status, payload = post_batch(api, 'u1', [MOOD, SCAN])
+    assert status == 200
+    assert payload['saved'] == 2
+    assert count(api, "SELECT count(*) FROM mood_log WHERE user_id = 'u1'") == 1
+    assert count(api, "SELECT count(*) FROM biophotonic_scan WHERE user_id = 'u1'") == 1
+
+
+def test_failing_batch_leaves_no_rows(api):
+    # Passes validation, fails in the database after the first record is written
+    with api.db.transaction() as conn:
+        conn.execute("CREATE TRIGGER reject_scan BEFORE INSERT ON biophotonic_scan "
+                     "BEGIN SELECT RAISE(ABORT, 'rejected'); END")
+    status, _ = post_batch(api, 'u1', [MOOD, SCAN])
+    assert status == 500
+    for table in ('mood_log', 'biophotonic_scan', 'changes', 'rollups'):
+        assert count(api, f"SELECT count(*) FROM {table} WHERE user_id = 'u1'") == 0
+
+    with api.db.transaction() as conn:
+        conn.execute("DROP TRIGGER reject_scan")
+    status, _ = post_batch(api, 'u1', [MOOD, SCAN])
+    assert status == 200
+    assert count(api, "SELECT count(*) FROM biophotonic_scan WHERE user_id = 'u1'") == 1
+
+
+def test_invalid_batch_saves_nothing(api):
+    status, payload = post_batch(api, 'u1', [MOOD, {**SCAN, 'score': 'high'}])
+    assert status == 400
+    assert payload['details'][0]['index'] == 1
+    assert count(api, "SELECT count(*) FROM mood_log WHERE user_id = 'u1'") == 0
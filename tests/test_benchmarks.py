@@ -0,0 +1,37 @@
+import json
+import sqlite3
+
+from benchmarks.bench_data_layer import SECTIONS, compare, main
+from benchmarks.synthetic import build_legacy_db, build_typed_db, generate_rows, user_ids
+from nubodhi.migrate import migrate_legacy_rows
+from nubodhi.storage import load_profile
+
+
+def test_synthetic_rows_are_deterministic():
+    assert list(generate_rows(3, 10, seed=4)) == list(generate_rows(3, 10, seed=4))
+    assert list(generate_rows(3, 10, seed=4)) != list(generate_rows(3, 10, seed=5))
+
+
+def test_typed_and_migrated_legacy_databases_agree():
+    typed = sqlite3.connect(':memory:', isolation_level=None)
+    rows = build_typed_db(typed, 2, 40)
+    legacy = sqlite3.connect(':memory:', isolation_level=None)
+    assert build_legacy_db(legacy, 2, 40) == rows
+    migrate_legacy_rows(legacy)
+    for user_id in user_ids(2):
+        expected, migrated = load_profile(typed, user_id), load_profile(legacy, user_id)
+        for data_type, history in expected.items():
+            assert list(migrated[data_type]) == list(history)
+
+
+def test_data_layer_run_writes_comparable_results(tmp_path, capsys):
+    out = tmp_path / 'run.json'
+    main(['--users', '5', '--days', '20', '--samples', '3', '--save-days', '1', '--out', str(out)])
+    results = json.loads(out.read_text())
+    assert results['rows'] > 0
+    for section in SECTIONS:
+        assert results[section]['mean_ms'] >= 0
+    slower = {section: {'mean_ms': results[section]['mean_ms'] * 2 + 1} for section in SECTIONS}
+    assert compare(slower, results, threshold=0.2) == len(SECTIONS)
+    assert compare(results, results, threshold=0.2) == 0
+    assert 'profile_load' in capsys.readouterr().out
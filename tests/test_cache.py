@@ -0,0 +1,89 @@
+import time
+
+import pytest
+
+from nubodhi.cache import HistoryCache
+from nubodhi.db import Database
+from nubodhi.history import History
+from nubodhi.service import UserDataService, open_database
+
+MOOD = {'mood': 7, 'energy': 6, 'sleep_hours': 7.5, 'sleep_quality': 8}
+
+
+# Two services on one database file, as two server processes would have
+@pytest.fixture
+def services(tmp_path):
+    path = str(tmp_path / 'app.db')
+    first = UserDataService(open_database(path), HistoryCache())
+    second = UserDataService(Database(path), HistoryCache())
+    yield first, second
+    first.db.close()
+    second.db.close()
+
+
+def dates(profile, data_type='mood_log'):
+    history = profile[data_type]
+    return [history.date(i) for i in range(len(history))]
+
+
+def test_profile_sees_writes_from_another_service(services):
+    first, second = services
+    first.save('u1', 'mood_log', '2024-05-01', MOOD)
+    assert dates(second.profile('u1')) == ['2024-05-01']
+    first.save('u1', 'mood_log', '2024-05-02', MOOD)
+    assert dates(second.profile('u1')) == ['2024-05-01', '2024-05-02']
+    assert second.cache.stats()['stale'] == 1
+
+
+def test_own_writes_keep_the_cached_profile(services):
+    first, _ = services
+    first.save('u1', 'mood_log', '2024-05-01', MOOD)
+    first.profile('u1')
+    first.save('u1', 'mood_log', '2024-05-02', MOOD)
+    assert dates(first.profile('u1')) == ['2024-05-01', '2024-05-02']
+    stats = first.cache.stats()
+    assert stats['stale'] == 0
+    assert stats['updates'] == 1
+
+
+def history(user_id, days):
+    return History('mood_log', user_id, [(f'2024-05-{day:02d}', [5, 5, 7.0, 5]) for day in range(1, days + 1)])
+
+
+def test_saves_update_the_cached_history_in_date_order():
+    cache = HistoryCache()
+    cache.put('u1', 'mood_log', history('u1', 3))
+    cache.record_write('u1', 'mood_log', '2024-05-02', {**MOOD, 'mood': 9})
+    cache.record_write('u1', 'mood_log', '2024-05-05', MOOD)
+    cached = cache.get('u1', 'mood_log')
+    assert [entry['date'] for entry in cached] == ['2024-05-01', '2024-05-02', '2024-05-03', '2024-05-05']
+    assert cached[1]['mood'] == 9
+
+
+def test_sessions_get_their_own_copy():
+    cache = HistoryCache()
+    cache.put('u1', 'mood_log', history('u1', 3))
+    session = cache.get('u1', 'mood_log')
+    session.append({'date': '2024-05-09', **MOOD})
+    assert len(cache.get('u1', 'mood_log')) == 3
+
+
+def test_least_recently_used_entries_go_first():
+    cache = HistoryCache(max_rows=10)
+    cache.put('u1', 'mood_log', history('u1', 4))
+    cache.put('u2', 'mood_log', history('u2', 4))
+    cache.get('u1', 'mood_log')
+    cache.put('u3', 'mood_log', history('u3', 4))
+    assert cache.get('u2', 'mood_log') is None
+    assert cache.get('u1', 'mood_log') is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['rows'] == 8
+
+
+def test_entries_expire(monkeypatch):
+    cache = HistoryCache(ttl=60)
+    cache.put('u1', 'mood_log', history('u1', 3))
+    now = time.monotonic()
+    monkeypatch.setattr(time, 'monotonic', lambda: now + 61)
+    assert cache.get('u1', 'mood_log') is None
+    assert cache.stats()['expired'] == 1
@@ -0,0 +1,62 @@
+import pytest
+
+from nubodhi.catalog import MealCatalog, fts_query
+from nubodhi.meals import meal_plans
+
+PLANS = {
+    'Vegetarian': {
+        'Monday': {
+            'Lunch': {'Meal': 'Dal Tadka', 'Ingredients': ['Yellow lentils', 'Ghee'], 'Recipe': 'Simmer lentils.'},
+            'Dinner': {'Meal': 'Egg Bhurji', 'Ingredients': ['Eggs', 'Onion'], 'Recipe': 'Scramble the eggs.'},
+        },
+        'Tuesday': {
+            'Lunch': {'Meal': 'Leftover Dal Wrap', 'Ingredients': ['Leftover dal', 'Roti'],
+                      'Recipe': 'Roll the lentils in a roti.'},
+        },
+    },
+    'Meat-Eater': {
+        'Monday': {
+            'Lunch': {'Meal': 'Chicken Curry', 'Ingredients': ['Chicken thighs', 'Tomatoes'],
+                      'Recipe': 'Cook the chicken with lentils on the side.'},
+        },
+    },
+}
+
+
+@pytest.fixture(scope='module')
+def catalog():
+    return MealCatalog(PLANS)
+
+
+def names(meals):
+    return [meal['Meal'] for meal in meals]
+
+
+def test_text_matches_stems_and_prefixes(catalog):
+    assert names(catalog.search('lentil')) == ['Dal Tadka', 'Leftover Dal Wrap', 'Chicken Curry']
+    assert names(catalog.search('scrambl')) == ['Egg Bhurji']
+    assert catalog.search('quinoa') == []
+
+
+def test_filters(catalog):
+    assert names(catalog.search('lentils', exclude_meat=True)) == ['Dal Tadka', 'Leftover Dal Wrap']
+    assert names(catalog.search(ingredient='lentils')) == ['Dal Tadka']
+    assert names(catalog.search(diet='Vegetarian', exclude_egg=True)) == ['Dal Tadka', 'Leftover Dal Wrap']
+    assert names(catalog.search(leftovers=True)) == ['Leftover Dal Wrap']
+    assert names(catalog.search(meal_type='Lunch', day='Monday')) == ['Dal Tadka', 'Chicken Curry']
+    meal = catalog.search('bhurji')[0]
+    assert (meal['diet'], meal['day'], meal['meal_type'], meal['Ingredients']) == \
+        ('Vegetarian', 'Monday', 'Dinner', ['Eggs', 'Onion'])
+
+
+def test_queries_are_not_fts_syntax(catalog):
+    assert fts_query('  ') is None
+    assert catalog.search('dal OR "chicken') == []
+    assert names(catalog.search('dal-tadka')) == ['Dal Tadka']
+
+
+def test_shipped_plans():
+    catalog = MealCatalog(meal_plans())
+    assert len(catalog) == 56
+    for query in ('chickpea', 'chickpeas'):
+        assert sorted(set(names(catalog.search(query)))) == ['Besan Cheela', 'Chana Masala with Rice']
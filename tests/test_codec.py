@@ -0,0 +1,52 @@
+import sqlite3
+
+import pytest
+
+from nubodhi import codec
+from nubodhi.migrate import migrate_legacy_rows
+from nubodhi.schema import init_schema
+from nubodhi.storage import load_values
+
+VALUES = [
+    {'date': '2024-05-01', 'items': {'exercise_snack': True}, 'mood': 7, 'note': 'ça va'},
+    [1, 2.5, None, 'x'],
+    'plain text',
+    42,
+]
+
+
+@pytest.mark.parametrize('value', VALUES)
+def test_round_trip(value):
+    version, payload = codec.encode(value)
+    assert version == codec.CURRENT_VERSION
+    assert codec.decode(payload, version) == value
+
+
+def test_legacy_payloads_are_parsed_not_evaluated():
+    assert codec.decode(str(VALUES[0]), None) == VALUES[0]
+    with pytest.raises(codec.CodecError):
+        codec.decode("__import__('os').getcwd()", codec.LEGACY)
+    with pytest.raises(codec.CodecError):
+        codec.encode(VALUES[0], codec.LEGACY)
+
+
+def test_legacy_payloads_can_be_refused(monkeypatch):
+    monkeypatch.setattr(codec, 'ACCEPT_LEGACY', False)
+    with pytest.raises(codec.CodecError):
+        codec.decode(str(VALUES[0]), None)
+
+
+def test_migrate_reencodes_and_tags_unreadable_rows():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    init_schema(conn)
+    conn.executemany("INSERT INTO user_data (user_id, data_type, date, value) VALUES ('u1', ?, ?, ?)", [
+        ('notes', '2024-05-01', str({'text': 'first'})),
+        ('notes', '2024-05-02', "{'text': 'cut off"),
+    ])
+    stats = migrate_legacy_rows(conn)
+    assert (stats['reencoded'], stats['skipped']) == (1, 1)
+    rows = dict(conn.execute("SELECT date, codec FROM user_data"))
+    assert rows == {'2024-05-01': codec.JSON, '2024-05-02': codec.UNREADABLE}
+    # Unreadable rows stay for inspection but are not loaded
+    assert load_values(conn, 'u1', 'notes') == [('2024-05-01', {'text': 'first'})]
+    conn.close()
@@ -0,0 +1,54 @@
+import pytest
+
+from nubodhi.cache import HistoryCache
+from nubodhi.cohort import backend_cohort_frame, cohort_summary, save_cohort
+from nubodhi.service import UserDataService, open_database
+
+TODAY = '2024-05-10'
+
+
+def person(weight):
+    return {'name': 'Ana', 'age': 40, 'gender': 'Female', 'height': 165, 'weight': weight,
+            'activity': 'Sedentary (little or no exercise)'}
+
+
+def mood(level):
+    return {'mood': level, 'energy': 6, 'sleep_hours': 7.0, 'sleep_quality': 7}
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = UserDataService(open_database(str(tmp_path / 'app.db')), HistoryCache())
+    yield service
+    service.db.close()
+
+
+def test_first_and_latest_profile_go_by_date(service):
+    # The later weigh-in is saved first, the starting weight backfilled after
+    service.save('u1', 'personal_info', '2024-05-08', person(80))
+    service.save('u1', 'personal_info', '2024-05-01', person(84))
+    frame = backend_cohort_frame(service.db, days=10, today=TODAY)
+    assert frame.loc['u1', 'weight'] == 80
+    assert frame.loc['u1', 'weight_change'] == -4
+
+
+def test_cohort_aggregates(service):
+    for user_id, weight in (('u1', 60), ('u2', 90), ('u3', 70)):
+        service.save(user_id, 'personal_info', '2024-05-01', person(weight))
+    for day in ('2024-05-08', '2024-05-09', '2024-05-10'):
+        service.save('u1', 'daily_checklist', day, {'items': {'exercise_snack': True}})
+    service.save('u2', 'daily_checklist', '2024-05-10', {'items': {'exercise_snack': True}})
+    service.save('u1', 'mood_log', '2024-05-09', mood(8))
+    service.save('u2', 'mood_log', '2024-05-09', mood(4))
+    with service.db.transaction() as conn:
+        save_cohort(conn, 'spring', ['u1', 'u2'])
+
+    frame = backend_cohort_frame(service.db, 'spring', days=10, today=TODAY)
+    assert list(frame.index) == ['u1', 'u2']
+    assert list(frame['days_logged']) == [3, 1]
+    assert list(frame['bmi_category']) == ['Healthy', 'Obese']
+    summary = cohort_summary(frame)
+    assert summary['clients'] == 2
+    assert summary['active_clients'] == 2
+    assert summary['mean_mood'] == 6
+    assert summary['mean_compliance'] == pytest.approx((3 / 10 + 1 / 10) / 2)
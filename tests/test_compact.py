@@ -0,0 +1,77 @@
+import pytest
+
+from nubodhi.cache import HistoryCache
+from nubodhi.compact import compact, compact_in_background
+from nubodhi.db import Database
+from nubodhi.schema import TABLES, tables_to_compact, unique_index
+from nubodhi.service import UserDataService, open_database
+
+USERS = [f'u{i}' for i in range(30)]
+
+
+def mood(level):
+    return {'mood': level, 'energy': 6, 'sleep_hours': 7.5, 'sleep_quality': 8}
+
+
+# A database as old versions left it: no unique index on mood_log, and three
+# rows for every user's first of May
+@pytest.fixture
+def legacy_path(tmp_path):
+    path = str(tmp_path / 'app.db')
+    open_database(path).close()
+    db = Database(path)
+    table = TABLES['mood_log']
+    with db.transaction() as conn:
+        conn.execute(f"DROP INDEX {unique_index(table)}")
+        conn.execute("CREATE INDEX idx_mood_log_user_date ON mood_log (user_id, date)")
+        conn.executemany("INSERT INTO mood_log (user_id, date, mood) VALUES (?, '2024-05-01', ?)",
+                         [(user_id, level) for level in (1, 2, 3) for user_id in USERS])
+    db.close()
+    return path
+
+
+def moods(db, user_id):
+    with db.connection() as conn:
+        return conn.execute("SELECT date, mood FROM mood_log WHERE user_id = ? ORDER BY date, id",
+                            (user_id,)).fetchall()
+
+
+def test_opening_leaves_compaction_pending(legacy_path):
+    db = open_database(legacy_path)
+    assert db.compacting == {'mood_log'}
+    service = UserDataService(db, HistoryCache())
+    service.save('u1', 'mood_log', '2024-05-01', mood(9))
+    service.save('u1', 'mood_log', '2024-05-02', mood(4))
+    assert moods(db, 'u1') == [('2024-05-01', 9), ('2024-05-02', 4)]
+    db.close()
+
+
+def test_saves_during_compaction(legacy_path):
+    db = open_database(legacy_path)
+    service = UserDataService(db, HistoryCache())
+
+    def save_midway(table, stats):
+        if stats['batches'] == 2:
+            service.save('u0', 'mood_log', '2024-05-01', mood(9))
+            service.save('u29', 'mood_log', '2024-05-01', mood(8))
+
+    with db.connection() as conn:
+        stats = compact(conn, batch_rows=10, progress=save_midway)
+        assert stats['batches'] > 2
+        assert tables_to_compact(conn) == []
+    assert moods(db, 'u0') == [('2024-05-01', 9)]
+    assert moods(db, 'u29') == [('2024-05-01', 8)]
+    # Last row wins for everyone else
+    assert moods(db, 'u5') == [('2024-05-01', 3)]
+    db.close()
+
+
+def test_background_compaction_goes_back_to_upserts(legacy_path):
+    db = open_database(legacy_path)
+    service = UserDataService(db, HistoryCache())
+    compact_in_background(db, batch_rows=10, pause=0).join()
+    assert db.compacting == frozenset()
+    service.save('u1', 'mood_log', '2024-05-01', mood(9))
+    assert moods(db, 'u1') == [('2024-05-01', 9)]
+    assert compact_in_background(db) is None
+    db.close()
@@ -0,0 +1,76 @@
+import threading
+
+import pytest
+
+from nubodhi.db import Database
+from nubodhi.schema import init_schema
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = Database(str(tmp_path / 'app.db'))
+    with db.connection() as conn:
+        init_schema(conn)
+    yield db
+    db.close()
+
+
+def count(db):
+    with db.connection() as conn:
+        return conn.execute("SELECT count(*) FROM mood_log").fetchone()[0]
+
+
+def insert(conn, date):
+    conn.execute("INSERT INTO mood_log (user_id, date, mood) VALUES ('u1', ?, 5)", (date,))
+
+
+def test_connections_use_wal_and_are_reused(db):
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+        with db.connection() as inner:
+            assert inner is conn
+    with db.connection() as again:
+        assert again is conn
+
+
+def test_nested_transaction_rolls_back_to_its_savepoint(db):
+    committed = []
+    with db.transaction() as conn:
+        insert(conn, '2024-05-01')
+        db.on_commit(lambda: committed.append('outer'))
+        with pytest.raises(ValueError):
+            with db.transaction() as inner:
+                insert(inner, '2024-05-02')
+                db.on_commit(lambda: committed.append('inner'))
+                raise ValueError
+        assert committed == []
+    assert count(db) == 1
+    assert committed == ['outer']
+
+
+def test_failed_transaction_commits_nothing(db):
+    with pytest.raises(ValueError):
+        with db.transaction() as conn:
+            insert(conn, '2024-05-01')
+            raise ValueError
+    assert count(db) == 0
+
+
+def test_snapshot_does_not_see_later_commits(db):
+    started, written = threading.Event(), threading.Event()
+
+    def write():
+        started.wait()
+        with db.transaction() as conn:
+            insert(conn, '2024-05-01')
+        written.set()
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    with db.snapshot() as conn:
+        before = conn.execute("SELECT count(*) FROM mood_log").fetchone()[0]
+        started.set()
+        written.wait(5)
+        assert conn.execute("SELECT count(*) FROM mood_log").fetchone()[0] == before == 0
+    thread.join()
+    assert count(db) == 1
@@ -0,0 +1,49 @@
+import pytest
+
+from nubodhi.gallery import date_order, entry_dates, entry_for_date, filter_positions, paginate
+from nubodhi.history import History
+
+
+def photos(date, **views):
+    return {'date': date, 'photos': {view: views.get(view) for view in ('front', 'side', 'back', 'outfit')}}
+
+
+@pytest.fixture
+def entries():
+    history = History('progress_photos', 'u1')
+    for day in range(1, 31):
+        history.append(photos(f'2024-04-{day:02d}', front=f'front-{day}.jpg'))
+    # A backfilled day, and a second save on the 10th with another view
+    history.append(photos('2024-03-31', front='front-0.jpg'))
+    history.append(photos('2024-04-10', side='side-10.jpg'))
+    return history
+
+
+def test_pages_build_only_their_entries(entries, monkeypatch):
+    order = date_order(entries)
+    built = []
+    entry = History._entry
+    monkeypatch.setattr(History, '_entry', lambda self, i: built.append(i) or entry(self, i))
+
+    selected = filter_positions(order, '2024-04-01', '2024-04-30')
+    visible, pages = paginate(selected, 2, 5)
+    page = [entries[i] for i in visible]
+    assert pages == 7
+    assert [entry['date'] for entry in page] == ['2024-04-25', '2024-04-24', '2024-04-23', '2024-04-22',
+                                                 '2024-04-21']
+    assert len(built) == 5
+
+
+def test_dates_newest_first(entries):
+    order = date_order(entries)
+    assert order[0][0] == '2024-04-30'
+    assert order[-1][0] == '2024-03-31'
+    dates = entry_dates(order)
+    assert len(dates) == 31
+    assert dates == sorted(dates, reverse=True)
+
+
+def test_same_day_saves_merge(entries):
+    entry = entry_for_date(entries, date_order(entries), '2024-04-10')
+    assert entry['photos'] == {'front': 'front-10.jpg', 'side': 'side-10.jpg'}
+    assert entry_for_date(entries, date_order(entries), '2024-05-01') is None
@@ -0,0 +1,50 @@
+from fractions import Fraction
+
+import pytest
+
+from nubodhi.grocery import GroceryPlanner, ShoppingItem, aggregate, format_quantity, parse_ingredient, to_csv
+from nubodhi.meals import meal_plans
+
+
+@pytest.mark.parametrize('text, quantity, unit, item', [
+    ("1 cup chickpea flour", 1, 'cup', 'chickpea flour'),
+    ("200g paneer", 200, 'g', 'paneer'),
+    ("1/2 tsp turmeric", Fraction(1, 2), 'tsp', 'turmeric'),
+    ("2 garlic cloves", 2, 'cloves', 'garlic'),
+    ("3 medium tomatoes (chopped)", 3, None, 'tomato'),
+    ("1.5 l water", Fraction(3, 2), 'l', 'water'),
+])
+def test_parse_ingredient(text, quantity, unit, item):
+    (ingredient,) = parse_ingredient(text)
+    assert (ingredient.quantity, ingredient.unit, ingredient.item) == (quantity, unit, item)
+    assert not ingredient.leftover and not ingredient.to_taste
+
+
+def test_parse_to_taste_and_leftovers():
+    assert [(ingredient.item, ingredient.to_taste) for ingredient in parse_ingredient("Salt, pepper to taste")] == \
+        [('salt', True), ('pepper', True)]
+    (leftover,) = parse_ingredient("Leftover dal")
+    assert leftover.leftover and leftover.item == 'dal'
+
+
+def test_aggregate_adds_up_one_item():
+    items, leftovers = aggregate(["1 cup rice", "2 tbsp rice", "100g paneer", "1 kg paneer", "Salt to taste",
+                                  "Salt", "2 cups water", "Leftover rice"])
+    assert items == (ShoppingItem('paneer', 1100, 'mass', 2), ShoppingItem('rice', 270, 'volume', 2),
+                     ShoppingItem('salt', None, None, 2))
+    assert leftovers == ('rice',)
+    assert [format_quantity(item) for item in items] == ['1.1 kg', '1 cup', 'to taste']
+    assert to_csv(items).splitlines()[1] == 'paneer,1.1 kg,2'
+
+
+def test_planner_memoizes_day_ranges():
+    planner = GroceryPlanner(meal_plans())
+    days = list(meal_plans()['Vegetarian'])
+    week = planner.shopping_list('Vegetarian')
+    assert planner.shopping_list('Vegetarian', days[0], days[-1]) is week
+    monday = planner.shopping_list('Vegetarian', days[0], days[0])
+    assert planner.shopping_list('Vegetarian', days[0], days[0]) is monday
+    # A week uses at least as much of everything as one day of it
+    totals = {(item.item, item.dimension): item for item in week[0]}
+    for item in monday[0]:
+        assert totals[item.item, item.dimension].meals >= item.meals
@@ -0,0 +1,71 @@
+import copy
+import math
+import tracemalloc
+
+from nubodhi.history import History
+from nubodhi.schema import CHECKLIST_ITEMS
+
+
+def checklist(date, done=True, mood=5):
+    return {'date': date, 'items': {item: done for item in CHECKLIST_ITEMS}, 'mood': mood, 'energy': 5,
+            'sleep_hours': 7.5, 'sleep_quality': 5, 'arms': 30, 'chest': 95, 'waist': 80, 'hips': 98,
+            'thighs': 55, 'calves': 36}
+
+
+def test_entries_come_back_as_saved():
+    history = History('daily_checklist', 'u1')
+    entries = [checklist('2024-05-01'), checklist('2024-05-02', done=False, mood=8)]
+    history.extend(entries)
+    assert list(history) == entries
+    assert history[-1] == entries[-1]
+    assert history[:1] == entries[:1]
+
+
+def test_missing_values_stay_missing():
+    history = History('mood_log', 'u1')
+    history.append({'date': '2024-05-01', 'mood': 6, 'energy': None, 'sleep_hours': 7.5, 'sleep_quality': 5})
+    assert history[0]['energy'] is None
+    assert math.isnan(history.column(('energy',))[0])
+    assert history.column(('mood',))[0] == 6
+
+
+def test_daily_rows_replace_the_day_and_keep_date_order():
+    history = History('mood_log', 'u1')
+    for date, mood in (('2024-05-03', 3), ('2024-05-01', 1), ('2024-05-03', 9)):
+        history.append({'date': date, 'mood': mood, 'energy': 5, 'sleep_hours': 7.0, 'sleep_quality': 5})
+    assert [(entry['date'], entry['mood']) for entry in history] == [('2024-05-01', 1), ('2024-05-03', 9)]
+    history.add_row('2024-05-02', [2, 5, 7.0, 5])
+    assert history.dates() == ['2024-05-01', '2024-05-02', '2024-05-03']
+
+
+def test_copies_share_columns_until_one_adds_a_row():
+    history = History('mood_log', 'u1', [('2024-05-01', [5, 5, 7.0, 5])])
+    copy = history.copy()
+    assert copy.column(('mood',)) is history.column(('mood',))
+    copy.append_row('2024-05-02', [6, 5, 7.0, 5])
+    assert (len(history), len(copy)) == (1, 2)
+    history.append_row('2024-05-03', [7, 5, 7.0, 5])
+    assert history.dates() == ['2024-05-01', '2024-05-03']
+
+
+def test_values_that_do_not_fit_are_kept_as_is():
+    history = History('mood_log', 'u1', [('2024-05-01', [5, 5, 7.0, 5])])
+    history.append_row('May 2nd', ['great', 5, 7.0, 5])
+    assert history.dates() == ['2024-05-01', 'May 2nd']
+    assert history.ordinals() is None
+    assert [entry['mood'] for entry in history] == [5, 'great']
+
+
+def test_a_year_is_much_smaller_than_the_dicts():
+    entries = [checklist(f'2024-{1 + day // 28:02d}-{1 + day % 28:02d}') for day in range(336)]
+    tracemalloc.start()
+    history = History('daily_checklist', 'u1')
+    history.extend(entries)
+    columnar = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    tracemalloc.start()
+    dicts = copy.deepcopy(entries)
+    as_dicts = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    assert len(history) == len(dicts)
+    assert columnar * 4 < as_dicts
@@ -0,0 +1,56 @@
+import json
+import threading
+
+from nubodhi.cache import HistoryCache
+from nubodhi.instrument import Recorder
+from nubodhi.service import UserDataService, open_database
+from nubodhi.writebehind import WriteBehindQueue
+
+MOOD = {'mood': 7, 'energy': 6, 'sleep_hours': 7.5, 'sleep_quality': 8}
+
+
+def log_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_write_behind_commits_are_timed(tmp_path):
+    db = open_database(str(tmp_path / 'app.db'))
+    recorder = Recorder()
+    write_queue = WriteBehindQueue(db, recorder=recorder)
+    service = UserDataService(db, HistoryCache(), write_queue, recorder)
+    service.save('u1', 'mood_log', '2024-05-01', MOOD).wait(5)
+    write_queue.close()
+    summaries = recorder.summaries()
+    assert summaries['save_seconds'][0]['mode'] == 'queued'
+    assert summaries['commit_seconds'][0]['count'] == 1
+    assert summaries['commit_rows'][0]['sum'] == 1
+    statements = {summary['statement'] for summary in summaries['sql_seconds']}
+    assert 'insert:mood_log' in statements
+    db.close()
+
+
+def test_close_logs_every_event_recorded_before_it(tmp_path):
+    path = tmp_path / 'metrics.jsonl'
+    recorder = Recorder(log_path=str(path))
+    started = threading.Barrier(5)
+
+    def record(worker):
+        started.wait()
+        for number in range(500):
+            recorder.record({'name': 'test', 'worker': worker, 'number': number})
+
+    threads = [threading.Thread(target=record, args=(worker,)) for worker in range(4)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    for thread in threads:
+        thread.join()
+    recorder.close()
+    assert len(log_lines(path)) == 2000
+
+    # Later events are kept for the debug panel but no longer logged
+    recorder.record({'name': 'late'})
+    recorder.close()
+    assert recorder.events(1)[0]['name'] == 'late'
+    assert len(log_lines(path)) == 2000
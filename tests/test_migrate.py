@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+
+from nubodhi.cache import HistoryCache
+from nubodhi.migrate import migrate_legacy_rows, needs_migration
+from nubodhi.schema import init_schema
+from nubodhi.service import UserDataService, open_database
+
+
+def mood(date, level):
+    return {'date': date, 'mood': level, 'energy': 6, 'sleep_hours': 7.5, 'sleep_quality': 8}
+
+
+# A database as the original app wrote it: one table, str(value) payloads
+@pytest.fixture
+def legacy_path(tmp_path):
+    path = str(tmp_path / 'app.db')
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE user_data (user_id TEXT, data_type TEXT, date TEXT, value TEXT)")
+    rows = [('u1', 'mood_log', f'2024-05-{day:02d}', str(mood(f'2024-05-{day:02d}', day))) for day in range(1, 8)]
+    rows.append(('u1', 'personal_info', '2024-05-01',
+                 str({'user_id': 'u1', 'name': 'Ana', 'age': 40, 'gender': 'Female', 'height': 165, 'weight': 70,
+                      'activity': 'Sedentary (little or no exercise)'})))
+    conn.executemany("INSERT INTO user_data VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def test_open_database_moves_legacy_rows_to_typed_tables(legacy_path):
+    db = open_database(legacy_path)
+    profile = UserDataService(db, HistoryCache()).profile('u1')
+    assert [entry['mood'] for entry in profile['mood_log']] == list(range(1, 8))
+    assert profile['personal_info'][-1]['weight'] == 70
+    with db.connection() as conn:
+        assert conn.execute("SELECT count(*) FROM user_data").fetchone()[0] == 0
+        assert conn.execute("SELECT count(*) FROM mood_log").fetchone()[0] == 7
+        assert not needs_migration(conn)
+    db.close()
+
+
+def test_interrupted_migration_resumes(legacy_path):
+    conn = sqlite3.connect(legacy_path, isolation_level=None)
+    init_schema(conn)
+
+    def stop(stats):
+        raise KeyboardInterrupt
+
+    with pytest.raises(KeyboardInterrupt):
+        migrate_legacy_rows(conn, batch_size=3, progress=stop)
+    # The first batch is committed, and gone from user_data
+    assert conn.execute("SELECT count(*) FROM mood_log").fetchone()[0] == 3
+    assert conn.execute("SELECT count(*) FROM user_data").fetchone()[0] == 5
+
+    stats = migrate_legacy_rows(conn, batch_size=3)
+    assert stats['migrated'] == 5
+    assert conn.execute("SELECT count(*) FROM mood_log").fetchone()[0] == 7
+    assert conn.execute("SELECT count(*) FROM personal_info").fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,80 @@
+from datetime import datetime
+
+import pytest
+
+from nubodhi.backends import open_backend
+from nubodhi.reminders import GRACE, ReminderScheduler, SessionInbox, client_state, complete_snack, enroll_client
+
+MORNING = datetime(2024, 5, 1, 6, 0).timestamp()
+EVENING = datetime(2024, 5, 1, 22, 0).timestamp()
+
+
+@pytest.fixture(params=['file', 'sharded'])
+def db(request, tmp_path):
+    db = open_backend(str(tmp_path / 'app.db') if request.param == 'file' else f"sharded:{tmp_path / 'data'}")
+    yield db
+    db.close()
+
+
+# Run a scheduler until its first reminder for u1 goes out; returns the time
+def first_reminder(scheduler, now=MORNING):
+    while now < EVENING:
+        now += 60
+        if any(reminder.user_id == 'u1' for reminder in scheduler.run_due(now)):
+            return now
+    raise AssertionError("no reminder sent")
+
+
+def test_every_session_takes_the_reminder_once(db):
+    scheduler = ReminderScheduler(db)
+    scheduler.enroll(['u1', 'u2'], now=MORNING)
+    sent = first_reminder(scheduler)
+    inbox = SessionInbox(db)
+    assert inbox.take('u1', 'first', sent).user_id == 'u1'
+    assert inbox.take('u1', 'first', sent) is None
+    # Another server process has its own inbox
+    assert SessionInbox(db).take('u1', 'second', sent).user_id == 'u1'
+    assert inbox.take('u1', 'third', sent + GRACE + 1) is None
+
+
+def test_completed_snack_clears_the_reminder(db):
+    scheduler = ReminderScheduler(db)
+    scheduler.enroll(['u1'], now=MORNING)
+    sent = first_reminder(scheduler)
+    inbox = SessionInbox(db)
+    inbox.take('u1', 'first', sent)
+    assert complete_snack(db, 'u1', now=sent + 60)['completed_today'] == 1
+    assert inbox.take('u1', 'second', sent + 60) is None
+
+
+def test_scheduler_save_keeps_completions_from_other_processes(db):
+    scheduler = ReminderScheduler(db)
+    scheduler.enroll(['u1'], now=MORNING)
+    complete_snack(db, 'u1', now=MORNING + 60)
+    complete_snack(db, 'u1', now=MORNING + 120)
+    # The scheduler has not seen them yet, and saves its state over the row
+    first_reminder(scheduler, MORNING + 120)
+    assert client_state(db, 'u1', MORNING + 3600)['completed_today'] == 2
+    scheduler.load(now=MORNING + 3600)
+    assert scheduler.state('u1', MORNING + 3600)['completed_today'] == 2
+
+
+def test_scheduler_picks_up_clients_enrolled_elsewhere(db):
+    scheduler = ReminderScheduler(db)
+    scheduler.load(now=MORNING)
+    assert enroll_client(db, 'u1', now=MORNING)['completed_today'] == 0
+    scheduler.load(now=MORNING)
+    assert scheduler.user_ids() == ['u1']
+    first_reminder(scheduler)
+
+
+def test_scheduler_stops_at_the_target_completed_elsewhere(db):
+    scheduler = ReminderScheduler(db, target_daily=2)
+    scheduler.enroll(['u1'], now=MORNING)
+    for minute in (1, 2):
+        complete_snack(db, 'u1', now=MORNING + minute * 60)
+    scheduler.load(now=MORNING + 180)
+    now = MORNING + 180
+    while now < EVENING:
+        now += 60
+        assert not scheduler.run_due(now)
@@ -0,0 +1,56 @@
+import random
+
+import pytest
+
+from nubodhi.cache import HistoryCache
+from nubodhi.rollups import load_rollups, rebuild_rollups
+from nubodhi.service import UserDataService, open_database
+
+DATES = [f'2024-{month:02d}-{day:02d}' for month in (1, 2) for day in (1, 5, 9, 14, 28)]
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = UserDataService(open_database(str(tmp_path / 'app.db')), HistoryCache())
+    yield service
+    service.db.close()
+
+
+def rollup_rows(db):
+    with db.connection() as conn:
+        return conn.execute("SELECT user_id, metric, period, period_start, count, total, min, max, last, last_date "
+                            "FROM rollups ORDER BY 1, 2, 3, 4").fetchall()
+
+
+# Saves in random order, with days saved again: mood_log is daily (a re-save
+# replaces the day), biophotonic_scan and blood_work keep every reading
+def test_incremental_rollups_equal_a_rebuild(service):
+    rng = random.Random(7)
+    for _ in range(60):
+        date = rng.choice(DATES)
+        user_id = rng.choice(['u1', 'u2'])
+        service.save(user_id, 'mood_log', date, {'mood': rng.randint(1, 10), 'energy': rng.randint(1, 10),
+                                                 'sleep_hours': rng.choice([6.5, 7.0, 8.25]), 'sleep_quality': 5})
+        service.save(user_id, 'biophotonic_scan', date, rng.choice([0, 40, 52]))
+        service.save(user_id, 'blood_work', date, {'metrics': {'blood_sugar': rng.uniform(4, 6), 'hemoglobin': 14.0,
+                                                               'blood_pressure': '120/80'}})
+    incremental = rollup_rows(service.db)
+    with service.db.transaction() as conn:
+        conn.execute("DELETE FROM rollups")
+        rebuild_rollups(conn)
+    rebuilt = rollup_rows(service.db)
+    assert len(incremental) == len(rebuilt)
+    for row, other in zip(incremental, rebuilt):
+        assert row[:5] == other[:5]
+        assert row[5:] == pytest.approx(other[5:])
+
+
+def test_daily_resave_replaces_the_reading(service):
+    for mood in (2, 8):
+        service.save('u1', 'mood_log', '2024-01-01', {'mood': mood, 'energy': 5, 'sleep_hours': 7.0,
+                                                     'sleep_quality': 5})
+    service.save('u1', 'mood_log', '2024-01-03', {'mood': 6, 'energy': 5, 'sleep_hours': 7.0, 'sleep_quality': 5})
+    with service.db.connection() as conn:
+        (week,) = load_rollups(conn, 'u1', 'mood', 'week')
+    assert week['period_start'] == '2024-01-01'
+    assert (week['count'], week['mean'], week['min'], week['max'], week['last']) == (2, 7, 6, 8, 6)
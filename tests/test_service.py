@@ -0,0 +1,53 @@
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+from nubodhi.cache import HistoryCache
+from nubodhi.service import UserDataService, default_user_data, history_size, open_database, user_data_from_profile
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TODAY = '2024-05-02'
+MOOD = {'mood': 7, 'energy': 6, 'sleep_hours': 7.5, 'sleep_quality': 8}
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = UserDataService(open_database(str(tmp_path / 'app.db')), HistoryCache())
+    yield service
+    service.db.close()
+
+
+def test_package_imports_without_streamlit_or_side_effects(tmp_path):
+    code = ("import sys, nubodhi.api, nubodhi.service, nubodhi.meals, nubodhi.cohort, nubodhi.transfer; "
+            "print('streamlit' in sys.modules, nubodhi.meals.meal_plans.cache_info().currsize)")
+    env = dict(os.environ, PYTHONPATH=REPO)
+    output = subprocess.run([sys.executable, '-c', code], cwd=tmp_path, env=env, capture_output=True, text=True,
+                            check=True).stdout
+    assert output.split() == ['False', '0']
+    assert os.listdir(tmp_path) == []
+
+
+def test_user_data_from_saved_profile(service):
+    service.save('u1', 'personal_info', '2024-05-01',
+                 {'user_id': 'u1', 'name': 'Ana', 'age': 40, 'gender': 'Female', 'height': 165, 'weight': 70,
+                  'activity': 'Sedentary (little or no exercise)'})
+    service.save('u1', 'mood_log', '2024-05-01', MOOD)
+    service.save('u1', 'daily_checklist', TODAY, {'date': TODAY, 'items': {'exercise_snack': True}, **MOOD})
+    user_data = default_user_data(TODAY)
+    user_data.update(user_data_from_profile('u1', service.profile('u1'), TODAY))
+    assert (user_data['name'], user_data['weight']) == ('Ana', 70)
+    assert user_data['weight_history'] == [('2024-05-01', 70)]
+    assert user_data['daily_checklist']['items']['exercise_snack'] is True
+    assert user_data['exercise_reminders']['target_daily'] == 4
+    assert history_size(user_data) == 2
+
+
+def test_save_many_stores_all_or_nothing(service):
+    with pytest.raises(sqlite3.ProgrammingError):
+        service.save_many('u1', [('mood_log', '2024-05-01', MOOD), ('mood_log', '2024-05-02', {'mood': object()})])
+    assert service.load('u1', 'mood_log') == []
+    service.save_many('u1', [('mood_log', '2024-05-01', MOOD), ('mood_log', '2024-05-02', MOOD)])
+    assert [date for date, _ in service.load('u1', 'mood_log')] == ['2024-05-01', '2024-05-02']
@@ -0,0 +1,42 @@
+import sqlite3
+
+import pytest
+
+from nubodhi.schema import TABLES, init_schema
+from nubodhi.storage import load_profile, load_values, save_value
+
+MOOD = {'mood': 7, 'energy': 6, 'sleep_hours': 7.5, 'sleep_quality': 8}
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:', isolation_level=None)
+    init_schema(conn)
+    save_value(conn, 'u1', 'personal_info', '2024-05-01',
+               {'user_id': 'u1', 'name': 'Ana', 'age': 40, 'gender': 'Female', 'height': 165, 'weight': 70,
+                'activity': 'Sedentary (little or no exercise)'})
+    for day in (3, 1, 2):
+        save_value(conn, 'u1', 'mood_log', f'2024-05-0{day}', {'date': f'2024-05-0{day}', **MOOD, 'mood': day})
+    save_value(conn, 'u1', 'biophotonic_scan', '2024-05-02', 41)
+    save_value(conn, 'u1', 'biophotonic_scan', '2024-05-02', 44)
+    save_value(conn, 'u2', 'mood_log', '2024-05-01', {'date': '2024-05-01', **MOOD})
+    yield conn
+    conn.close()
+
+
+def test_profile_is_one_query(conn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    load_profile(conn, 'u1')
+    assert len(statements) == 1
+
+
+def test_profile_matches_per_type_loads(conn):
+    profile = load_profile(conn, 'u1')
+    assert set(profile) == set(TABLES)
+    for data_type, history in profile.items():
+        assert history.dates() == [date for date, _ in load_values(conn, 'u1', data_type)]
+    assert [entry['mood'] for entry in profile['mood_log']] == [1, 2, 3]
+    assert profile['personal_info'][0]['weight'] == 70
+    assert [entry['score'] for entry in profile['biophotonic_scan']] == [41, 44]
+    assert len(profile['daily_checklist']) == 0
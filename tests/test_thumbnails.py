@@ -0,0 +1,51 @@
+import io
+
+import pytest
+from PIL import Image
+
+from nubodhi.cache import HistoryCache
+from nubodhi.service import UserDataService, open_database
+from nubodhi.thumbnails import SIZES, backfill, derivative_for, render_derivatives
+from nubodhi.uploads import content_hash, store_upload
+
+
+def jpeg(width, height, orientation=None):
+    image = Image.new('RGB', (width, height), (200, 120, 80))
+    exif = Image.Exif()
+    if orientation:
+        exif[0x0112] = orientation
+    data = io.BytesIO()
+    image.save(data, 'JPEG', exif=exif)
+    data.seek(0)
+    return data
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = UserDataService(open_database(str(tmp_path / 'app.db')), HistoryCache())
+    yield service
+    service.db.close()
+
+
+def test_derivatives_fit_their_size_upright(service, tmp_path):
+    root = str(tmp_path / 'uploads')
+    # Stored landscape, shown portrait (EXIF: rotate 90 degrees)
+    path = store_upload(service.db, jpeg(1600, 1200, orientation=6), 'front.jpg', root=root)
+    assert derivative_for(path, 'thumb', root) is None
+    targets = render_derivatives(path, content_hash(path), root)
+    for size, target in targets.items():
+        assert derivative_for(path, size, root) == target
+        with Image.open(target) as image:
+            assert image.size == (SIZES[size] * 3 // 4, SIZES[size])
+
+
+def test_backfill_renders_what_is_missing(service, tmp_path):
+    root = str(tmp_path / 'uploads')
+    front = store_upload(service.db, jpeg(900, 1200), 'front.jpg', root=root)
+    side = store_upload(service.db, jpeg(900, 1200, orientation=3), 'side.jpg', root=root)
+    render_derivatives(front, content_hash(front), root)
+    service.save('u1', 'progress_photos', '2024-05-01',
+                 {'date': '2024-05-01', 'photos': {'front': front, 'side': side, 'back': root + '/gone.jpg'}})
+    stats = backfill(service.db, root=root, max_workers=1)
+    assert stats == {'rendered': 1, 'up_to_date': 1, 'missing': 1, 'failed': 0}
+    assert derivative_for(side, 'medium', root) is not None
@@ -0,0 +1,58 @@
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from nubodhi.history import History
+from nubodhi.timeseries import chart_frame, lttb, metric_series
+
+START = date(2023, 1, 1)
+
+
+def mood_history(days):
+    history = History('mood_log', 'u1')
+    for day in range(days):
+        level = 9 if day == days // 3 else 1 if day == 2 * days // 3 else 5
+        history.append({'date': (START + timedelta(days=day)).isoformat(), 'mood': level, 'energy': 5,
+                        'sleep_hours': 7.0, 'sleep_quality': 5})
+    return history
+
+
+def test_lttb_keeps_the_ends_and_the_extremes():
+    x = np.arange(1000)
+    y = np.sin(x / 50)
+    y[400], y[700] = 10, -10
+    keep = lttb(x, y, 50)
+    assert len(keep) == 50
+    assert keep[0] == 0 and keep[-1] == 999
+    assert 400 in keep and 700 in keep
+    assert np.all(np.diff(keep) > 0)
+
+
+def test_short_series_are_left_alone():
+    assert list(lttb(np.arange(10), np.arange(10), 50)) == list(range(10))
+
+
+def test_columnar_and_dict_histories_give_the_same_series():
+    history = mood_history(30)
+    columnar = metric_series(history, 'mood')
+    from_dicts = metric_series(list(history), 'mood')
+    assert columnar.equals(from_dicts)
+    assert len(columnar) == 30
+
+
+def test_chart_frame_fits_the_point_budget():
+    frame = chart_frame(mood_history(2000), 'mood', rolling_days=7, max_points=200)
+    assert len(frame) == 200
+    assert frame.index[0] == pd.Timestamp(START)
+    assert frame.index[-1] == pd.Timestamp(START + timedelta(days=1999))
+    assert frame['Mood (1-10)'].max() == 9 and frame['Mood (1-10)'].min() == 1
+    assert '7-day average' in frame
+
+
+def test_weekly_resampling_averages():
+    frame = chart_frame(mood_history(28), 'mood', freq='Week')
+    assert len(frame) == 5
+    # The week of Monday 9 January holds the 9 among six 5s
+    assert frame.loc['2023-01-15', 'Mood (1-10)'] == pytest.approx((6 * 5 + 9) / 7)
@@ -0,0 +1,12 @@
+import json
+
+from benchmarks.bench_checkin import CHECK_IN, main
+
+
+# Runs the real app: every check-in input is staged in its form and the
+# save button submits them in one script run
+def test_daily_check_in_is_one_script_run(capsys):
+    main(['--days', '20', '--json'])
+    results = json.loads(capsys.readouterr().out)
+    assert results['saved']
+    assert results['reruns'] == 1 < len(CHECK_IN)
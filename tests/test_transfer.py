@@ -0,0 +1,101 @@
+import csv
+import threading
+
+import pytest
+
+from nubodhi.backends import open_backend
+from nubodhi.cache import HistoryCache
+from nubodhi.service import UserDataService, open_database
+from nubodhi.transfer import TransferError, import_records, main
+
+USERS = [f'u{i}' for i in range(40)]
+
+
+@pytest.fixture
+def spec(tmp_path):
+    return f"sharded:{tmp_path / 'data'}?shards=3"
+
+
+def mood(user_id, date='2024-05-01'):
+    return {'user_id': user_id, 'date': date, 'mood': 7, 'energy': 6}
+
+
+def rows_by_shard(db):
+    counts = []
+    for store in db.stores():
+        with store.connection() as conn:
+            counts.append(conn.execute("SELECT count(*) FROM mood_log").fetchone()[0])
+    return counts
+
+
+def test_import_registers_users_on_their_shards(spec):
+    db = open_backend(spec)
+    stats = import_records(db, 'mood_log', [mood(user_id) for user_id in USERS], chunk_size=7)
+    assert stats['imported'] == len(USERS)
+    with db.connection() as conn:
+        registered = dict(conn.execute("SELECT user_id, shard FROM user_shards"))
+    assert sorted(registered) == sorted(USERS)
+    for user_id, shard in registered.items():
+        with db.stores()[shard].connection() as conn:
+            assert conn.execute("SELECT count(*) FROM mood_log WHERE user_id = ?", (user_id,)).fetchone()[0] == 1
+    assert sum(rows_by_shard(db)) == len(USERS)
+    db.close()
+
+
+def test_invalid_row_keeps_committed_chunks(spec):
+    db = open_backend(spec)
+    with pytest.raises(TransferError) as error:
+        import_records(db, 'mood_log', [mood(user_id) for user_id in USERS] + [mood('bad', 'never')], chunk_size=7)
+    assert error.value.stats['imported'] == 35
+    assert sum(rows_by_shard(db)) == 35
+    db.close()
+
+
+def test_atomic_import_aborts_every_shard(spec):
+    db = open_backend(spec)
+    with pytest.raises(TransferError):
+        import_records(db, 'mood_log', [mood(user_id) for user_id in USERS] + [mood('bad', 'never')], chunk_size=7,
+                       atomic=True)
+    assert rows_by_shard(db) == [0, 0, 0]
+    db.close()
+
+
+def test_app_saves_while_an_import_runs(tmp_path):
+    db = open_database(str(tmp_path / 'app.db'))
+    service = UserDataService(db, HistoryCache())
+    errors = []
+
+    def save():
+        try:
+            service.save('app-user', 'mood_log', '2024-05-02', {'mood': 5, 'energy': 5})
+        except Exception as e:
+            errors.append(e)
+
+    # Saves from another thread halfway through, as the app would
+    def records():
+        for number, user_id in enumerate(USERS):
+            if number == 20:
+                thread = threading.Thread(target=save)
+                thread.start()
+                thread.join()
+            yield mood(user_id)
+
+    import_records(db, 'mood_log', records(), chunk_size=7)
+    assert errors == []
+    with db.connection() as conn:
+        assert conn.execute("SELECT count(*) FROM mood_log").fetchone()[0] == len(USERS) + 1
+    db.close()
+
+
+def test_cohort_export_reads_members_from_main(spec, tmp_path):
+    db = open_backend(spec)
+    import_records(db, 'mood_log', [mood(user_id) for user_id in USERS])
+    with db.transaction() as conn:
+        conn.executemany("INSERT INTO cohort_members (cohort, user_id) VALUES ('spring', ?)",
+                         [(user_id,) for user_id in USERS[::4]])
+    db.close()
+    out = tmp_path / 'spring.csv'
+    main(['--db', spec, 'export', '--data-type', 'mood_log', '--cohort', 'spring', '--out', str(out)])
+    with open(out, newline='') as f:
+        exported = sorted(row['user_id'] for row in csv.DictReader(f))
+    assert exported == sorted(USERS[::4])
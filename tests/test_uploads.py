@@ -0,0 +1,60 @@
+import io
+import os
+
+import pytest
+
+from nubodhi.cache import HistoryCache
+from nubodhi.service import UserDataService, open_database
+from nubodhi.uploads import collect_garbage, content_hash, store_upload
+
+
+@pytest.fixture
+def service(tmp_path):
+    service = UserDataService(open_database(str(tmp_path / 'app.db')), HistoryCache())
+    yield service
+    service.db.close()
+
+
+def uploads_rows(db):
+    with db.connection() as conn:
+        return conn.execute("SELECT path, size FROM uploads ORDER BY path").fetchall()
+
+
+def test_identical_content_is_stored_once(service, tmp_path):
+    root = str(tmp_path / 'uploads')
+    first = store_upload(service.db, io.BytesIO(b'front photo'), 'Front.JPG', root=root)
+    second = store_upload(service.db, io.BytesIO(b'front photo'), 'copy.jpg', root=root)
+    other = store_upload(service.db, io.BytesIO(b'side photo'), 'side.jpg', root=root)
+    assert first == second != other
+    sha256 = content_hash(first)
+    assert first == os.path.join(root, sha256[:2], sha256[2:4], sha256 + '.jpg')
+    assert uploads_rows(service.db) == sorted([(first, 11), (other, 10)])
+    assert os.listdir(os.path.join(root, 'tmp')) == []
+
+
+def test_gc_removes_only_unreferenced_files(service, tmp_path):
+    root = str(tmp_path / 'uploads')
+    kept = store_upload(service.db, io.BytesIO(b'kept'), 'kept.jpg', root=root)
+    dropped = store_upload(service.db, io.BytesIO(b'dropped'), 'dropped.jpg', root=root)
+    service.save('u1', 'progress_photos', '2024-05-01', {'date': '2024-05-01', 'photos': {'front': kept}})
+    # Left by the old app directly under uploads/
+    legacy = os.path.join(root, 'old_photo.jpg')
+    with open(legacy, 'wb') as f:
+        f.write(b'legacy')
+
+    stats = collect_garbage(service.db, root=root, grace_seconds=0, dry_run=True)
+    assert stats['removed'] == 1
+    assert os.path.exists(dropped)
+
+    stats = collect_garbage(service.db, root=root, grace_seconds=0)
+    assert stats['removed'] == 1
+    assert not os.path.exists(dropped)
+    assert os.path.exists(kept) and os.path.exists(legacy)
+    assert [path for path, _ in uploads_rows(service.db)] == [kept]
+
+
+def test_gc_spares_recent_files(service, tmp_path):
+    root = str(tmp_path / 'uploads')
+    path = store_upload(service.db, io.BytesIO(b'being saved'), 'new.jpg', root=root)
+    assert collect_garbage(service.db, root=root)['removed'] == 0
+    assert os.path.exists(path)
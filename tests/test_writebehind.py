@@ -0,0 +1,76 @@
+import sqlite3
+import time
+
+import pytest
+
+from nubodhi.service import open_database
+from nubodhi.writebehind import WriteBehindQueue, WriteQueueFull
+
+MOOD = {'mood': 7, 'energy': 6, 'sleep_hours': 7.5, 'sleep_quality': 8}
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = open_database(str(tmp_path / 'app.db'))
+    yield db
+    db.close()
+
+
+def count(db):
+    with db.connection() as conn:
+        return conn.execute("SELECT count(*) FROM mood_log").fetchone()[0]
+
+
+def test_writes_are_grouped_into_batches(db):
+    write_queue = WriteBehindQueue(db, max_rows=50, max_delay_ms=200)
+    tickets = [write_queue.submit(f'u{i}', 'mood_log', '2024-05-01', MOOD) for i in range(100)]
+    assert write_queue.flush(5)
+    assert all(ticket.done for ticket in tickets)
+    assert count(db) == 100
+    stats = write_queue.stats()
+    assert stats['written'] == 100
+    assert stats['batches'] <= 4
+    write_queue.close()
+
+
+def test_failed_batch_reaches_the_ticket(db):
+    with db.transaction() as conn:
+        conn.execute("CREATE TRIGGER refuse BEFORE INSERT ON mood_log WHEN NEW.user_id = 'bad' "
+                     "BEGIN SELECT RAISE(ABORT, 'refused'); END")
+    write_queue = WriteBehindQueue(db)
+    committed = []
+    ticket = write_queue.submit('bad', 'mood_log', '2024-05-01', MOOD)
+    ticket.on_commit(lambda: committed.append('bad'))
+    with pytest.raises(sqlite3.IntegrityError):
+        ticket.wait(5)
+    assert committed == []
+    assert write_queue.submit('good', 'mood_log', '2024-05-01', MOOD).wait(5)
+    assert write_queue.stats()['failed'] == 1
+    write_queue.close()
+
+
+def test_submit_many_commits_together(db):
+    write_queue = WriteBehindQueue(db)
+    ticket = write_queue.submit_many('u1', [('mood_log', f'2024-05-0{day}', MOOD) for day in range(1, 6)])
+    assert ticket.wait(5)
+    assert count(db) == 5
+    write_queue.close()
+
+
+def test_full_queue_raises_and_close_drains(db, tmp_path):
+    write_queue = WriteBehindQueue(db, max_rows=1, max_pending=2, put_timeout=0.05)
+    # Hold the write lock so the writer thread stalls on its first batch
+    blocker = sqlite3.connect(str(tmp_path / 'app.db'), isolation_level=None)
+    blocker.execute("BEGIN IMMEDIATE")
+    tickets = [write_queue.submit('u1', 'mood_log', '2024-05-01', MOOD)]
+    time.sleep(0.1)
+    tickets += [write_queue.submit(f'u{i}', 'mood_log', '2024-05-01', MOOD) for i in (2, 3)]
+    with pytest.raises(WriteQueueFull):
+        write_queue.submit('u4', 'mood_log', '2024-05-01', MOOD)
+    blocker.rollback()
+    blocker.close()
+    write_queue.close()
+    assert all(ticket.wait(0) for ticket in tickets)
+    assert count(db) == 3
+    with pytest.raises(RuntimeError):
+        write_queue.submit('u5', 'mood_log', '2024-05-01', MOOD)